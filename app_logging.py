@@ -0,0 +1,199 @@
+import contextvars
+import hashlib
+import json
+import logging
+import os
+import queue
+import random
+import re
+import sys
+import threading
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+# 日誌：呼叫端只把紀錄放進佇列，由背景執行緒格式化並寫到 stdout，不在請求裡做 I/O。
+#   - 每筆紀錄帶 request_id（contextvars），同一個 webhook 在 worker 裡的紀錄也能串起來
+#   - LOG_FORMAT=json 輸出一行一個 JSON，text 方便本機閱讀
+#   - 寫出前遮蔽 LINE 權杖、Bearer token 與使用者 ID（換成固定的短雜湊，仍可追蹤同一人）
+#   - webhook 內容只在 DEBUG 且依 LOG_BODY_SAMPLE_RATE 抽樣時才記錄
+# 佇列滿時直接丟棄並計數，不讓日誌拖慢請求。
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+LOG_BODY_SAMPLE_RATE = float(os.getenv("LOG_BODY_SAMPLE_RATE", "0"))
+LOG_REDACT_USER_IDS = os.getenv("LOG_REDACT_USER_IDS", "1") == "1"
+
+USER_ID_PATTERN = re.compile(r"\b[UCR][0-9a-f]{32}\b")
+BEARER_PATTERN = re.compile(r"Bearer\s+[A-Za-z0-9+/=._-]+")
+
+request_id_var = contextvars.ContextVar("request_id", default="-")
+
+# LogRecord 本身的欄位，其餘的（logger.info(..., extra={...})）會輸出成 JSON 欄位
+_RECORD_FIELDS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "request_id"}
+
+
+def new_request_id(request_id=None):
+    """設定目前請求的 correlation ID（沒有給就產生一個）並回傳"""
+    request_id = request_id or uuid.uuid4().hex[:16]
+    request_id_var.set(request_id)
+    return request_id
+
+
+def get_request_id():
+    return request_id_var.get()
+
+
+@contextmanager
+def request_context(request_id):
+    """在背景執行緒（例如重試）裡沿用原本請求的 ID"""
+    token = request_id_var.set(request_id)
+    try:
+        yield
+    finally:
+        request_id_var.reset(token)
+
+
+class Redactor:
+    def __init__(self, secrets=(), redact_user_ids=LOG_REDACT_USER_IDS):
+        # 太短的值（例如測試用的假權杖）會把一般文字也遮掉，不列入
+        self.secrets = [secret for secret in secrets if secret and len(secret) >= 8]
+        self.redact_user_ids = redact_user_ids
+
+    @staticmethod
+    def _hash_user_id(match):
+        return "user:" + hashlib.sha256(match.group(0).encode("utf-8")).hexdigest()[:10]
+
+    def __call__(self, text):
+        for secret in self.secrets:
+            if secret in text:
+                text = text.replace(secret, "[REDACTED]")
+        if "Bearer" in text:
+            text = BEARER_PATTERN.sub("Bearer [REDACTED]", text)
+        if self.redact_user_ids:
+            text = USER_ID_PATTERN.sub(self._hash_user_id, text)
+        return text
+
+
+class JsonFormatter(logging.Formatter):
+    def __init__(self, redactor):
+        super().__init__()
+        self.redactor = redactor
+
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "request_id": getattr(record, "request_id", "-"),
+            "thread": record.threadName,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_FIELDS:
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exception"] = record.exc_text
+        return self.redactor(json.dumps(entry, ensure_ascii=False, default=str))
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self, redactor):
+        super().__init__("%(asctime)s %(levelname)s [%(request_id)s] %(name)s: %(message)s")
+        self.redactor = redactor
+
+    def format(self, record):
+        return self.redactor(super().format(record))
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """把紀錄放進有上限的佇列；滿了就丟棄，fork 之後自動重新啟動背景寫入的執行緒"""
+
+    def __init__(self, log_queue, target):
+        super().__init__(log_queue)
+        self.target = target
+        self.dropped = 0
+        self._listener = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._listener = QueueListener(self.queue, self.target, respect_handler_level=True)
+            self._listener.start()
+            self._pid = os.getpid()
+
+    def stop(self):
+        with self._lock:
+            if self._listener is not None and self._pid == os.getpid():
+                self._listener.stop()
+            self._pid = None
+
+    def prepare(self, record):
+        # 在呼叫端記下 request_id；訊息的格式化與遮蔽留給背景執行緒
+        record.request_id = request_id_var.get()
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        if self._pid != os.getpid():
+            self.start()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+_handler = None
+
+
+def setup_logging(level=LOG_LEVEL, log_format=LOG_FORMAT, secrets=(), stream=None):
+    """設定 root logger，可以重複呼叫（只會設定一次）"""
+    global _handler
+    if _handler is not None:
+        return _handler
+    secrets = list(secrets) + [os.getenv("LINE_CHANNEL_ACCESS_TOKEN"), os.getenv("LINE_CHANNEL_SECRET")]
+    redactor = Redactor(secrets)
+    target = logging.StreamHandler(stream or sys.stdout)
+    target.setFormatter(JsonFormatter(redactor) if log_format == "json" else TextFormatter(redactor))
+    _handler = NonBlockingQueueHandler(queue.Queue(LOG_QUEUE_SIZE), target)
+    _handler.start()
+    root = logging.getLogger()
+    root.handlers = [_handler]
+    root.setLevel(level)
+    # werkzeug 每個請求都記一行 access log，交給前面的 proxy 記錄
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    return _handler
+
+
+def shutdown_logging():
+    """把佇列裡的紀錄寫完"""
+    if _handler is not None:
+        _handler.stop()
+
+
+def log_body(logger, message, body, sample_rate=None):
+    """DEBUG 開啟時依抽樣比例記錄完整的 webhook 內容；沒開 DEBUG 幾乎沒有成本"""
+    if not logger.isEnabledFor(logging.DEBUG):
+        return
+    rate = LOG_BODY_SAMPLE_RATE if sample_rate is None else sample_rate
+    if rate >= 1 or (rate > 0 and random.random() < rate):
+        if isinstance(body, bytes):
+            body = body.decode("utf-8", "replace")
+        logger.debug(message, body)
+
+
+def stats():
+    return {"dropped": _handler.dropped if _handler else 0,
+            "queued": _handler.queue.qsize() if _handler else 0}
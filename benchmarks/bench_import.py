@@ -0,0 +1,73 @@
+"""量測 `import main` 的冷啟動時間（每次都開新的 Python process）
+
+用法：
+    python benchmarks/bench_import.py --runs 10
+    python benchmarks/bench_import.py --budget-ms 800   # 中位數超過預算時以狀態碼 1 結束，可放進 CI
+    python benchmarks/bench_import.py --top 15          # 列出 import 最久的模組（python -X importtime）
+
+沒有設定 LINE_CHANNEL_ACCESS_TOKEN / LINE_CHANNEL_SECRET 時會填入假的值，import 本身不應該連線。
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+TIMED_IMPORT = "import time; t = time.perf_counter(); import main; print((time.perf_counter() - t) * 1000)"
+
+
+def child_env():
+    env = dict(os.environ)
+    env.setdefault("LINE_CHANNEL_ACCESS_TOKEN", "bench-token")
+    env.setdefault("LINE_CHANNEL_SECRET", "bench-secret")
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [ROOT, env.get("PYTHONPATH")]))
+    return env
+
+
+def time_import(env):
+    output = subprocess.run([sys.executable, "-c", TIMED_IMPORT], cwd=ROOT, env=env,
+                            capture_output=True, text=True, check=True).stdout
+    return float(output.strip().splitlines()[-1])
+
+
+def slowest_modules(env, top):
+    stderr = subprocess.run([sys.executable, "-X", "importtime", "-c", "import main"], cwd=ROOT, env=env,
+                            capture_output=True, text=True, check=True).stderr
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        # "import time:  self [us] | cumulative | imported package"
+        self_us, cumulative_us, name = [part.strip() for part in line.split(":", 1)[1].split("|")]
+        if self_us.isdigit():
+            rows.append((int(cumulative_us), int(self_us), name))
+    return sorted(rows, reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget-ms", type=float, help="中位數的上限（毫秒）")
+    parser.add_argument("--top", type=int, default=0, help="列出累計時間最長的幾個模組")
+    args = parser.parse_args()
+
+    env = child_env()
+    samples = [time_import(env) for _ in range(args.runs)]
+    median = statistics.median(samples)
+    print(f"import main: median {median:.1f} ms, min {min(samples):.1f} ms, max {max(samples):.1f} ms "
+          f"({args.runs} runs)")
+
+    if args.top:
+        print(f"{'cumulative ms':>14}{'self ms':>10}  module")
+        for cumulative_us, self_us, name in slowest_modules(env, args.top):
+            print(f"{cumulative_us / 1000:>14.1f}{self_us / 1000:>10.1f}  {name}")
+
+    if args.budget_ms is not None and median > args.budget_ms:
+        print(f"❌ Import time {median:.1f} ms exceeds budget {args.budget_ms:.0f} ms")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""量測 glucose_parser 的吞吐量（語音辨識與手動輸入常見的句子）
+
+用法：
+    python benchmarks/bench_parser.py
+    python benchmarks/bench_parser.py --iterations 2000 --show
+    python benchmarks/bench_parser.py --corpus utterances.txt   # 一行一句
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import glucose_parser  # noqa: E402
+
+# 會記錄的句子與不該記錄的一般訊息（大部分訊息不是紀錄，排除得快也很重要）
+CORPUS = [
+    "早餐後 135",
+    "早餐後135",
+    "血糖一百二",
+    "血糖 一百二十五",
+    "血糖兩百",
+    "空腹 98",
+    "空腹血糖九十八",
+    "睡前 一百四十",
+    "睡前１２０",
+    "午餐前 102 mg/dL",
+    "晚餐后一百六",
+    "飯後兩小時 180",
+    "餐後2小時 一百七十五",
+    "早上7點 空腹 95",
+    "早上七點半 血糖 一百零五",
+    "7:30 空腹 98 mg/dL",
+    "１２：３０ 午餐後 １４５",
+    "中午12點 血糖 130",
+    "下午三點十五分 血糖 180",
+    "晚上八點半 飯後 兩百",
+    "晚上十點 睡前 一二五",
+    "凌晨兩點 血糖 65",
+    "早上8點 135",
+    "晚上八點 一百五",
+    "起床 88",
+    "剛剛量血糖 142",
+    "今天早餐後血糖是一百五十",
+    "血糖 110 毫克",
+    "血糖紀錄",
+    "個人報表",
+    "語音轉文字",
+    "你好",
+    "謝謝",
+    "今天天氣很好",
+    "我想看上禮拜的報表",
+    "血糖高一點怎麼辦",
+    "三點要回診",
+    "明天早上八點抽血",
+    "135",
+    "好",
+    "收到，謝謝你的提醒！",
+    "早餐吃了兩片吐司和一杯牛奶",
+    "晚餐後散步 30 分鐘",
+    "我下午3點吃藥 血壓 130",
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=1000, help="整個語料重複幾次")
+    parser.add_argument("--corpus", help="語料檔，一行一句")
+    parser.add_argument("--show", action="store_true", help="列出每一句的解析結果")
+    args = parser.parse_args()
+
+    corpus = CORPUS
+    if args.corpus:
+        with open(args.corpus, encoding="utf-8") as f:
+            corpus = [line.strip() for line in f if line.strip()]
+
+    results = [glucose_parser.parse_entry(text) for text in corpus]
+    if args.show:
+        for text, entry in zip(corpus, results):
+            print(f"{text:<24}\t{entry}")
+        print()
+
+    parse = glucose_parser.parse_entry
+    start = time.perf_counter()
+    for _ in range(args.iterations):
+        for text in corpus:
+            parse(text)
+    elapsed = time.perf_counter() - start
+    calls = args.iterations * len(corpus)
+
+    matched = sum(entry is not None for entry in results)
+    print(f"{len(corpus)} utterances, {matched} parsed as readings")
+    print(f"{calls / elapsed:,.0f} parses/s, {elapsed / calls * 1e6:.2f} us/parse")
+
+    # 分開量測記錄與非記錄的句子
+    for label, subset in (("readings", [t for t, e in zip(corpus, results) if e is not None]),
+                          ("other", [t for t, e in zip(corpus, results) if e is None])):
+        if not subset:
+            continue
+        start = time.perf_counter()
+        for _ in range(args.iterations):
+            for text in subset:
+                parse(text)
+        elapsed = time.perf_counter() - start
+        print(f"  {label:<9}{elapsed / (args.iterations * len(subset)) * 1e6:>8.2f} us/parse")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""量測路由表的分派成本（handler 為空函式，只算路由本身）
+
+用法：
+    python benchmarks/bench_router.py --iterations 200000
+    python benchmarks/bench_router.py --route postback:edit_record
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import router  # noqa: E402
+from session_state import EDITING_BLOODSUGAR, SessionState  # noqa: E402
+
+# (路由名稱, 事件種類, 內容)
+CASES = [
+    ("command:血糖紀錄", "message", "血糖紀錄"),
+    ("state:editing_bloodsugar", "message", "120"),
+    ("default", "message", "你好"),
+    ("postback:add_blood_sugar", "postback", "action=add_blood_sugar"),
+    ("postback:edit_record", "postback", "action=edit_record&index=3"),
+    ("postback:report_last_week", "postback", "action=report_last_week"),
+]
+
+
+def build_router(extra_commands):
+    r = router.Router()
+
+    def noop(*args):
+        pass
+
+    r.command("血糖紀錄", *[f"指令{i}" for i in range(extra_commands)])(noop)
+    r.state(EDITING_BLOODSUGAR)(noop)
+    r.postback("add_blood_sugar", "edit_record", "report_last_week")(noop)
+    r.default(noop)
+    return r
+
+
+def legacy_chain(data):
+    # 舊的 if-chain 寫法，作為對照
+    import re
+    if data == "action=select_date":
+        return "select_date"
+    if data == "action=add_blood_sugar":
+        return "add_blood_sugar"
+    if data in ["action=edit_blood_sugar", "action=delete_blood_sugar"]:
+        return "edit_or_delete"
+    if data.startswith("action=edit_record"):
+        return int(re.search(r"index=(\d+)", data).group(1))
+    if data.startswith("action=delete_record"):
+        return int(re.search(r"index=(\d+)", data).group(1))
+    if data == "action=report_today":
+        return "report_today"
+    if data in ["action=report_last_week", "action=report_select_date"]:
+        return "report_range"
+    return None
+
+
+def bench(func, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    return (time.perf_counter() - start) / iterations * 1e9
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=100000)
+    parser.add_argument("--extra-commands", type=int, default=100, help="額外註冊的指令數，確認分派成本不隨之增加")
+    parser.add_argument("--route", help="只量測這條路由")
+    args = parser.parse_args()
+
+    r = build_router(args.extra_commands)
+    state = SessionState(EDITING_BLOODSUGAR, date="2026-01-01", index=0)
+    print(f"{'route':<28}{'ns/op':>10}")
+    for name, kind, payload in CASES:
+        if args.route and args.route != name:
+            continue
+        if kind == "message":
+            call = lambda: r.dispatch_message(None, "U0", payload, state)  # noqa: E731
+        else:
+            call = lambda: r.dispatch_postback(None, "U0", payload)  # noqa: E731
+        print(f"{name:<28}{bench(call, args.iterations):>10.0f}")
+    if not args.route:
+        print(f"{'legacy if-chain edit_record':<28}"
+              f"{bench(lambda: legacy_chain('action=edit_record&index=3'), args.iterations):>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""比較 webhook 簽名驗證與解析的成本：舊流程（兩次 HMAC）與 webhook_parser（一次完成）
+
+用法：
+    python benchmarks/bench_signature.py
+    python benchmarks/bench_signature.py --events 1 10 100 500 --iterations 200
+"""
+import argparse
+import base64
+import hashlib
+import hmac
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from linebot import WebhookHandler  # noqa: E402
+
+from webhook_parser import WebhookParser  # noqa: E402
+
+SECRET = "0123456789abcdef0123456789abcdef"
+
+
+def make_payload(count):
+    events = []
+    for i in range(count):
+        event = {
+            "type": "message" if i % 2 == 0 else "postback",
+            "mode": "active",
+            "timestamp": 1700000000000 + i,
+            "source": {"type": "user", "userId": f"U{i:032x}"},
+            "replyToken": f"{i:032x}",
+            "webhookEventId": f"01H{i:023d}",
+            "deliveryContext": {"isRedelivery": False},
+        }
+        if i % 2 == 0:
+            event["message"] = {"type": "text", "id": str(i), "text": "血糖 一百二十 飯後"}
+        else:
+            event["postback"] = {"data": f"action=edit_record&index={i % 10}"}
+        events.append(event)
+    body = json.dumps({"destination": "U" + "0" * 32, "events": events}, ensure_ascii=False).encode("utf-8")
+    signature = base64.b64encode(hmac.new(SECRET.encode("utf-8"), body, hashlib.sha256).digest()).decode("utf-8")
+    return body, signature
+
+
+def legacy(handler, body, signature):
+    # 舊的 callback：轉成字串、手動算一次 HMAC 用 != 比對，再交給 WebhookHandler 驗證並解析
+    text = body.decode("utf-8")
+    digest = hmac.new(SECRET.encode("utf-8"), text.encode("utf-8"), hashlib.sha256).digest()
+    if signature != base64.b64encode(digest).decode("utf-8"):
+        raise ValueError("signature mismatch")
+    return handler.parser.parse(text, signature)
+
+
+def bench(func, iterations):
+    func()  # 暖身
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    return (time.perf_counter() - start) / iterations
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--events", type=int, nargs="+", default=[1, 10, 100, 500])
+    parser.add_argument("--iterations", type=int, default=200)
+    args = parser.parse_args()
+
+    handler = WebhookHandler(SECRET)
+    webhook_parser = WebhookParser(SECRET)
+    print(f"{'events':>7}{'bytes':>10}{'legacy us':>12}{'single us':>12}{'verify us':>12}{'speedup':>9}")
+    for count in args.events:
+        body, signature = make_payload(count)
+        assert len(webhook_parser.parse(body, signature)) == len(legacy(handler, body, signature)) == count
+        old = bench(lambda: legacy(handler, body, signature), args.iterations)
+        new = bench(lambda: webhook_parser.parse(body, signature), args.iterations)
+        verify = bench(lambda: webhook_parser.verify(body, signature), args.iterations)
+        print(f"{count:>7}{len(body):>10}{old * 1e6:>12.1f}{new * 1e6:>12.1f}{verify * 1e6:>12.1f}{old / new:>8.2f}x")
+
+
+if __name__ == "__main__":
+    main()
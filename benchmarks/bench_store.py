@@ -0,0 +1,85 @@
+"""比較血糖紀錄儲存後端在多個寫入者同時寫入時的表現
+
+用法：
+    python benchmarks/bench_store.py --writers 8 --writes 200
+    python benchmarks/bench_store.py --include-legacy   # 會寫入正式的 legacy 後端，請小心使用
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import blood_sugar_store  # noqa: E402
+
+
+def percentile(samples, pct):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * pct / 100))]
+
+
+def run(store, writers, writes, date_str):
+    latencies = {"write": [], "read_day": [], "read_range": []}
+    lock = threading.Lock()
+    start_barrier = threading.Barrier(writers)
+
+    def worker(n):
+        user_id = f"Ubench{n:04d}"
+        local = {key: [] for key in latencies}
+        start_barrier.wait()
+        for i in range(writes):
+            t = time.perf_counter()
+            store.record(user_id, 80 + i % 150)
+            local["write"].append(time.perf_counter() - t)
+            if i % 10 == 0:
+                t = time.perf_counter()
+                store.get_by_date(user_id, date_str)
+                local["read_day"].append(time.perf_counter() - t)
+                if store.supports_range:
+                    t = time.perf_counter()
+                    store.get_by_range(user_id, "2020-01-01", date_str)
+                    local["read_range"].append(time.perf_counter() - t)
+        with lock:
+            for key, samples in local.items():
+                latencies[key].extend(samples)
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(writers)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    print(f"\n== {store.name} ({writers} writers x {writes} writes) ==")
+    print(f"writes/s: {writers * writes / elapsed:,.0f}")
+    for key, samples in latencies.items():
+        if samples:
+            print(f"{key:>10}: p50 {statistics.median(samples) * 1000:.2f} ms, "
+                  f"p95 {percentile(samples, 95) * 1000:.2f} ms, "
+                  f"p99 {percentile(samples, 99) * 1000:.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--writers", type=int, default=8)
+    parser.add_argument("--writes", type=int, default=200)
+    parser.add_argument("--pool-size", type=int, default=blood_sugar_store.BLOOD_SUGAR_DB_POOL_SIZE)
+    parser.add_argument("--include-legacy", action="store_true")
+    args = parser.parse_args()
+
+    date_str = datetime.now(blood_sugar_store.TZ).strftime("%Y-%m-%d")
+    with tempfile.TemporaryDirectory() as tmp:
+        store = blood_sugar_store.SQLiteStore(os.path.join(tmp, "bench.db"), pool_size=args.pool_size)
+        run(store, args.writers, args.writes, date_str)
+    if args.include_legacy:
+        run(blood_sugar_store.LegacyStore(), args.writers, args.writes, date_str)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,369 @@
+"""對 /callback 重播簽名過的 webhook，量測吞吐量與各路由的 p50/p95/p99
+
+用法：
+    python benchmarks/loadtest.py --concurrency 16 --duration 30
+    python benchmarks/loadtest.py --target http://127.0.0.1:10000 --secret "$LINE_CHANNEL_SECRET"
+    python benchmarks/loadtest.py --compare benchmarks/results/loadtest-20250101-120000-abc1234.json \\
+        --max-regression 20
+
+沒有 --target 時會在子 process 裡自己啟動待測的服務：
+    - LINE API 換成 line_stub_server（LINE_API_ENDPOINT）
+    - blood_sugar 換成 benchmarks/stubs/blood_sugar.py（繪圖、上傳不連網路）
+    - 紀錄存在暫存的 SQLite（BLOOD_SUGAR_BACKEND=sqlite），並預先寫入 --seed-days 天的資料
+結果寫到 benchmarks/results/，--compare 會和之前的結果逐路由比較 p95。
+"""
+import argparse
+import base64
+import hashlib
+import hmac
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import requests
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH_DIR)
+STUBS_DIR = os.path.join(BENCH_DIR, "stubs")
+RESULTS_DIR = os.path.join(BENCH_DIR, "results")
+
+DEFAULT_SECRET = "loadtest-channel-secret"
+
+
+def user_ids(count):
+    return [f"U{hashlib.md5(f'loadtest-{i}'.encode()).hexdigest()}" for i in range(count)]
+
+
+# ---------------------------------------------------------------- 產生 webhook
+
+def message_event(user_id, text):
+    return _event(user_id, "message", {"message": {"type": "text", "id": _random_id(), "text": text}})
+
+
+def postback_event(user_id, data, params=None):
+    postback = {"data": data}
+    if params:
+        postback["params"] = params
+    return _event(user_id, "postback", {"postback": postback})
+
+
+def _random_id():
+    return "%018d" % random.randrange(10 ** 18)
+
+
+def _event(user_id, kind, fields):
+    event = {
+        "type": kind,
+        "mode": "active",
+        "timestamp": int(time.time() * 1000),
+        "source": {"type": "user", "userId": user_id},
+        "replyToken": os.urandom(16).hex(),
+        "webhookEventId": os.urandom(13).hex().upper(),
+        "deliveryContext": {"isRedelivery": False},
+    }
+    event.update(fields)
+    return event
+
+
+def sign(secret, events):
+    body = json.dumps({"destination": "U" + "0" * 32, "events": events}, ensure_ascii=False).encode("utf-8")
+    signature = base64.b64encode(hmac.new(secret.encode("utf-8"), body, hashlib.sha256).digest()).decode("utf-8")
+    return body, signature
+
+
+def _days_ago(days):
+    return (datetime.now() - timedelta(days=days)).strftime("%Y-%m-%d")
+
+
+# 每個情境回傳 [(路由名稱, 事件列表), ...]，同一情境的請求依序送出（例如「新增」→ 輸入數值）
+SCENARIOS = {
+    "today_records": (20, lambda u: [("command:血糖紀錄", [message_event(u, "血糖紀錄")])]),
+    "report_menu": (5, lambda u: [("command:個人報表", [message_event(u, "個人報表")])]),
+    "help": (5, lambda u: [("default", [message_event(u, "你好")])]),
+    "select_date": (5, lambda u: [("postback:select_date", [
+        postback_event(u, "action=select_date", {"date": _days_ago(random.randrange(7))})])]),
+    "add_reading": (20, lambda u: [
+        ("postback:add_blood_sugar", [postback_event(u, "action=add_blood_sugar")]),
+        ("state:waiting_for_bloodsugar", [message_event(u, str(random.randint(60, 250)))]),
+    ]),
+    # 語音／手動輸入一次完成的紀錄
+    "one_shot_reading": (10, lambda u: [("pattern:glucose_entry", [
+        message_event(u, f"{random.choice(['早餐後', '空腹', '睡前', '血糖'])} {random.randint(60, 250)}")])]),
+    "edit_reading": (8, lambda u: [
+        ("postback:edit_blood_sugar", [postback_event(u, "action=edit_blood_sugar")]),
+        ("postback:edit_record", [postback_event(u, "action=edit_record&index=0")]),
+        ("state:editing_bloodsugar", [message_event(u, str(random.randint(60, 250)))]),
+    ]),
+    "delete_reading": (4, lambda u: [
+        ("postback:delete_blood_sugar", [postback_event(u, "action=delete_blood_sugar")]),
+        ("postback:delete_record", [postback_event(u, "action=delete_record&index=0")]),
+    ]),
+    "report_today": (10, lambda u: [("postback:report_today", [postback_event(u, "action=report_today")])]),
+    "report_last_week": (8, lambda u: [("postback:report_last_week", [postback_event(u, "action=report_last_week")])]),
+    "report_range": (5, lambda u: [("postback:report_select_date", [
+        postback_event(u, "action=report_select_date", {"date": _days_ago(random.randrange(7, 90))})])]),
+    # LINE 會把短時間內的多個事件合併成一個 webhook
+    "batch": (10, lambda u: [("batch:5", [
+        message_event(u, "血糖紀錄"),
+        postback_event(u, "action=report_last_week"),
+        message_event(u, "個人報表"),
+        postback_event(u, "action=select_date", {"date": _days_ago(1)}),
+        message_event(u, "你好"),
+    ])]),
+}
+
+
+# ---------------------------------------------------------------- 待測服務
+
+def serve(args):
+    """子 process：啟動 LINE 替身、寫入種子資料、用多執行緒的 WSGI server 執行 main.app"""
+    sys.path[:0] = [STUBS_DIR, ROOT]
+    from line_stub_server import StubLineServer
+    stub = StubLineServer(delay=args.line_delay).start()
+    os.environ["LINE_API_ENDPOINT"] = stub.endpoint  # 必須在 import main（line_client）之前設定
+
+    import blood_sugar_store
+    store = blood_sugar_store.SQLiteStore(os.environ["BLOOD_SUGAR_DB"])
+    now = datetime.now(blood_sugar_store.TZ)
+    for user_id in user_ids(args.users):
+        for day in range(args.seed_days):
+            for hour in (7, 12, 18, 22):
+                recorded_at = (now - timedelta(days=day)).replace(hour=hour, minute=0, second=0)
+                store.record(user_id, random.randint(60, 250), recorded_at.strftime("%Y-%m-%d %H:%M:%S"))
+
+    from werkzeug.serving import make_server
+    import main
+    server = make_server("127.0.0.1", args.port, main.app, threaded=True)
+    server.serve_forever()
+
+
+def start_server(args):
+    port = args.port or _free_port()
+    workdir = tempfile.mkdtemp(prefix="loadtest_")
+    env = dict(os.environ)
+    env.update({
+        "PYTHONPATH": os.pathsep.join([STUBS_DIR, ROOT]),
+        "LINE_CHANNEL_ACCESS_TOKEN": "loadtest-access-token",
+        "LINE_CHANNEL_SECRET": args.secret,
+        "BLOOD_SUGAR_BACKEND": "sqlite",
+        "BLOOD_SUGAR_DB": os.path.join(workdir, "blood_sugar.db"),
+        "CHART_CACHE_DIR": os.path.join(workdir, "charts"),
+        "LOG_LEVEL": env.get("LOG_LEVEL", "WARNING"),
+    })
+    command = [sys.executable, os.path.abspath(__file__), "--serve", "--port", str(port),
+               "--users", str(args.users), "--seed-days", str(args.seed_days), "--line-delay", str(args.line_delay)]
+    process = subprocess.Popen(command, env=env, cwd=workdir)
+    target = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise SystemExit(f"❌ Server exited with code {process.returncode}")
+        try:
+            if requests.get(f"{target}/health/live", timeout=1).ok:
+                return process, target
+        except requests.ConnectionError:
+            pass
+        time.sleep(0.2)
+    process.kill()
+    raise SystemExit("❌ Server did not start within 60s")
+
+
+def _free_port():
+    import socket
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+# ---------------------------------------------------------------- 壓測
+
+def run_load(target, secret, concurrency, duration, warmup, users):
+    names = list(SCENARIOS)
+    weights = [SCENARIOS[name][0] for name in names]
+    samples = []  # (路由, 秒, HTTP 狀態)
+    lock = threading.Lock()
+    start = time.monotonic()
+    measure_from = start + warmup
+    deadline = measure_from + duration
+
+    def worker(n):
+        session = requests.Session()
+        rng = random.Random(n)
+        local = []
+        while time.monotonic() < deadline:
+            scenario = SCENARIOS[rng.choices(names, weights)[0]][1]
+            for route, events in scenario(rng.choice(users)):
+                body, signature = sign(secret, events)
+                t = time.perf_counter()
+                try:
+                    status = session.post(f"{target}/callback", data=body, timeout=30, headers={
+                        "Content-Type": "application/json", "X-Line-Signature": signature}).status_code
+                except requests.RequestException:
+                    status = 0
+                elapsed = time.perf_counter() - t
+                if time.monotonic() >= measure_from:
+                    local.append((route, elapsed, status))
+        with lock:
+            samples.extend(local)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(worker, range(concurrency)))
+    return samples, time.monotonic() - measure_from
+
+
+def percentile(sorted_samples, pct):
+    return sorted_samples[min(len(sorted_samples) - 1, int(len(sorted_samples) * pct / 100))]
+
+
+def summarize(samples, elapsed):
+    by_route = {}
+    for route, seconds, status in samples:
+        by_route.setdefault(route, []).append((seconds, status))
+    routes = {}
+    for route, rows in sorted(by_route.items()):
+        latencies = sorted(seconds for seconds, _ in rows)
+        routes[route] = {
+            "count": len(rows),
+            "errors": sum(status != 200 for _, status in rows),
+            "rps": round(len(rows) / elapsed, 2),
+            "mean_ms": round(statistics.fmean(latencies) * 1000, 2),
+            "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+            "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+            "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+            "max_ms": round(latencies[-1] * 1000, 2),
+        }
+    latencies = sorted(seconds for _, seconds, _ in samples) or [0]
+    return {
+        "requests": len(samples),
+        "errors": sum(status != 200 for _, _, status in samples),
+        "elapsed_s": round(elapsed, 2),
+        "throughput_rps": round(len(samples) / elapsed, 2),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "routes": routes,
+    }
+
+
+def server_stats(target):
+    stats = {}
+    for name, path in (("routes", "/health/routes"), ("queue", "/health/queue")):
+        try:
+            stats[name] = requests.get(f"{target}{path}", timeout=5).json()
+        except (requests.RequestException, ValueError):
+            stats[name] = None
+    return stats
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def print_report(result, baseline=None):
+    print(f"\n{result['requests']} requests in {result['elapsed_s']}s: {result['throughput_rps']} req/s, "
+          f"{result['errors']} errors, p50 {result['p50_ms']} ms, p95 {result['p95_ms']} ms, p99 {result['p99_ms']} ms")
+    header = f"{'route':<32}{'count':>7}{'err':>5}{'rps':>8}{'p50':>9}{'p95':>9}{'p99':>9}"
+    if baseline:
+        header += f"{'base p95':>10}{'Δ p95':>9}"
+    print(header)
+    for route, stats in result["routes"].items():
+        line = (f"{route:<32}{stats['count']:>7}{stats['errors']:>5}{stats['rps']:>8}"
+                f"{stats['p50_ms']:>9}{stats['p95_ms']:>9}{stats['p99_ms']:>9}")
+        base = (baseline or {}).get("routes", {}).get(route)
+        if base:
+            line += f"{base['p95_ms']:>10}{_change(base['p95_ms'], stats['p95_ms']):>9}"
+        print(line)
+
+
+def _change(before, after):
+    return f"{(after - before) / before * 100:+.0f}%" if before else "n/a"
+
+
+def regressions(result, baseline, max_regression):
+    """p95 比基準慢超過 max_regression% 的路由"""
+    found = []
+    for route, stats in result["routes"].items():
+        base = baseline.get("routes", {}).get(route)
+        if base and base["p95_ms"] and (stats["p95_ms"] - base["p95_ms"]) / base["p95_ms"] * 100 > max_regression:
+            found.append(route)
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0],
+                                     formatter_class=argparse.RawDescriptionHelpFormatter, epilog=__doc__)
+    parser.add_argument("--target", help="已經在執行的服務網址；沒有給就自己啟動一個")
+    parser.add_argument("--secret", default=os.getenv("LINE_CHANNEL_SECRET", DEFAULT_SECRET), help="簽名用的 channel secret")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=20, help="量測秒數")
+    parser.add_argument("--warmup", type=float, default=3, help="不列入統計的暖身秒數")
+    parser.add_argument("--users", type=int, default=200, help="模擬的使用者數")
+    parser.add_argument("--seed-days", type=int, default=30, help="每個使用者預先寫入幾天的紀錄")
+    parser.add_argument("--line-delay", type=float, default=0.0, help="LINE API 替身每個請求的延遲（秒）")
+    parser.add_argument("--port", type=int, default=0)
+    parser.add_argument("--label", default="", help="寫進結果檔，方便辨識這次的設定")
+    parser.add_argument("--output", help="結果 JSON 的路徑（預設放在 benchmarks/results/）")
+    parser.add_argument("--compare", help="與之前的結果 JSON 比較")
+    parser.add_argument("--max-regression", type=float, help="任何路由的 p95 比 --compare 慢超過這個百分比時以狀態碼 1 結束")
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args)
+        return
+
+    process = None
+    target = args.target
+    if not target:
+        process, target = start_server(args)
+    try:
+        samples, elapsed = run_load(target, args.secret, args.concurrency, args.duration, args.warmup,
+                                    user_ids(args.users))
+        result = summarize(samples, elapsed)
+        result["server"] = server_stats(target)
+    finally:
+        if process:
+            process.terminate()
+            process.wait(10)
+
+    revision = git_revision()
+    result.update({
+        "label": args.label,
+        "git": revision,
+        "started_at": datetime.now().isoformat(timespec="seconds"),
+        "config": dict({key: getattr(args, key) for key in ("concurrency", "duration", "warmup", "users", "seed_days",
+                                                            "line_delay")}, target=args.target or "local"),
+    })
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"loadtest-{datetime.now():%Y%m%d-%H%M%S}-{revision}.json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+    print_report(result, baseline)
+    print(f"\n✅ Results written to {output}")
+
+    if baseline and args.max_regression is not None:
+        slower = regressions(result, baseline, args.max_regression)
+        if slower:
+            raise SystemExit(f"❌ p95 regressed by more than {args.max_regression}%: {', '.join(slower)}")
+
+
+if __name__ == "__main__":
+    main()
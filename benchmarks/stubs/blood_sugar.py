@@ -0,0 +1,70 @@
+"""壓測用的 blood_sugar 替身（benchmarks/loadtest.py 會把這個目錄放在 PYTHONPATH 最前面）
+
+紀錄放在記憶體；圖表寫出固定的 1x1 PNG；上傳不連網路，只回傳假的網址。
+CHART_DELAY / UPLOAD_DELAY（秒）可以模擬繪圖與上傳的耗時。
+"""
+import base64
+import os
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+import pytz
+
+TZ = pytz.timezone("Asia/Taipei")
+CHART_DELAY = float(os.getenv("STUB_CHART_DELAY", "0"))
+UPLOAD_DELAY = float(os.getenv("STUB_UPLOAD_DELAY", "0"))
+
+PNG = base64.b64decode(
+    "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNkYPhfDwAChwGA60e6kgAAAABJRU5ErkJggg=="
+)
+
+_records = {}  # (user_id, date) -> [{"time": "HH:MM", "value": int}]
+_lock = threading.Lock()
+
+
+def get_blood_sugar_by_date(user_id, date_str):
+    with _lock:
+        return [dict(record) for record in _records.get((user_id, date_str), [])]
+
+
+def record_blood_sugar(user_id, value):
+    now = datetime.now(TZ)
+    with _lock:
+        records = _records.setdefault((user_id, now.strftime("%Y-%m-%d")), [])
+        records.append({"time": now.strftime("%H:%M"), "value": value})
+        records.sort(key=lambda record: record["time"])
+    return f"✅ 已記錄血糖 {value} mg/dL"
+
+
+def update_blood_sugar(user_id, date_str, index, new_value):
+    with _lock:
+        records = _records.get((user_id, date_str), [])
+        if not 0 <= index < len(records):
+            return "❌ 找不到這筆血糖紀錄"
+        records[index]["value"] = new_value
+    return f"✅ 已修改血糖為 {new_value} mg/dL"
+
+
+def delete_blood_sugar(user_id, date_str, index):
+    with _lock:
+        records = _records.get((user_id, date_str), [])
+        if not 0 <= index < len(records):
+            return "❌ 找不到這筆血糖紀錄"
+        del records[index]
+    return "✅ 已刪除血糖紀錄"
+
+
+def generate_blood_sugar_chart(user_id, records, period="today"):
+    time.sleep(CHART_DELAY)
+    # 每個使用者、期間固定一個檔案，重複壓測不會留下大量暫存檔
+    path = os.path.join(tempfile.gettempdir(), f"stub_chart_{user_id}_{period}.png")
+    with open(path, "wb") as f:
+        f.write(PNG)
+    return path
+
+
+def upload_and_get_url(local_file, user_id, period="today"):
+    time.sleep(UPLOAD_DELAY)
+    return f"https://example.com/charts/{period}/{os.path.basename(local_file)}"
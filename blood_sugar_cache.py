@@ -0,0 +1,263 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+import pytz
+
+import blood_sugar_store
+import chart_cache
+import metrics
+from sqlite_local import ThreadLocalConnection
+
+# get_blood_sugar_by_date 的讀取快取（LRU + TTL），以 (user_id, date, 版本) 為 key。
+# 新增／修改／刪除都要經過這裡，才能同步更新或清除快取（包含當天的報表圖檔）。
+# 快取只存在目前的 process；每個使用者的資料版本存在共用的 SQLite 檔（UserVersions），
+# 任何 worker 寫入都會把版本加一，其他 worker 下次讀取時就不會用到舊版本的快取。
+# 修改／刪除的清單用 get_blood_sugar_fresh 直接查後端，序號才會對應到正確的紀錄。
+# 實際讀寫交給 blood_sugar_store 選定的後端。
+
+CACHE_TTL = float(os.getenv("BLOOD_SUGAR_CACHE_TTL", "300"))
+CACHE_MAX_ENTRIES = int(os.getenv("BLOOD_SUGAR_CACHE_MAX_ENTRIES", "2048"))
+# 記憶體上限：所有快取項目的紀錄筆數總和
+CACHE_MAX_RECORDS = int(os.getenv("BLOOD_SUGAR_CACHE_MAX_RECORDS", "50000"))
+# 各使用者資料版本的 SQLite 檔，所有 worker process 要用同一個
+CACHE_VERSION_DB = os.getenv("BLOOD_SUGAR_CACHE_VERSION_DB", "cache_versions.db")
+
+
+class RecordCache:
+    def __init__(self, ttl=CACHE_TTL, max_entries=CACHE_MAX_ENTRIES, max_records=CACHE_MAX_RECORDS):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_records = max_records
+        self._entries = OrderedDict()  # key -> (expires_at, records)
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry[0] < time.monotonic():
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, records):
+        if len(records) > self.max_records:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.monotonic() + self.ttl, records)
+            self._size += len(records)
+            while len(self._entries) > self.max_entries or self._size > self.max_records:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def _remove(self, key):
+        _, records = self._entries.pop(key)
+        self._size -= len(records)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "records": self._size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+
+class UserVersions:
+    """每個使用者的資料版本（寫入次數），存在共用的 SQLite 檔"""
+
+    def __init__(self, path=CACHE_VERSION_DB):
+        self._conn = ThreadLocalConnection(path, """
+            CREATE TABLE IF NOT EXISTS user_versions (
+                user_id TEXT PRIMARY KEY,
+                version INTEGER NOT NULL
+            );
+        """)
+
+    def get(self, user_id):
+        row = self._conn().execute("SELECT version FROM user_versions WHERE user_id = ?", (user_id,)).fetchone()
+        return row[0] if row else 0
+
+    def bump(self, user_id):
+        """版本加一，回傳新的版本"""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("INSERT INTO user_versions (user_id, version) VALUES (?, 1) "
+                         "ON CONFLICT (user_id) DO UPDATE SET version = version + 1", (user_id,))
+            version = conn.execute("SELECT version FROM user_versions WHERE user_id = ?", (user_id,)).fetchone()[0]
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return version
+
+
+cache = RecordCache()
+versions = UserVersions()
+store = blood_sugar_store.get_store()
+
+
+def _today():
+    return datetime.now(pytz.timezone("Asia/Taipei")).strftime("%Y-%m-%d")
+
+
+def get_blood_sugar_by_date(user_id, date_str):
+    key = (user_id, date_str, versions.get(user_id))
+    records = cache.get(key)
+    if records is not None:
+        return records
+    records = metrics.timed_call("get_blood_sugar_by_date", store.get_by_date, user_id, date_str)
+    # 錯誤訊息（字串）不快取
+    if isinstance(records, list):
+        cache.put(key, records)
+    return records
+
+
+def get_blood_sugar_fresh(user_id, date_str):
+    """不經過快取直接查詢後端，並用結果更新快取
+
+    修改／刪除的清單要用這個：使用者點的序號會直接套用到後端的資料，清單必須是後端目前的內容。
+    """
+    key = (user_id, date_str, versions.get(user_id))
+    records = metrics.timed_call("get_blood_sugar_by_date", store.get_by_date, user_id, date_str)
+    if isinstance(records, list):
+        cache.put(key, records)
+    else:
+        cache.invalidate(key)
+    return records
+
+
+def get_blood_sugar_by_range(user_id, start_date, end_date):
+    """查詢 [start_date, end_date] 的所有紀錄，每筆多一個 date 欄位，依時間排序
+
+    後端支援區間查詢時只查一次；否則退回逐日查詢（有快取就用，但不寫入快取，
+    一年份的報表或整段歷史的匯出才不會把其他使用者的快取擠掉）。
+    查詢失敗時回傳錯誤訊息字串。
+    """
+    if store.supports_range:
+        return store.get_by_range(user_id, start_date, end_date)
+
+    records = []
+    version = versions.get(user_id)
+    day = datetime.strptime(start_date, "%Y-%m-%d")
+    end = datetime.strptime(end_date, "%Y-%m-%d")
+    while day <= end:
+        date_str = day.strftime("%Y-%m-%d")
+        day_records = cache.get((user_id, date_str, version))
+        if day_records is None:
+            day_records = metrics.timed_call("get_blood_sugar_by_date", store.get_by_date, user_id, date_str)
+        if isinstance(day_records, str):
+            return day_records
+        records.extend(dict(record, date=date_str) for record in day_records)
+        day += timedelta(days=1)
+    return records
+
+
+def get_daily_summaries(user_id, start_date, end_date):
+    """後端有維護每日統計時回傳統計列，否則回傳 None"""
+    if not store.supports_summaries:
+        return None
+    return store.get_daily_summaries(user_id, start_date, end_date)
+
+
+def _written(user_id, date_strs, before):
+    """寫入後呼叫：版本加一讓其他 worker 的快取失效，清掉這個 process 的舊快取與報表圖檔，回傳新版本"""
+    after = versions.bump(user_id)
+    for date_str in date_strs:
+        cache.invalidate((user_id, date_str, before))
+        chart_cache.cache.invalidate(user_id, date_str)
+    return after
+
+
+def record_blood_sugar(user_id, value, recorded_at=None, meal=None):
+    """recorded_at 為「YYYY-MM-DD HH:MM:SS」，沒有時由後端以現在時間記錄；meal 為餐別標籤"""
+    before = versions.get(user_id)
+    response_text = metrics.timed_call("record_blood_sugar", store.record, user_id, value, recorded_at, meal)
+    # 新紀錄的時間由後端決定（legacy 會忽略 recorded_at），清掉可能受影響那幾天的快取
+    _written(user_id, {_today(), (recorded_at or "")[:10]} - {""}, before)
+    return response_text
+
+
+def import_readings(user_id, rows):
+    """批次寫入 (recorded_at, value, meal)，回傳新增筆數；後端不支援匯入時回傳錯誤訊息"""
+    if not store.supports_import:
+        return f"❌ 目前的儲存後端（{store.name}）不支援匯入，請改用 BLOOD_SUGAR_BACKEND=sqlite"
+    before = versions.get(user_id)
+    inserted = metrics.timed_call("import_readings", store.bulk_insert, user_id, rows)
+    _written(user_id, {row[0][:10] for row in rows}, before)
+    return inserted
+
+
+def _carry_over(user_id, date_str, before, after, records, change):
+    """把舊版本的快取內容套用 change 後存成新版本；中間有其他 worker 寫入（版本跳號）時不沿用"""
+    if after != before + 1:
+        return
+    try:
+        cache.put((user_id, date_str, after), change(list(records)))
+    except (IndexError, TypeError):
+        pass
+
+
+def update_blood_sugar(user_id, date_str, index, new_value):
+    before = versions.get(user_id)
+    response_text = store.update(user_id, date_str, index, new_value)
+    records = cache.get((user_id, date_str, before))
+    after = _written(user_id, [date_str], before)
+    if not response_text.startswith("✅") or records is None:
+        return response_text
+
+    def update(records):
+        if not 0 <= index < len(records):
+            raise IndexError(index)
+        records[index] = dict(records[index], value=new_value)
+        return records
+
+    _carry_over(user_id, date_str, before, after, records, update)
+    return response_text
+
+
+def delete_blood_sugar(user_id, date_str, index):
+    before = versions.get(user_id)
+    response_text = store.delete(user_id, date_str, index)
+    records = cache.get((user_id, date_str, before))
+    after = _written(user_id, [date_str], before)
+    if not response_text.startswith("✅") or records is None:
+        return response_text
+
+    def delete(records):
+        del records[index]
+        return records
+
+    _carry_over(user_id, date_str, before, after, records, delete)
+    return response_text
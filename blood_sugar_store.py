@@ -0,0 +1,348 @@
+import argparse
+import os
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+import pytz
+
+# 血糖紀錄的儲存後端。main.py 透過 blood_sugar_cache 存取，不直接碰後端：
+#   legacy：原本的 blood_sugar 模組
+#   sqlite：內嵌 SQLite（WAL 模式），以 (user_id, recorded_at) 複合索引查詢單日或區間，
+#           並在每次寫入時同步維護每人每日的統計（daily_summary），報表只需讀取彙總列
+# 用 BLOOD_SUGAR_BACKEND 選擇後端。
+# 命令列工具：python blood_sugar_store.py migrate | rebuild-summaries | check-summaries
+
+BLOOD_SUGAR_BACKEND = os.getenv("BLOOD_SUGAR_BACKEND", "legacy")
+BLOOD_SUGAR_DB = os.getenv("BLOOD_SUGAR_DB", "blood_sugar.db")
+BLOOD_SUGAR_DB_POOL_SIZE = int(os.getenv("BLOOD_SUGAR_DB_POOL_SIZE", "4"))
+
+TZ = pytz.timezone("Asia/Taipei")
+
+# 目標範圍（mg/dL），低於 TARGET_LOW 為偏低、高於 TARGET_HIGH 為偏高
+TARGET_LOW = 70
+TARGET_HIGH = 180
+
+
+def _next_day(date_str):
+    return (datetime.strptime(date_str, "%Y-%m-%d") + timedelta(days=1)).strftime("%Y-%m-%d")
+
+
+def _normalize_time(time_str):
+    # 統一成 HH:MM:SS，舊資料可能只有 HH:MM
+    return time_str if len(time_str) == 8 else f"{time_str}:00"
+
+
+def _reading(recorded_at, value, meal):
+    reading = {"time": recorded_at[11:16], "value": value}
+    if meal:
+        reading["meal"] = meal
+    return reading
+
+
+class LegacyStore:
+    name = "legacy"
+    supports_summaries = False
+    supports_import = False
+    # 不能指定紀錄時間，也不保存餐別
+    supports_details = False
+
+    # blood_sugar 會載入繪圖與雲端儲存套件，第一次用到才 import，不拖慢啟動
+    @property
+    def module(self):
+        import blood_sugar
+        return blood_sugar
+
+    @property
+    def supports_range(self):
+        return hasattr(self.module, "get_blood_sugar_by_range")
+
+    def ping(self):
+        """確認 blood_sugar 可以載入（順便預先載入）"""
+        return self.module.__name__
+
+    def get_by_date(self, user_id, date_str):
+        return self.module.get_blood_sugar_by_date(user_id, date_str)
+
+    def get_by_range(self, user_id, start_date, end_date):
+        return self.module.get_blood_sugar_by_range(user_id, start_date, end_date)
+
+    def record(self, user_id, value, recorded_at=None, meal=None):
+        # blood_sugar 只接受數值：時間一律是寫入當下，餐別不會保存
+        return self.module.record_blood_sugar(user_id, value)
+
+    def update(self, user_id, date_str, index, new_value):
+        return self.module.update_blood_sugar(user_id, date_str, index, new_value)
+
+    def delete(self, user_id, date_str, index):
+        return self.module.delete_blood_sugar(user_id, date_str, index)
+
+
+# SQL 字串固定不變，sqlite3 會依字串快取每個連線已編譯好的 statement
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS readings (
+    id INTEGER PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    recorded_at TEXT NOT NULL,
+    value INTEGER NOT NULL,
+    meal TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_readings_user_time ON readings (user_id, recorded_at);
+CREATE TABLE IF NOT EXISTS daily_summary (
+    user_id TEXT NOT NULL,
+    day TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    total REAL NOT NULL,
+    total_sq REAL NOT NULL,
+    min_value INTEGER NOT NULL,
+    max_value INTEGER NOT NULL,
+    in_range INTEGER NOT NULL,
+    low INTEGER NOT NULL,
+    high INTEGER NOT NULL,
+    PRIMARY KEY (user_id, day)
+) WITHOUT ROWID;
+"""
+SELECT_RANGE = ("SELECT recorded_at, value, meal FROM readings "
+                "WHERE user_id = ? AND recorded_at >= ? AND recorded_at < ? ORDER BY recorded_at, id")
+INSERT_READING = "INSERT INTO readings (user_id, recorded_at, value, meal) VALUES (?, ?, ?, ?)"
+# 匯入時略過已經存在（同一時間、同一數值）的紀錄，重複匯入同一個檔案不會多出資料
+INSERT_READING_IF_NEW = ("INSERT INTO readings (user_id, recorded_at, value, meal) SELECT ?, ?, ?, ? WHERE NOT EXISTS "
+                         "(SELECT 1 FROM readings WHERE user_id = ? AND recorded_at = ? AND value = ?)")
+# 以當天第 index 筆（依時間排序）定位要修改／刪除的紀錄，和 legacy 的用法相同
+NTH_OF_DAY = ("SELECT id FROM readings WHERE user_id = ? AND recorded_at >= ? AND recorded_at < ? "
+              "ORDER BY recorded_at, id LIMIT 1 OFFSET ?")
+UPDATE_READING = "UPDATE readings SET value = ? WHERE id = ?"
+DELETE_READING = "DELETE FROM readings WHERE id = ?"
+DELETE_DAY = "DELETE FROM readings WHERE user_id = ? AND recorded_at >= ? AND recorded_at < ?"
+
+# 新增紀錄時直接累加當天的統計
+ADD_TO_SUMMARY = """
+INSERT INTO daily_summary (user_id, day, count, total, total_sq, min_value, max_value, in_range, low, high)
+VALUES (?, ?, 1, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (user_id, day) DO UPDATE SET
+    count = count + 1,
+    total = total + excluded.total,
+    total_sq = total_sq + excluded.total_sq,
+    min_value = min(min_value, excluded.min_value),
+    max_value = max(max_value, excluded.max_value),
+    in_range = in_range + excluded.in_range,
+    low = low + excluded.low,
+    high = high + excluded.high
+"""
+# 修改／刪除後 min/max 無法直接扣回，重新計算那一天（只掃描當天的索引範圍）
+AGGREGATE_READINGS = f"""
+SELECT user_id, substr(recorded_at, 1, 10) AS day, count(*), sum(value), sum(value * value),
+       min(value), max(value), sum(value BETWEEN {TARGET_LOW} AND {TARGET_HIGH}),
+       sum(value < {TARGET_LOW}), sum(value > {TARGET_HIGH})
+FROM readings
+"""
+REFRESH_SUMMARY = ("INSERT INTO daily_summary " + AGGREGATE_READINGS +
+                   "WHERE user_id = ? AND recorded_at >= ? AND recorded_at < ? GROUP BY user_id, day")
+DELETE_SUMMARY = "DELETE FROM daily_summary WHERE user_id = ? AND day = ?"
+DELETE_SUMMARIES = "DELETE FROM daily_summary WHERE user_id = ? AND day >= ? AND day <= ?"
+SELECT_SUMMARIES = ("SELECT day, count, total, total_sq, min_value, max_value, in_range, low, high "
+                    "FROM daily_summary WHERE user_id = ? AND day >= ? AND day <= ? ORDER BY day")
+
+
+class SQLiteStore:
+    name = "sqlite"
+    supports_range = True
+    supports_summaries = True
+    supports_import = True
+    supports_details = True
+
+    def __init__(self, path=BLOOD_SUGAR_DB, pool_size=BLOOD_SUGAR_DB_POOL_SIZE):
+        self.path = path
+        self.pool_size = pool_size
+        self._pool = None
+        self._pid = None
+        self._lock = threading.Lock()
+        with self._connection() as conn:
+            conn.executescript(SCHEMA)
+            # 舊的資料庫沒有 meal 欄位（餐別標籤，可為 NULL）
+            if "meal" not in {row[1] for row in conn.execute("PRAGMA table_info(readings)")}:
+                conn.execute("ALTER TABLE readings ADD COLUMN meal TEXT")
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=5, check_same_thread=False, cached_statements=64)
+        # WAL：讀取不會被寫入擋住；NORMAL 在 WAL 模式下仍能保證不會損毀資料庫
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    @contextmanager
+    def _connection(self):
+        # 連線不能跨 fork 使用，pid 改變時重建連線池
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pool = queue.LifoQueue()
+                for _ in range(self.pool_size):
+                    self._pool.put(None)
+                self._pid = os.getpid()
+            pool = self._pool
+        conn = pool.get()
+        try:
+            if conn is None:
+                conn = self._connect()
+            yield conn
+        finally:
+            pool.put(conn)
+
+    def ping(self):
+        with self._connection() as conn:
+            return conn.execute("SELECT 1").fetchone()[0]
+
+    def get_by_date(self, user_id, date_str):
+        with self._connection() as conn:
+            rows = conn.execute(SELECT_RANGE, (user_id, date_str, _next_day(date_str))).fetchall()
+        return [_reading(recorded_at, value, meal) for recorded_at, value, meal in rows]
+
+    def get_by_range(self, user_id, start_date, end_date):
+        with self._connection() as conn:
+            rows = conn.execute(SELECT_RANGE, (user_id, start_date, _next_day(end_date))).fetchall()
+        return [dict(_reading(recorded_at, value, meal), date=recorded_at[:10]) for recorded_at, value, meal in rows]
+
+    def get_daily_summaries(self, user_id, start_date, end_date):
+        """回傳 [start_date, end_date] 每天的統計（沒有紀錄的日期不會出現）"""
+        with self._connection() as conn:
+            rows = conn.execute(SELECT_SUMMARIES, (user_id, start_date, end_date)).fetchall()
+        keys = ("day", "count", "total", "total_sq", "min", "max", "in_range", "low", "high")
+        return [dict(zip(keys, row)) for row in rows]
+
+    def _refresh_summary(self, conn, user_id, date_str):
+        conn.execute(DELETE_SUMMARY, (user_id, date_str))
+        conn.execute(REFRESH_SUMMARY, (user_id, date_str, _next_day(date_str)))
+
+    def record(self, user_id, value, recorded_at=None, meal=None):
+        recorded_at = recorded_at or datetime.now(TZ).strftime("%Y-%m-%d %H:%M:%S")
+        with self._connection() as conn, conn:
+            conn.execute(INSERT_READING, (user_id, recorded_at, value, meal))
+            conn.execute(ADD_TO_SUMMARY, (
+                user_id, recorded_at[:10], value, value * value, value, value,
+                int(TARGET_LOW <= value <= TARGET_HIGH), int(value < TARGET_LOW), int(value > TARGET_HIGH),
+            ))
+        return f"✅ 已記錄血糖 {value} mg/dL"
+
+    def update(self, user_id, date_str, index, new_value):
+        with self._connection() as conn, conn:
+            row = conn.execute(NTH_OF_DAY, (user_id, date_str, _next_day(date_str), index)).fetchone()
+            if row is None:
+                return "❌ 找不到這筆血糖紀錄"
+            conn.execute(UPDATE_READING, (new_value, row[0]))
+            self._refresh_summary(conn, user_id, date_str)
+        return f"✅ 已修改血糖為 {new_value} mg/dL"
+
+    def delete(self, user_id, date_str, index):
+        with self._connection() as conn, conn:
+            row = conn.execute(NTH_OF_DAY, (user_id, date_str, _next_day(date_str), index)).fetchone()
+            if row is None:
+                return "❌ 找不到這筆血糖紀錄"
+            conn.execute(DELETE_READING, (row[0],))
+            self._refresh_summary(conn, user_id, date_str)
+        return "✅ 已刪除血糖紀錄"
+
+    def replace_day(self, user_id, date_str, records):
+        """用 records（time/value）取代某一天的全部紀錄，搬資料時使用"""
+        rows = [(user_id, f"{date_str} {_normalize_time(record['time'])}", record["value"], record.get("meal"))
+                for record in records]
+        with self._connection() as conn, conn:
+            conn.execute(DELETE_DAY, (user_id, date_str, _next_day(date_str)))
+            conn.executemany(INSERT_READING, rows)
+            self._refresh_summary(conn, user_id, date_str)
+        return len(rows)
+
+    def bulk_insert(self, user_id, rows):
+        """rows 為 (recorded_at, value, meal)，整批在一個交易裡寫入並重算涉及日期的統計，回傳新增筆數"""
+        if not rows:
+            return 0
+        first_day = min(row[0] for row in rows)[:10]
+        last_day = max(row[0] for row in rows)[:10]
+        with self._connection() as conn, conn:
+            before = conn.total_changes
+            conn.executemany(INSERT_READING_IF_NEW, ((user_id, recorded_at, value, meal, user_id, recorded_at, value)
+                                                     for recorded_at, value, meal in rows))
+            inserted = conn.total_changes - before
+            if inserted:
+                # 整段日期一次重算（沒有新資料的日期重算後也不變）
+                conn.execute(DELETE_SUMMARIES, (user_id, first_day, last_day))
+                conn.execute(REFRESH_SUMMARY, (user_id, first_day, _next_day(last_day)))
+        return inserted
+
+    def rebuild_summaries(self):
+        """從原始紀錄重建整張 daily_summary"""
+        with self._connection() as conn, conn:
+            conn.execute("DELETE FROM daily_summary")
+            conn.execute("INSERT INTO daily_summary " + AGGREGATE_READINGS + "GROUP BY user_id, day")
+            return conn.execute("SELECT count(*) FROM daily_summary").fetchone()[0]
+
+    def check_summaries(self):
+        """比對 daily_summary 與原始紀錄，回傳不一致的 (user_id, day, 彙總列, 重新計算的結果)"""
+        with self._connection() as conn:
+            stored = {row[:2]: row[2:] for row in conn.execute("SELECT * FROM daily_summary")}
+            actual = {row[:2]: row[2:] for row in conn.execute(AGGREGATE_READINGS + "GROUP BY user_id, day")}
+        return [(key[0], key[1], stored.get(key), actual.get(key))
+                for key in sorted(stored.keys() | actual.keys())
+                if stored.get(key) != actual.get(key)]
+
+
+def get_store():
+    if BLOOD_SUGAR_BACKEND == "sqlite":
+        return SQLiteStore()
+    if BLOOD_SUGAR_BACKEND != "legacy":
+        raise ValueError(f"❌ 未知的 BLOOD_SUGAR_BACKEND：{BLOOD_SUGAR_BACKEND}")
+    return LegacyStore()
+
+
+def migrate(user_ids, start_date, end_date, db_path=BLOOD_SUGAR_DB):
+    """把 legacy 的紀錄逐日搬到 SQLite，可重複執行（每天的資料整天覆蓋）"""
+    source = LegacyStore()
+    target = SQLiteStore(db_path)
+    total = 0
+    for user_id in user_ids:
+        day = start_date
+        while day <= end_date:
+            records = source.get_by_date(user_id, day)
+            if isinstance(records, str):
+                print(f"❌ Failed to read {user_id} on {day}: {records}")
+            elif records:
+                total += target.replace_day(user_id, day, records)
+            day = _next_day(day)
+        print(f"✅ Migrated user {user_id}")
+    print(f"✅ Migrated {total} readings into {db_path}")
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description="血糖紀錄儲存後端工具")
+    commands = parser.add_subparsers(dest="command", required=True)
+    migrate_parser = commands.add_parser("migrate", help="從 legacy 後端搬資料到 SQLite")
+    migrate_parser.add_argument("--db", default=BLOOD_SUGAR_DB)
+    migrate_parser.add_argument("--users-file", required=True, help="每行一個 user_id")
+    migrate_parser.add_argument("--start", default="2020-01-01")
+    migrate_parser.add_argument("--end", default=datetime.now(TZ).strftime("%Y-%m-%d"))
+    rebuild_parser = commands.add_parser("rebuild-summaries", help="從原始紀錄重建每日統計")
+    rebuild_parser.add_argument("--db", default=BLOOD_SUGAR_DB)
+    check_parser = commands.add_parser("check-summaries", help="檢查每日統計是否與原始紀錄一致")
+    check_parser.add_argument("--db", default=BLOOD_SUGAR_DB)
+    args = parser.parse_args()
+
+    if args.command == "migrate":
+        with open(args.users_file, encoding="utf-8") as f:
+            user_ids = [line.strip() for line in f if line.strip()]
+        migrate(user_ids, args.start, args.end, args.db)
+    elif args.command == "rebuild-summaries":
+        count = SQLiteStore(args.db).rebuild_summaries()
+        print(f"✅ Rebuilt {count} daily summaries")
+    elif args.command == "check-summaries":
+        mismatches = SQLiteStore(args.db).check_summaries()
+        for user_id, day, stored, actual in mismatches:
+            print(f"❌ {user_id} {day}: summary={stored} readings={actual}")
+        if mismatches:
+            raise SystemExit(f"❌ {len(mismatches)} daily summaries are inconsistent")
+        print("✅ Daily summaries match the readings")
+
+
+if __name__ == "__main__":
+    main()
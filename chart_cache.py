@@ -0,0 +1,195 @@
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+import chart_renderer
+import metrics
+
+# 報表圖檔快取：以 (user_id, period, 日期, 紀錄內容) 的雜湊為 key，
+# 紀錄沒變就直接回傳上次上傳的圖片網址，不重新畫圖和上傳。
+# 圖檔存在本機目錄，index.json 記錄每個 key 的網址、大小與最後使用時間。
+# 多個 worker process 共用同一個目錄：修改 index.json 時持有檔案鎖，先讀回其他 process 寫入的項目再合併，
+# 容量上限才會以整個目錄計算；啟動時刪除不在 index 裡的圖檔。
+
+CHART_CACHE_DIR = os.getenv("CHART_CACHE_DIR", os.path.join(tempfile.gettempdir(), "blood_sugar_charts"))
+CHART_CACHE_MAX_BYTES = int(os.getenv("CHART_CACHE_MAX_BYTES", str(100 * 1024 * 1024)))
+# 不在 index 裡、超過這個秒數的圖檔才刪除（其他 process 可能剛畫好、正在上傳）
+ORPHAN_MIN_AGE = 600
+
+logger = logging.getLogger(__name__)
+
+
+def chart_key(user_id, period, date_str, records):
+    # 紀錄只有時間與數值，不同天的紀錄可能完全相同，日期也要算進去
+    payload = json.dumps([user_id, period, date_str, records], sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ChartCache:
+    def __init__(self, directory=CHART_CACHE_DIR, max_bytes=CHART_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.index_path = os.path.join(directory, "index.json")
+        self.lock_path = os.path.join(directory, "index.lock")
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(directory, exist_ok=True)
+        self._index = {}
+        with self._locked_index() as index:
+            self._remove_orphans(index)
+
+    def _read_index(self):
+        try:
+            with open(self.index_path, encoding="utf-8") as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        # 圖檔已被刪除的項目直接丟掉
+        return {key: entry for key, entry in index.items() if os.path.exists(self._path(key))}
+
+    @contextmanager
+    def _locked_index(self):
+        """持有檔案鎖，讀回 index.json 並合併這個 process 的使用時間；區塊結束後寫回"""
+        with self._lock, open(self.lock_path, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            index = self._read_index()
+            for key, entry in index.items():
+                local = self._index.get(key)
+                if local is not None:
+                    entry["used_at"] = max(entry["used_at"], local["used_at"])
+            yield index
+            self._index = index
+            self._save_index()
+
+    def _save_index(self):
+        tmp_path = self.index_path + f".{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self._index, f, ensure_ascii=False)
+        os.replace(tmp_path, self.index_path)
+
+    def _remove_orphans(self, index):
+        cutoff = time.time() - ORPHAN_MIN_AGE
+        for name in os.listdir(self.directory):
+            key, ext = os.path.splitext(name)
+            if ext != ".png" or key in index:
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+            except OSError:
+                pass
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.png")
+
+    def lookup(self, key):
+        with self._lock:
+            entry = self._index.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            entry["used_at"] = time.time()
+            self.hits += 1
+            return entry["url"]
+
+    def write_image(self, key, image):
+        """把圖檔寫進快取目錄，回傳檔案路徑（之後用 store 記錄網址）"""
+        path = self._path(key)
+        tmp_path = path + f".{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(image)
+        os.replace(tmp_path, path)
+        return path
+
+    def store(self, key, user_id, date_str, url):
+        size = os.path.getsize(self._path(key))
+        with self._locked_index() as index:
+            index[key] = {
+                "user_id": user_id,
+                "date": date_str,
+                "url": url,
+                "size": size,
+                "used_at": time.time(),
+            }
+            self._evict(index)
+
+    def _evict(self, index):
+        total = sum(entry["size"] for entry in index.values())
+        if total <= self.max_bytes:
+            return
+        # 從最久沒用到的開始刪
+        for key in sorted(index, key=lambda k: index[k]["used_at"]):
+            if total <= self.max_bytes:
+                break
+            total -= index.pop(key)["size"]
+            self._delete_file(key)
+            self.evictions += 1
+
+    def invalidate(self, user_id, date_str):
+        """刪除某位使用者某一天的圖檔快取"""
+        # 每次寫入紀錄都會呼叫，只有這個 process 知道的項目才需要鎖住 index；
+        # 其他 process 留下的舊圖 key 含紀錄內容，不會再被用到，由容量上限淘汰
+        with self._lock:
+            if not any(entry["user_id"] == user_id and entry["date"] == date_str for entry in self._index.values()):
+                return
+        with self._locked_index() as index:
+            keys = [key for key, entry in index.items() if entry["user_id"] == user_id and entry["date"] == date_str]
+            for key in keys:
+                del index[key]
+                self._delete_file(key)
+
+    def _delete_file(self, key):
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._index),
+                "bytes": sum(entry["size"] for entry in self._index.values()),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+cache = ChartCache()
+
+
+def get_chart_url(user_id, records, period, date_str):
+    """回傳報表圖片網址；紀錄沒變就沿用快取
+
+    失敗時回傳 ❌ 開頭的錯誤訊息；繪圖服務忙碌或逾時回傳 None。
+    """
+    key = chart_key(user_id, period, date_str, records)
+    image_url = cache.lookup(key)
+    if image_url:
+        logger.debug("Chart cache hit for user %s (%s, %s)", user_id, period, date_str)
+        return image_url
+
+    start = time.perf_counter()
+    image = chart_renderer.renderer.render(user_id, records, period)
+    # 忙碌、逾時（None）或繪圖失敗（❌ 訊息）都算錯誤
+    metrics.observe("generate_blood_sugar_chart", time.perf_counter() - start, error=not isinstance(image, bytes))
+    if image is None or isinstance(image, str):
+        return image
+    import blood_sugar  # 上傳用的雲端套件很大，用到才載入
+    local_file = cache.write_image(key, image)
+    image_url = metrics.timed_call("upload_and_get_url", blood_sugar.upload_and_get_url, local_file, user_id,
+                                   period=period)
+    if isinstance(image_url, str) and image_url.startswith("❌"):
+        cache._delete_file(key)
+        return image_url
+    cache.store(key, user_id, date_str, image_url)
+    return image_url
@@ -0,0 +1,147 @@
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+# 報表繪圖服務：matplotlib 畫圖會佔住 GIL，放在 Flask 執行緒裡會卡住其他使用者，
+# 所以交給預先啟動、已經 import 好繪圖套件的 process pool 處理，回傳 PNG bytes。
+# pool 忙碌（排隊的工作太多）或逾時時回傳 None，由呼叫端改用文字摘要。
+
+CHART_POOL_SIZE = int(os.getenv("CHART_POOL_SIZE", "2"))
+CHART_RENDER_TIMEOUT = float(os.getenv("CHART_RENDER_TIMEOUT", "10"))
+# 同時送進 pool 的工作上限（包含正在畫的），超過就視為忙碌
+CHART_MAX_PENDING = int(os.getenv("CHART_MAX_PENDING", str(CHART_POOL_SIZE * 4)))
+# pool 壞掉（例如繪圖套件載入失敗）後等多久才重建，這段時間直接回傳 None
+CHART_POOL_RESTART_DELAY = float(os.getenv("CHART_POOL_RESTART_DELAY", "30"))
+
+logger = logging.getLogger(__name__)
+
+# 這個 process 已經有 webhook worker、日誌、重試等執行緒，fork 出來的子 process 可能卡在複製過來的鎖上，
+# 改由乾淨的 forkserver（不支援的平台用 spawn）啟動繪圖 process。
+# 子 process 會重新 import 啟動的腳本，所以本機用 serve.py 啟動（見 serve.py）
+_MP_CONTEXT = multiprocessing.get_context(
+    "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn")
+
+
+def _warm_up():
+    # 在 worker process 啟動時先載入繪圖套件，避免第一張圖要等 import
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot  # noqa: F401
+    import blood_sugar  # noqa: F401
+
+
+def _ping():
+    return os.getpid()
+
+
+def _render(user_id, records, period):
+    import blood_sugar
+    local_file = blood_sugar.generate_blood_sugar_chart(user_id, records, period=period)
+    if isinstance(local_file, str) and local_file.startswith("❌"):
+        return local_file
+    with open(local_file, "rb") as f:
+        return f.read()
+
+
+class ChartRenderer:
+    def __init__(self, pool_size=CHART_POOL_SIZE, timeout=CHART_RENDER_TIMEOUT, max_pending=CHART_MAX_PENDING):
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._restart_at = 0.0
+        self.rendered = 0
+        self.saturated = 0
+        self.timeouts = 0
+        self.broken = 0
+
+    def start(self):
+        """回傳 pool；pool 剛壞掉、還在等待重建時回傳 None"""
+        # 和 webhook worker 一樣，fork 之後要在新的 process 重新建立 pool
+        with self._lock:
+            if self._executor is not None and self._pid == os.getpid():
+                return self._executor
+            if self._pid == os.getpid() and time.monotonic() < self._restart_at:
+                return None
+            self._executor = ProcessPoolExecutor(max_workers=self.pool_size, mp_context=_MP_CONTEXT,
+                                                 initializer=_warm_up)
+            self._pid = os.getpid()
+            # 先丟幾個空工作，讓所有 worker 立刻啟動並完成 import
+            for _ in range(self.pool_size):
+                self._executor.submit(_ping)
+            logger.info("Started chart rendering pool with %d workers", self.pool_size)
+            return self._executor
+
+    def ping(self):
+        """確認繪圖 process 已經啟動並完成 import，回傳 worker 的 pid"""
+        executor = self.start()
+        if executor is None:
+            raise RuntimeError("Chart rendering pool is waiting to restart")
+        return executor.submit(_ping).result(timeout=self.timeout)
+
+    def render(self, user_id, records, period):
+        """回傳 PNG bytes；繪圖失敗回傳 ❌ 開頭的訊息；忙碌或逾時回傳 None"""
+        if not self._slots.acquire(blocking=False):
+            self.saturated += 1
+            logger.warning("Chart pool saturated, skipping chart for user %s", user_id)
+            return None
+        try:
+            executor = self.start()
+            if executor is None:
+                self._slots.release()
+                return None
+            future = executor.submit(_render, user_id, records, period)
+        except BrokenProcessPool as e:
+            self._slots.release()
+            self._reset(executor, e)
+            return None
+        except Exception:
+            self._slots.release()
+            raise
+        # 逾時的工作仍會在背景畫完，畫完才釋放名額
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            image = future.result(timeout=self.timeout)
+        except TimeoutError:
+            self.timeouts += 1
+            logger.warning("Chart rendering for user %s timed out after %ss", user_id, self.timeout)
+            return None
+        except BrokenProcessPool as e:
+            self._reset(executor, e)
+            return None
+        self.rendered += 1
+        return image
+
+    def _reset(self, executor, error):
+        with self._lock:
+            if self._executor is not executor:
+                return  # 已經由其他請求處理
+            logger.error("Chart rendering pool broken, restarting in %ss: %s", CHART_POOL_RESTART_DELAY, error)
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+            self._restart_at = time.monotonic() + CHART_POOL_RESTART_DELAY
+            self.broken += 1
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None and self._pid == os.getpid():
+                self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def stats(self):
+        return {
+            "pool_size": self.pool_size,
+            "rendered": self.rendered,
+            "saturated": self.saturated,
+            "timeouts": self.timeouts,
+            "broken": self.broken,
+        }
+
+
+renderer = ChartRenderer()
@@ -0,0 +1,418 @@
+import argparse
+import csv
+import io
+import json
+import logging
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import numpy as np
+
+import blood_sugar_cache
+from blood_sugar_store import TZ
+from glucose_parser import MAX_VALUE, MIN_VALUE
+from sqlite_local import ThreadLocalConnection
+
+# 血糖機匯出檔（CSV）的批次匯入與串流匯出：
+#   read_rows：逐行讀取（generator），辨識欄位名稱，時間統一成 YYYY-MM-DD HH:MM:SS
+#   validate：每 CSV_BATCH_SIZE 筆用 numpy 一次檢查數值範圍與時間，mmol/L 換算成 mg/dL
+#   import_csv：每批一個交易寫入（略過已存在的紀錄），每批結束回報進度
+#   export_csv：每次只查 CSV_EXPORT_WINDOW_DAYS 天，邊查邊輸出，不會把整段歷史放進記憶體
+# 上傳的檔案先存成暫存檔，由 ImportJobs 在背景匯入，進度存在 SQLite，可以查詢進度。
+# 命令列：python csv_io.py import --user U... meter.csv | export --user U... -o history.csv
+
+CSV_BATCH_SIZE = int(os.getenv("CSV_BATCH_SIZE", "5000"))
+CSV_EXPORT_WINDOW_DAYS = int(os.getenv("CSV_EXPORT_WINDOW_DAYS", "31"))
+CSV_IMPORT_WORKERS = int(os.getenv("CSV_IMPORT_WORKERS", "1"))
+CSV_MAX_UPLOAD_BYTES = int(os.getenv("CSV_MAX_UPLOAD_BYTES", str(20 * 1024 * 1024)))
+# 匯入進度存在這個 SQLite 檔，多個 worker process 都查得到
+CSV_IMPORT_DB = os.getenv("CSV_IMPORT_DB", "import_jobs.db")
+# 進度裡最多保留幾筆錯誤明細
+CSV_MAX_ERROR_DETAILS = 20
+# 找欄位名稱列時最多看幾行（有些血糖機匯出檔前面有幾行裝置資訊）
+HEADER_SEARCH_LINES = 10
+MMOL_TO_MGDL = 18.0
+EXPORT_START = "2020-01-01"
+
+logger = logging.getLogger(__name__)
+
+# 欄位名稱（轉成小寫、去掉多餘空白後比對）
+COLUMNS = {
+    "datetime": {"datetime", "timestamp", "device timestamp", "date time", "日期時間", "量測時間", "時間戳記"},
+    "date": {"date", "日期", "量測日期"},
+    "time": {"time", "時間"},
+    "value": {"value", "glucose", "glucose (mg/dl)", "mg/dl", "historic glucose mg/dl", "scan glucose mg/dl",
+              "reading", "血糖", "血糖值", "血糖 (mg/dl)"},
+    "mmol": {"glucose (mmol/l)", "mmol/l", "historic glucose mmol/l", "scan glucose mmol/l"},
+    "meal": {"meal", "tag", "note", "notes", "餐別", "標記", "備註"},
+}
+_COLUMN_OF = {name: column for column, names in COLUMNS.items() for name in names}
+
+YMD = re.compile(r"(\d{4})[-/.](\d{1,2})[-/.](\d{1,2})")
+MDY = re.compile(r"(\d{1,2})[-/.](\d{1,2})[-/.](\d{4})")
+# 12 小時制的「7:05 PM」「下午 07:05:00」也要辨識，否則下午的紀錄會存成上午
+HMS = re.compile(r"(?:(?P<zh>上午|下午|早上|晚上)\s*)?(?P<hour>\d{1,2}):(?P<minute>\d{2})(?::(?P<second>\d{2}))?"
+                 r"(?:\s*(?P<en>[AaPp])\.?[Mm]\b\.?)?")
+PM = {"下午", "晚上", "p", "P"}
+
+# line：檔案中的行號；recorded_at：已統一格式的時間（無法解析時為 None）；value：原始文字
+RawRow = namedtuple("RawRow", ["line", "recorded_at", "value", "meal", "mmol"])
+
+
+def _normalize_header(name):
+    return " ".join(name.strip().lower().split())
+
+
+def normalize_datetime(text, day_first=False):
+    """「2024/1/2 7:05」「01-02-2024 07:05:00」之類的時間轉成 YYYY-MM-DD HH:MM:SS，無法解析時回傳 None"""
+    match = YMD.search(text)
+    if match:
+        year, month, day = match.groups()
+    else:
+        match = MDY.search(text)
+        if not match:
+            return None
+        first, second, year = match.groups()
+        month, day = (second, first) if day_first else (first, second)
+    clock = HMS.search(text, match.end())
+    if not clock:
+        return f"{year}-{int(month):02d}-{int(day):02d} 00:00:00"
+    hour = int(clock.group("hour"))
+    period = clock.group("en") or clock.group("zh")
+    if period:
+        # 12 小時制：12 AM 是 0 點，12 PM 是中午
+        if not 1 <= hour <= 12:
+            return None
+        hour = hour % 12 + (12 if period in PM else 0)
+    return f"{year}-{int(month):02d}-{int(day):02d} {hour:02d}:{clock.group('minute')}:{clock.group('second') or '00'}"
+
+
+def read_rows(lines, day_first=False):
+    """從文字行讀出 RawRow；找不到時間或血糖欄位時拋出 ValueError"""
+    reader = csv.reader(lines)
+    columns = None
+    for line_number, header in enumerate(reader, start=1):
+        columns = {}
+        for index, name in enumerate(header):
+            column = _COLUMN_OF.get(_normalize_header(name))
+            if column and column not in columns:
+                columns[column] = index
+        if ("datetime" in columns or "date" in columns) and ("value" in columns or "mmol" in columns):
+            break
+        if line_number >= HEADER_SEARCH_LINES:
+            columns = None
+            break
+    else:
+        columns = None
+    if not columns:
+        raise ValueError("❌ 找不到日期與血糖欄位（需要 date/time 或 datetime，以及 value 欄位）")
+
+    # 沒有的欄位指向每列最後補上的空字串，迴圈裡不用逐一判斷
+    missing = max(columns.values()) + 1
+    datetime_index, date_index, time_index, value_index, mmol_index, meal_index = (
+        columns.get(name, missing) for name in ("datetime", "date", "time", "value", "mmol", "meal"))
+    padding = [""] * (missing + 1)
+
+    for row in reader:
+        if not "".join(row).strip():
+            continue
+        if len(row) > missing:
+            row[missing] = ""  # 這一欄沒有用到
+        else:
+            row += padding[len(row):]
+        if datetime_index != missing:
+            when = row[datetime_index]
+        else:
+            when = f"{row[date_index]} {row[time_index]}"
+        value = row[value_index].strip()
+        mmol = False
+        if not value and mmol_index != missing:
+            value = row[mmol_index].strip()
+            mmol = True
+        yield RawRow(reader.line_num, normalize_datetime(when, day_first), value, row[meal_index].strip()[:20] or None,
+                     mmol)
+
+
+def _batches(rows, size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _to_float(text):
+    try:
+        return float(text)
+    except ValueError:
+        return np.nan
+
+
+def _to_datetimes(texts):
+    try:
+        return np.array(texts, dtype="datetime64[s]")
+    except ValueError:
+        # 這批有不存在的日期（例如 2 月 30 日），逐筆轉換
+        result = np.empty(len(texts), dtype="datetime64[s]")
+        for i, text in enumerate(texts):
+            try:
+                result[i] = np.datetime64(text, "s")
+            except ValueError:
+                result[i] = np.datetime64("NaT")
+        return result
+
+
+def validate(batch, now, unit=None):
+    """一次檢查一批 RawRow，回傳 (可寫入的 (recorded_at, value, meal), [(行號, 原因)])
+
+    unit="mmol" 時全部視為 mmol/L；否則只有 mmol/L 欄位的數值會換算。
+    """
+    values = np.array([_to_float(row.value) for row in batch])
+    mmol = np.fromiter((unit == "mmol" or row.mmol for row in batch), dtype=bool, count=len(batch))
+    values = np.rint(np.where(mmol, values * MMOL_TO_MGDL, values))
+    times = _to_datetimes([row.recorded_at or "NaT" for row in batch])
+
+    bad_time = np.isnat(times)
+    future = ~bad_time & (times > now)
+    with np.errstate(invalid="ignore"):
+        bad_value = ~((values >= MIN_VALUE) & (values <= MAX_VALUE))
+    ok = ~(bad_time | future | bad_value)
+
+    rows = [(batch[i].recorded_at, int(values[i]), batch[i].meal) for i in np.flatnonzero(ok)]
+    errors = []
+    for i in np.flatnonzero(~ok):
+        if bad_time[i]:
+            reason = "時間格式錯誤"
+        elif future[i]:
+            reason = "時間晚於現在"
+        elif not batch[i].value:
+            reason = "缺少血糖值"
+        elif np.isnan(values[i]):
+            reason = "血糖值不是數字"
+        else:
+            reason = f"血糖值超出範圍（{MIN_VALUE}～{MAX_VALUE} mg/dL）"
+        errors.append((batch[i].line, reason))
+    return rows, errors
+
+
+def import_csv(binary, user_id, progress=None, batch_size=CSV_BATCH_SIZE, unit=None, day_first=False,
+               encoding="utf-8", total_bytes=None):
+    """從二進位檔案串流匯入，回傳統計；每寫完一批呼叫 progress(統計)
+
+    檔案格式或後端有問題時統計的 error 為錯誤訊息。
+    """
+    stats = {"rows": 0, "inserted": 0, "duplicates": 0, "invalid": 0, "errors": [], "error": None,
+             "bytes_read": 0, "bytes_total": total_bytes, "elapsed": 0.0}
+    start = time.monotonic()
+    now = np.datetime64(datetime.now(TZ).strftime("%Y-%m-%dT%H:%M:%S"), "s")
+    try:
+        # utf-8-sig 會去掉 Excel 存檔時加在開頭的 BOM
+        if encoding.lower().replace("_", "-") in ("utf-8", "utf8"):
+            encoding = "utf-8-sig"
+        lines = io.TextIOWrapper(binary, encoding=encoding, newline="")
+        for batch in _batches(read_rows(lines, day_first), batch_size):
+            rows, errors = validate(batch, now, unit)
+            inserted = blood_sugar_cache.import_readings(user_id, rows) if rows else 0
+            if isinstance(inserted, str):
+                stats["error"] = inserted
+                break
+            stats["rows"] += len(batch)
+            stats["inserted"] += inserted
+            stats["duplicates"] += len(rows) - inserted
+            stats["invalid"] += len(errors)
+            room = CSV_MAX_ERROR_DETAILS - len(stats["errors"])
+            stats["errors"].extend(errors[:max(room, 0)])
+            stats["bytes_read"] = binary.tell()
+            stats["elapsed"] = round(time.monotonic() - start, 3)
+            if progress:
+                progress(stats)
+    except (ValueError, UnicodeDecodeError) as e:
+        # ValueError 是格式錯誤（訊息已經是給使用者看的），解碼錯誤多半是編碼選錯
+        stats["error"] = str(e) if isinstance(e, ValueError) and str(e).startswith("❌") else f"❌ 無法讀取檔案：{e}"
+    stats["bytes_read"] = binary.tell()
+    stats["elapsed"] = round(time.monotonic() - start, 3)
+    return stats
+
+
+def export_csv(user_id, start_date=EXPORT_START, end_date=None, window_days=CSV_EXPORT_WINDOW_DAYS, bom=True):
+    """逐段查詢並產生 CSV 文字（generator），格式可以直接再匯入"""
+    end_date = end_date or datetime.now(TZ).strftime("%Y-%m-%d")
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\r\n")
+    # 加上 BOM，Excel 才會用 UTF-8 開啟中文
+    yield ("\ufeff" if bom else "") + "date,time,value,meal\r\n"
+    day = datetime.strptime(start_date, "%Y-%m-%d")
+    end = datetime.strptime(end_date, "%Y-%m-%d")
+    while day <= end:
+        window_end = min(end, day + timedelta(days=window_days - 1))
+        records = blood_sugar_cache.get_blood_sugar_by_range(user_id, day.strftime("%Y-%m-%d"),
+                                                             window_end.strftime("%Y-%m-%d"))
+        if isinstance(records, str):
+            # 已經開始輸出就無法改變狀態碼，只能中斷
+            logger.error("Export failed for %s at %s: %s", user_id, day.date(), records)
+            raise RuntimeError(records)
+        for record in records:
+            writer.writerow((record["date"], record["time"], record["value"], record.get("meal") or ""))
+        if buffer.tell():
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        day = window_end + timedelta(days=1)
+
+
+class ImportJobs:
+    """上傳的檔案在背景匯入，依 job ID 查詢進度；只保留最近 max_jobs 筆結果
+
+    進度存在 SQLite，多個 gunicorn worker 時查詢進度的請求不一定由執行匯入的 process 處理。
+    """
+
+    def __init__(self, path=CSV_IMPORT_DB, workers=CSV_IMPORT_WORKERS, max_jobs=100):
+        self.path = path
+        self.workers = workers
+        self.max_jobs = max_jobs
+        self._conn = ThreadLocalConnection(path, """
+            CREATE TABLE IF NOT EXISTS import_jobs (
+                id TEXT PRIMARY KEY,
+                user_id TEXT NOT NULL,
+                status TEXT NOT NULL,
+                progress TEXT NOT NULL,
+                updated_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_import_jobs_updated_at ON import_jobs (updated_at);
+        """)
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+
+    def _get_executor(self):
+        # fork 之後的子 process 沒有父 process 的執行緒，pid 改變時重建
+        with self._lock:
+            if self._pid != os.getpid():
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="csv-import")
+                self._pid = os.getpid()
+            return self._executor
+
+    def save_upload(self, stream):
+        """把上傳內容寫成暫存檔，回傳 (路徑, bytes)；超過 CSV_MAX_UPLOAD_BYTES 時拋出 ValueError"""
+        size = 0
+        fd, path = tempfile.mkstemp(prefix="import_", suffix=".csv")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                while True:
+                    chunk = stream.read(64 * 1024)
+                    if not chunk:
+                        break
+                    size += len(chunk)
+                    if size > CSV_MAX_UPLOAD_BYTES:
+                        raise ValueError(f"❌ 檔案超過 {CSV_MAX_UPLOAD_BYTES // (1024 * 1024)} MB")
+                    f.write(chunk)
+        except BaseException:
+            os.remove(path)
+            raise
+        return path, size
+
+    def submit(self, user_id, path, size, **options):
+        job_id = uuid.uuid4().hex
+        job = {"id": job_id, "status": "queued", "rows": 0, "inserted": 0, "duplicates": 0, "invalid": 0,
+               "errors": [], "error": None, "bytes_read": 0, "bytes_total": size, "elapsed": 0.0}
+        conn = self._conn()
+        conn.execute("INSERT INTO import_jobs (id, user_id, status, progress, updated_at) VALUES (?, ?, ?, ?, ?)",
+                     (job_id, user_id, "queued", json.dumps(job, ensure_ascii=False), time.time()))
+        conn.execute("DELETE FROM import_jobs WHERE id IN "
+                     "(SELECT id FROM import_jobs ORDER BY updated_at DESC LIMIT -1 OFFSET ?)", (self.max_jobs,))
+        self._get_executor().submit(self._run, job, user_id, path, size, options)
+        return job_id
+
+    def _run(self, job, user_id, path, size, options):
+        self._save(job, status="running")
+        try:
+            with open(path, "rb") as f:
+                stats = import_csv(f, user_id, progress=lambda stats: self._save(job, **stats),
+                                   total_bytes=size, **options)
+            self._save(job, status="failed" if stats["error"] else "done", **stats)
+            logger.info("Import %s finished: %d inserted, %d duplicates, %d invalid", job["id"], stats["inserted"],
+                        stats["duplicates"], stats["invalid"])
+        except Exception as e:
+            logger.exception("Import %s failed: %s", job["id"], e)
+            self._save(job, error=f"❌ 匯入失敗：{str(e)}", status="failed")
+        finally:
+            os.remove(path)
+
+    def _save(self, job, **changes):
+        # 只有執行匯入的執行緒會改這個 job
+        job.update(changes)
+        self._conn().execute("UPDATE import_jobs SET status = ?, progress = ?, updated_at = ? WHERE id = ?",
+                             (job["status"], json.dumps(job, ensure_ascii=False), time.time(), job["id"]))
+
+    def get(self, job_id):
+        row = self._conn().execute("SELECT user_id, progress FROM import_jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        return dict(json.loads(row[1]), user_id=row[0])
+
+    def stats(self):
+        counts = dict(self._conn().execute("SELECT status, count(*) FROM import_jobs GROUP BY status").fetchall())
+        return {status: counts.get(status, 0) for status in ("queued", "running", "done", "failed")}
+
+
+jobs = ImportJobs()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="血糖紀錄 CSV 匯入／匯出")
+    commands = parser.add_subparsers(dest="command", required=True)
+    import_parser = commands.add_parser("import", help="匯入血糖機匯出的 CSV")
+    import_parser.add_argument("file")
+    import_parser.add_argument("--user", required=True)
+    import_parser.add_argument("--unit", choices=["mgdl", "mmol"], default="mgdl", help="數值欄位的單位")
+    import_parser.add_argument("--day-first", action="store_true", help="日期為 DD/MM/YYYY（預設 MM/DD/YYYY）")
+    import_parser.add_argument("--encoding", default="utf-8")
+    import_parser.add_argument("--batch-size", type=int, default=CSV_BATCH_SIZE)
+    export_parser = commands.add_parser("export", help="匯出成 CSV")
+    export_parser.add_argument("--user", required=True)
+    export_parser.add_argument("--start", default=EXPORT_START)
+    export_parser.add_argument("--end", default=datetime.now(TZ).strftime("%Y-%m-%d"))
+    export_parser.add_argument("-o", "--output", help="輸出檔（預設為標準輸出）")
+    args = parser.parse_args()
+
+    if args.command == "import":
+        total = os.path.getsize(args.file)
+
+        def report(stats):
+            print(f"\r⏳ {stats['rows']} rows, {stats['inserted']} inserted "
+                  f"({stats['bytes_read'] * 100 // max(total, 1)}%)", end="", file=sys.stderr, flush=True)
+
+        with open(args.file, "rb") as f:
+            stats = import_csv(f, args.user, progress=report, batch_size=args.batch_size,
+                               unit="mmol" if args.unit == "mmol" else None, day_first=args.day_first,
+                               encoding=args.encoding, total_bytes=total)
+        print(file=sys.stderr)
+        for line, reason in stats["errors"]:
+            print(f"❌ line {line}: {reason}")
+        if stats["error"]:
+            raise SystemExit(stats["error"])
+        print(f"✅ Imported {stats['inserted']} readings ({stats['duplicates']} duplicates, "
+              f"{stats['invalid']} invalid rows) in {stats['elapsed']}s")
+    elif args.command == "export":
+        output = open(args.output, "w", encoding="utf-8", newline="") if args.output else sys.stdout
+        try:
+            for chunk in export_csv(args.user, args.start, args.end, bom=bool(args.output)):
+                output.write(chunk)
+        finally:
+            if args.output:
+                output.close()
+
+
+if __name__ == "__main__":
+    main()
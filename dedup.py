@@ -0,0 +1,133 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from sqlite_local import ThreadLocalConnection
+
+# webhook 事件去重：處理太慢時 LINE 會重送同一個事件（deliveryContext.isRedelivery），
+# 用 webhookEventId 記住處理過的事件，重送的直接回 200，不再寫入血糖或重畫圖表。
+#   memory：只存在目前的 process，重啟後就忘記
+#   sqlite：存在 SQLite 檔，重啟或多個 worker process 都能認出重送的事件
+# 用 DEDUP_BACKEND 選擇後端；只記住 DEDUP_WINDOW 秒內、最多 DEDUP_MAX_ENTRIES 筆。
+
+DEDUP_BACKEND = os.getenv("DEDUP_BACKEND", "memory")
+DEDUP_DB = os.getenv("DEDUP_DB", "webhook_events.db")
+DEDUP_WINDOW = float(os.getenv("DEDUP_WINDOW", "86400"))
+DEDUP_MAX_ENTRIES = int(os.getenv("DEDUP_MAX_ENTRIES", "100000"))
+
+logger = logging.getLogger(__name__)
+
+
+class MemorySeenSet:
+    def __init__(self, window=DEDUP_WINDOW, max_entries=DEDUP_MAX_ENTRIES):
+        self.window = window
+        self.max_entries = max_entries
+        self._seen = OrderedDict()  # event id -> 第一次看到的時間，依時間排序
+        self._lock = threading.Lock()
+
+    def add(self, event_id, now):
+        """第一次看到回傳 True，看過回傳 False"""
+        with self._lock:
+            # 最舊的在最前面，過期或超過數量的從前面移除
+            while self._seen and (len(self._seen) >= self.max_entries
+                                  or next(iter(self._seen.values())) + self.window < now):
+                self._seen.popitem(last=False)
+            if event_id in self._seen:
+                return False
+            self._seen[event_id] = now
+            return True
+
+    def __len__(self):
+        return len(self._seen)
+
+
+class SQLiteSeenSet:
+    def __init__(self, path=DEDUP_DB, window=DEDUP_WINDOW, max_entries=DEDUP_MAX_ENTRIES):
+        self.path = path
+        self.window = window
+        self.max_entries = max_entries
+        self._conn = ThreadLocalConnection(path)
+        self._writes = 0
+        self._conn().execute("""
+            CREATE TABLE IF NOT EXISTS seen_events (
+                event_id TEXT PRIMARY KEY,
+                seen_at REAL NOT NULL
+            )
+        """)
+        self._conn().execute("CREATE INDEX IF NOT EXISTS idx_seen_events_seen_at ON seen_events (seen_at)")
+
+    def add(self, event_id, now):
+        # 新事件或已過期的舊紀錄才會寫入，用 rowcount 判斷，多個 process 同時收到也只有一個成功
+        cursor = self._conn().execute(
+            "INSERT INTO seen_events (event_id, seen_at) VALUES (?, ?) "
+            "ON CONFLICT (event_id) DO UPDATE SET seen_at = excluded.seen_at WHERE seen_at < ?",
+            (event_id, now, now - self.window),
+        )
+        self._writes += 1
+        if self._writes % 1000 == 0:
+            self.prune(now)
+        return cursor.rowcount == 1
+
+    def prune(self, now=None):
+        """刪除超過時間窗的紀錄，數量仍超過上限時刪除最舊的"""
+        conn = self._conn()
+        conn.execute("DELETE FROM seen_events WHERE seen_at < ?", ((now or time.time()) - self.window,))
+        conn.execute(
+            "DELETE FROM seen_events WHERE event_id IN "
+            "(SELECT event_id FROM seen_events ORDER BY seen_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,),
+        )
+
+    def __len__(self):
+        return self._conn().execute("SELECT count(*) FROM seen_events").fetchone()[0]
+
+
+class EventDeduplicator:
+    def __init__(self, seen):
+        self.seen = seen
+        self._lock = threading.Lock()
+        self.counters = {"checked": 0, "suppressed": 0, "redelivered": 0, "without_id": 0}
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def is_duplicate(self, event):
+        event_id = getattr(event, "webhook_event_id", None)
+        self._count("checked")
+        if not event_id:
+            # 舊版 webhook 沒有事件 ID，無法判斷，照常處理
+            self._count("without_id")
+            return False
+        delivery_context = getattr(event, "delivery_context", None)
+        if getattr(delivery_context, "is_redelivery", False):
+            self._count("redelivered")
+        try:
+            duplicate = not self.seen.add(event_id, time.time())
+        except sqlite3.Error as e:
+            # 去重失敗時寧可重複處理，也不要漏掉事件
+            logger.error("Failed to check webhook event %s: %s", event_id, e)
+            return False
+        if duplicate:
+            self._count("suppressed")
+            logger.warning("Skipping duplicate webhook event %s", event_id)
+        return duplicate
+
+    def filter(self, events):
+        """去掉已經處理過的事件"""
+        return [event for event in events if not self.is_duplicate(event)]
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters, tracked=len(self.seen))
+
+
+def get_deduplicator():
+    if DEDUP_BACKEND == "sqlite":
+        return EventDeduplicator(SQLiteSeenSet())
+    if DEDUP_BACKEND != "memory":
+        raise ValueError(f"❌ 未知的 DEDUP_BACKEND：{DEDUP_BACKEND}")
+    return EventDeduplicator(MemorySeenSet())
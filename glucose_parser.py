@@ -0,0 +1,172 @@
+import re
+from collections import namedtuple
+
+# 從自由輸入的文字（語音辨識結果、LIFF 手動輸入）解析出一筆血糖紀錄，例如：
+#   「早餐後 135」「血糖一百二」「晚上八點半 飯後 兩百」「7:30 空腹 98 mg/dL」
+# 正規表達式在 import 時編譯好，每則訊息只掃描幾次；沒有任何數字的訊息第一步就排除。
+# 不在對話狀態中的訊息必須帶有線索（「血糖」、餐別、時間或單位）才算紀錄，
+# 單獨的數字仍然走原本的流程（按「新增」後再輸入）。
+
+# 血糖機的量測範圍（mg/dL），超出範圍的數字不當成血糖值
+MIN_VALUE = 20
+MAX_VALUE = 600
+# 太長的訊息不是紀錄，直接略過
+MAX_LENGTH = 60
+
+# value：mg/dL；meal：「早餐後」「空腹」之類的標籤或 None；time：「HH:MM」或 None
+GlucoseEntry = namedtuple("GlucoseEntry", ["value", "meal", "time"])
+
+DIGITS = {"零": 0, "〇": 0, "一": 1, "二": 2, "兩": 2, "两": 2, "三": 3, "四": 4,
+          "五": 5, "六": 6, "七": 7, "八": 8, "九": 9}
+UNITS = {"十": 10, "百": 100, "千": 1000}
+_CN = "零〇一二兩两三四五六七八九十百千"
+# 分鐘只會用到的中文數字（「八點一百五」的「一百五」不是分鐘）
+_CN_MINUTE = "零〇一二兩两三四五六七八九十"
+
+# 全形數字與符號轉成半形（語音辨識常輸出全形）
+FULLWIDTH = str.maketrans("０１２３４５６７８９：．／", "0123456789:./")
+
+ANY_NUMBER = re.compile(rf"[\d{_CN}]")
+TIME = re.compile(
+    rf"(?P<period>早上|上午|中午|下午|傍晚|晚上|凌晨|半夜)?\s*"
+    rf"(?:(?P<h1>\d{{1,2}}):(?P<m1>\d{{2}})"
+    # 「高一點」「多一點」不是時間
+    rf"|(?<![高低多少快慢好差])(?P<h2>\d{{1,2}}|[{_CN}]{{1,3}})\s*[點点]"
+    # 分鐘緊接在「點」後面，或後面有「分」；「8點 135」的 135 是血糖值，不是分鐘
+    rf"(?:\s*(?P<half>半)"
+    rf"|(?P<m2>\d{{1,2}}|[{_CN_MINUTE}]{{1,3}})(?![\d{_CN}])\s*分?"
+    rf"|\s+(?P<m3>\d{{1,2}}|[{_CN_MINUTE}]{{1,3}})\s*分)?)"
+)
+MEAL = re.compile(
+    r"(?P<meal>早|午|中|晚)?[餐飯饭]\s*(?P<when>前|後|后)(?:\s*[一二兩两12]\s*個?\s*(?:小時|钟头|鐘頭))?"
+    r"|(?P<tag>空腹|睡前|起床)"
+)
+KEYWORD = re.compile(r"血糖|mg\s*/?\s*dl|毫克", re.IGNORECASE)
+# 提到其他量測值或用藥的訊息（「血壓 130」「打 20 單位胰島素」）不是血糖紀錄
+OTHER_MEASUREMENT = re.compile(r"血壓|體重|体重|心跳|心率|脈搏|血氧|體溫|体温|胰島素|胰岛素|藥|药")
+# 後面接著其他單位的數字（「散步 30 分鐘」「打 20 單位」「150 克飯」）不是血糖值
+NUMBER = re.compile(rf"(?P<number>\d+(?:\.\d+)?|[{_CN}]{{2,}})\s*"
+                    r"(?P<unit>分鐘|分钟|分|秒|小時|小时|步|顆|颗|粒|次|公斤|kg|公里|km|歲|岁|度|元|塊|块"
+                    r"|單位|单位|毫升|ml|大卡|卡|克|片|碗|[ug](?![a-z]))?",
+                    re.IGNORECASE)
+BARE_NUMBER = re.compile(rf"\s*(\d+|[{_CN}]+)\s*")
+
+MEAL_NAMES = {"早": "早餐", "午": "午餐", "中": "午餐", "晚": "晚餐", None: "餐"}
+AFTERNOON = {"下午", "傍晚", "晚上"}
+
+
+def chinese_to_int(text):
+    """中文數字轉整數：「一百二十五」→125、「一百二」→120、「兩百」→200、「一二五」→125
+
+    無法解析時回傳 None。
+    """
+    if text.isdigit():
+        return int(text)
+    if not any(ch in UNITS for ch in text):
+        # 逐字念的數字（「一二五」）
+        if all(ch in DIGITS for ch in text):
+            return int("".join(str(DIGITS[ch]) for ch in text))
+        return None
+    total = 0
+    digit = None
+    last_unit = None
+    for ch in text:
+        if ch in DIGITS:
+            if digit is not None and digit != 0:
+                return None
+            digit = DIGITS[ch]
+        elif ch in UNITS:
+            unit = UNITS[ch]
+            if last_unit is not None and unit >= last_unit:
+                return None
+            total += (1 if digit is None else digit) * unit
+            digit = None
+            last_unit = unit
+        else:
+            return None
+    if digit:
+        # 「一百二」是一百二十的省略說法；「一百零二」中間有零則是個位數
+        if last_unit >= 100 and text[-2] in UNITS:
+            total += digit * last_unit // 10
+        else:
+            total += digit
+    return total
+
+
+def _parse_time(match):
+    if match.group("h1") is not None:
+        hour, minute = int(match.group("h1")), int(match.group("m1"))
+    else:
+        hour = chinese_to_int(match.group("h2"))
+        if match.group("half"):
+            minute = 30
+        elif match.group("m2") or match.group("m3"):
+            minute = chinese_to_int(match.group("m2") or match.group("m3"))
+        else:
+            minute = 0
+    if hour is None or minute is None:
+        return None
+    period = match.group("period")
+    if period in AFTERNOON and hour < 12:
+        hour += 12
+    elif period == "中午" and hour < 11:
+        hour += 12
+    elif period in ("凌晨", "半夜") and hour == 12:
+        hour = 0
+    if not (0 <= hour <= 23 and 0 <= minute <= 59):
+        return None
+    return f"{hour:02d}:{minute:02d}"
+
+
+def _cut(text, match):
+    return text[:match.start()] + " " + text[match.end():]
+
+
+def parse_entry(text, require_cue=True):
+    """解析一筆血糖紀錄，不是紀錄（或數值不明確）時回傳 None
+
+    require_cue=False 時單獨的數字也算（等待輸入血糖值的對話狀態使用）。
+    """
+    text = text.translate(FULLWIDTH)
+    if len(text) > MAX_LENGTH or not ANY_NUMBER.search(text) or OTHER_MEASUREMENT.search(text):
+        return None
+    if not require_cue:
+        match = BARE_NUMBER.fullmatch(text)
+        if match:
+            value = chinese_to_int(match.group(1))
+            return GlucoseEntry(value, None, None) if _in_range(value) else None
+
+    cue = False
+    entry_time = None
+    match = TIME.search(text)
+    if match:
+        entry_time = _parse_time(match)
+        if entry_time is not None:
+            text = _cut(text, match)
+            cue = True
+    meal = None
+    match = MEAL.search(text)
+    if match:
+        meal = match.group("tag") or MEAL_NAMES[match.group("meal")] + match.group("when").replace("后", "後")
+        text = _cut(text, match)
+        cue = True
+    if KEYWORD.search(text):
+        text = KEYWORD.sub(" ", text)
+        cue = True
+    if require_cue and not cue:
+        return None
+
+    values = set()
+    for number, unit in NUMBER.findall(text):
+        if unit:
+            continue
+        value = None if "." in number else chinese_to_int(number)
+        if _in_range(value):
+            values.add(value)
+    if len(values) != 1:
+        return None
+    return GlucoseEntry(values.pop(), meal, entry_time)
+
+
+def _in_range(value):
+    return value is not None and MIN_VALUE <= value <= MAX_VALUE
@@ -0,0 +1,159 @@
+import os
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from blood_sugar_store import TARGET_LOW, TARGET_HIGH
+
+# 區間報表（最近一週、自選日期起到今天）的統計。
+# 紀錄先轉成 NumPy 陣列再一次算完，90 天、365 天的區間也不用逐筆迴圈。
+# 區間超過 REPORT_RAW_SCAN_DAYS 天且後端有每日統計（daily_summary）時改用 summarize_daily，每天只讀一列；
+# 每日統計沒辦法算百分位數，這時報表會註明。
+
+MAX_REPORT_DAYS = 365
+# 天數超過這個值就不逐日列出平均，避免訊息太長
+MAX_DAILY_LINES = 14
+# 這個天數以內逐筆計算（含中位數與百分位數），更長的區間才用每日統計
+REPORT_RAW_SCAN_DAYS = int(os.getenv("REPORT_RAW_SCAN_DAYS", "90"))
+
+
+def to_arrays(records, start_date):
+    """把紀錄轉成 (距離 start_date 的天數, 血糖值) 兩個陣列，依天數排序"""
+    start = np.datetime64(start_date, "D")
+    days = np.array([record["date"] for record in records], dtype="datetime64[D]")
+    values = np.fromiter((float(record["value"]) for record in records), dtype=float, count=len(records))
+    day_index = (days - start).astype(np.int64)
+    order = np.argsort(day_index, kind="stable")
+    return day_index[order], values[order]
+
+
+def _num_days(start_date, end_date):
+    return (datetime.strptime(end_date, "%Y-%m-%d") - datetime.strptime(start_date, "%Y-%m-%d")).days + 1
+
+
+def use_daily_summaries(start_date, end_date):
+    """區間夠長時才值得用每日統計（少了百分位數）"""
+    return _num_days(start_date, end_date) > REPORT_RAW_SCAN_DAYS
+
+
+def summarize(records, start_date, end_date):
+    num_days = _num_days(start_date, end_date)
+    day_index, values = to_arrays(records, start_date)
+
+    counts = np.bincount(day_index, minlength=num_days)
+    sums = np.bincount(day_index, weights=values, minlength=num_days)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        daily_mean = sums / counts
+
+    # 已排序，所以每一天的紀錄是連續的一段，用 reduceat 取每天的最小／最大值
+    daily_min = np.full(num_days, np.nan)
+    daily_max = np.full(num_days, np.nan)
+    if len(values):
+        present = np.flatnonzero(counts)
+        starts = np.concatenate(([0], np.cumsum(counts[present])[:-1]))
+        daily_min[present] = np.minimum.reduceat(values, starts)
+        daily_max[present] = np.maximum.reduceat(values, starts)
+
+    stats = {
+        "start_date": start_date,
+        "end_date": end_date,
+        "num_days": num_days,
+        "days_with_data": int(np.count_nonzero(counts)),
+        "count": int(len(values)),
+        "daily_mean": daily_mean,
+        "daily_min": daily_min,
+        "daily_max": daily_max,
+    }
+    if len(values) == 0:
+        return stats
+
+    mean = values.mean()
+    stats.update({
+        "mean": float(mean),
+        "min": float(values.min()),
+        "max": float(values.max()),
+        "percentiles": dict(zip((10, 25, 50, 75, 90), np.percentile(values, [10, 25, 50, 75, 90]).tolist())),
+        "time_in_range": float(np.mean((values >= TARGET_LOW) & (values <= TARGET_HIGH)) * 100),
+        "time_below_range": float(np.mean(values < TARGET_LOW) * 100),
+        "time_above_range": float(np.mean(values > TARGET_HIGH) * 100),
+        "cv": float(values.std() / mean * 100) if mean else 0.0,
+    })
+    return stats
+
+
+def summarize_daily(rows, start_date, end_date):
+    """用每日統計列計算報表，結果格式與 summarize 相同（但沒有百分位數，from_summaries 為 True）"""
+    num_days = _num_days(start_date, end_date)
+    start = np.datetime64(start_date, "D")
+    day_index = (np.array([row["day"] for row in rows], dtype="datetime64[D]") - start).astype(np.int64)
+
+    def column(name):
+        return np.array([row[name] for row in rows], dtype=float)
+
+    counts, totals, totals_sq = column("count"), column("total"), column("total_sq")
+    daily_mean = np.full(num_days, np.nan)
+    daily_min = np.full(num_days, np.nan)
+    daily_max = np.full(num_days, np.nan)
+    daily_mean[day_index] = totals / counts
+    daily_min[day_index] = column("min")
+    daily_max[day_index] = column("max")
+
+    count = int(counts.sum())
+    stats = {
+        "start_date": start_date,
+        "end_date": end_date,
+        "num_days": num_days,
+        "days_with_data": len(rows),
+        "count": count,
+        "daily_mean": daily_mean,
+        "daily_min": daily_min,
+        "daily_max": daily_max,
+        "from_summaries": True,
+    }
+    if count == 0:
+        return stats
+
+    mean = totals.sum() / count
+    # 母體變異數 = E[x²] - E[x]²，和 summarize 的 values.std() 相同
+    std = np.sqrt(max(totals_sq.sum() / count - mean * mean, 0.0))
+    stats.update({
+        "mean": float(mean),
+        "min": float(np.nanmin(daily_min)),
+        "max": float(np.nanmax(daily_max)),
+        "time_in_range": float(column("in_range").sum() / count * 100),
+        "time_below_range": float(column("low").sum() / count * 100),
+        "time_above_range": float(column("high").sum() / count * 100),
+        "cv": float(std / mean * 100) if mean else 0.0,
+    })
+    return stats
+
+
+def format_report(stats, title):
+    message_text = f"{title}\n({stats['start_date']} ~ {stats['end_date']})\n"
+    if stats["count"] == 0:
+        return message_text + "這段期間還沒有記錄血糖喔!"
+
+    message_text += (
+        f"共 {stats['count']} 筆，{stats['days_with_data']}/{stats['num_days']} 天有紀錄\n"
+        f"平均 {stats['mean']:.0f} mg/dL（最低 {stats['min']:.0f}、最高 {stats['max']:.0f}）\n"
+    )
+    if "percentiles" in stats:
+        p = stats["percentiles"]
+        message_text += f"中位數 {p[50]:.0f}，25~75% 落在 {p[25]:.0f}~{p[75]:.0f}\n"
+    elif stats.get("from_summaries"):
+        message_text += f"（超過 {REPORT_RAW_SCAN_DAYS} 天的報表依每日統計計算，不含中位數）\n"
+    message_text += (
+        f"目標範圍內 ({TARGET_LOW}~{TARGET_HIGH}) {stats['time_in_range']:.0f}%\n"
+        f"偏低 {stats['time_below_range']:.0f}%、偏高 {stats['time_above_range']:.0f}%\n"
+        f"變異係數 CV {stats['cv']:.1f}%\n"
+    )
+    if stats["num_days"] <= MAX_DAILY_LINES:
+        message_text += "-------------\n"
+        start = datetime.strptime(stats["start_date"], "%Y-%m-%d")
+        for offset, mean in enumerate(stats["daily_mean"]):
+            if np.isnan(mean):
+                continue
+            day = (start + timedelta(days=offset)).strftime("%m/%d")
+            message_text += (f"🔹 {day} 平均 {mean:.0f}"
+                             f"（{stats['daily_min'][offset]:.0f}~{stats['daily_max'][offset]:.0f}）\n")
+    return message_text.rstrip("\n")
@@ -0,0 +1,121 @@
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import requests
+
+import line_client
+import metrics
+
+# LIFF 頁面呼叫 API 時用 liff.getIDToken() 取得的 ID token 證明使用者身分：
+#   Authorization: Bearer <ID token>
+# ID token 由 LINE 簽署，交給 LINE Login 的 verify 端點驗證簽章、期限與 client_id，取得 userId（sub）。
+# 驗證成功的結果快取到 token 過期為止，同一個頁面連續呼叫 API 只需驗證一次；快取以 token 的雜湊為 key。
+
+LIFF_ID = os.getenv("LIFF_ID", "2007818922-W21zlONn")
+# LIFF app 所屬 LINE Login channel 的 ID（LIFF ID 的前半段）
+LIFF_CHANNEL_ID = os.getenv("LIFF_CHANNEL_ID", LIFF_ID.split("-")[0])
+LIFF_VERIFY_ENDPOINT = os.getenv("LIFF_VERIFY_ENDPOINT", f"{line_client.LINE_API_ENDPOINT}/oauth2/v2.1/verify")
+LIFF_TOKEN_CACHE_SIZE = int(os.getenv("LIFF_TOKEN_CACHE_SIZE", "10000"))
+LIFF_VERIFY_TIMEOUT = float(os.getenv("LIFF_VERIFY_TIMEOUT", "5"))
+
+logger = logging.getLogger(__name__)
+
+
+class AuthError(Exception):
+    pass
+
+
+class VerificationUnavailable(AuthError):
+    """連不上 verify 端點；token 不一定無效"""
+
+
+class IdTokenVerifier:
+    def __init__(self, channel_id=LIFF_CHANNEL_ID, endpoint=LIFF_VERIFY_ENDPOINT, max_entries=LIFF_TOKEN_CACHE_SIZE):
+        self.channel_id = channel_id
+        self.endpoint = endpoint
+        self.max_entries = max_entries
+        self._cache = OrderedDict()  # sha256(token) -> (user_id, 過期時間)
+        self._lock = threading.Lock()
+        self._session = None
+        self._pid = None
+        self.hits = 0
+        self.verified = 0
+        self.rejected = 0
+
+    @property
+    def session(self):
+        # requests.Session 的連線不能跨 fork 共用
+        if self._pid != os.getpid():
+            self._session = requests.Session()
+            self._pid = os.getpid()
+        return self._session
+
+    def verify(self, id_token):
+        """回傳 ID token 的 userId；無效或過期時拋出 AuthError"""
+        if not id_token:
+            raise AuthError("Missing ID token")
+        key = hashlib.sha256(id_token.encode("utf-8")).digest()
+        now = time.time()
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is not None:
+                if entry[1] > now:
+                    self._cache.move_to_end(key)
+                    self.hits += 1
+                    return entry[0]
+                del self._cache[key]
+
+        user_id, expires_at = self._verify_remote(id_token)
+        with self._lock:
+            self._cache[key] = (user_id, expires_at)
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+            self.verified += 1
+        return user_id
+
+    def _verify_remote(self, id_token):
+        with metrics.timed("liff_verify"):
+            try:
+                response = self.session.post(self.endpoint, data={"id_token": id_token, "client_id": self.channel_id},
+                                             timeout=LIFF_VERIFY_TIMEOUT)
+            except requests.RequestException as e:
+                logger.error("ID token verification request failed: %s", e)
+                raise VerificationUnavailable("Verification unavailable")
+        try:
+            payload = response.json()
+        except ValueError:
+            payload = {}
+        if response.status_code != 200:
+            with self._lock:
+                self.rejected += 1
+            raise AuthError(payload.get("error_description") or f"Verification failed ({response.status_code})")
+        user_id = payload.get("sub")
+        if not user_id or str(payload.get("aud")) != str(self.channel_id):
+            with self._lock:
+                self.rejected += 1
+            raise AuthError("ID token was not issued for this channel")
+        return user_id, float(payload.get("exp", time.time()))
+
+    def stats(self):
+        with self._lock:
+            return {
+                "cached": len(self._cache),
+                "hits": self.hits,
+                "verified": self.verified,
+                "rejected": self.rejected,
+            }
+
+
+verifier = IdTokenVerifier()
+
+
+def bearer_token(headers):
+    """從 Authorization 標頭取出 Bearer token，沒有時回傳 None"""
+    scheme, _, token = headers.get("Authorization", "").partition(" ")
+    if scheme.lower() != "bearer":
+        return None
+    return token.strip() or None
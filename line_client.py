@@ -0,0 +1,119 @@
+import asyncio
+import functools
+import logging
+import os
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from linebot import LineBotApi
+from linebot.http_client import RequestsHttpClient, RequestsHttpResponse
+
+# 對 LINE Messaging API 的連線：
+#   create_line_bot_api：同步 LineBotApi，共用 requests.Session 的 keep-alive 連線池
+#   AsyncLineClient：aiohttp + asyncio，在一個背景執行緒的 event loop 上同時送出大量回覆
+# LINE_API_ENDPOINT 可以指向本機的 line_stub_server.py 做測試。
+
+LINE_API_ENDPOINT = os.getenv("LINE_API_ENDPOINT", "https://api.line.me")
+LINE_HTTP_POOL_SIZE = int(os.getenv("LINE_HTTP_POOL_SIZE", "16"))
+LINE_HTTP_CONNECT_TIMEOUT = float(os.getenv("LINE_HTTP_CONNECT_TIMEOUT", "3"))
+LINE_HTTP_READ_TIMEOUT = float(os.getenv("LINE_HTTP_READ_TIMEOUT", "10"))
+# 閒置的 keep-alive 連線保留多久（秒），只用於 aiohttp
+LINE_HTTP_KEEPALIVE = float(os.getenv("LINE_HTTP_KEEPALIVE", "60"))
+
+logger = logging.getLogger(__name__)
+
+
+class PooledHttpClient(RequestsHttpClient):
+    """共用 Session 的 HttpClient，連線會被重複使用，不必每次重新 TLS 握手"""
+
+    def __init__(self, timeout=RequestsHttpClient.DEFAULT_TIMEOUT, pool_size=LINE_HTTP_POOL_SIZE):
+        super(PooledHttpClient, self).__init__(timeout)
+        self.session = requests.Session()
+        # pool_block：連線都在使用中時等待，而不是另開一條用完即丟的連線
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=pool_size, pool_block=True)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def get(self, url, headers=None, params=None, stream=False, timeout=None):
+        response = self.session.get(url, headers=headers, params=params, stream=stream,
+                                    timeout=timeout or self.timeout)
+        return RequestsHttpResponse(response)
+
+    def post(self, url, headers=None, data=None, timeout=None):
+        response = self.session.post(url, headers=headers, data=data, timeout=timeout or self.timeout)
+        return RequestsHttpResponse(response)
+
+    def delete(self, url, headers=None, data=None, timeout=None):
+        response = self.session.delete(url, headers=headers, data=data, timeout=timeout or self.timeout)
+        return RequestsHttpResponse(response)
+
+    def put(self, url, headers=None, data=None, timeout=None):
+        response = self.session.put(url, headers=headers, data=data, timeout=timeout or self.timeout)
+        return RequestsHttpResponse(response)
+
+
+def create_line_bot_api(channel_access_token, pool_size=LINE_HTTP_POOL_SIZE, endpoint=LINE_API_ENDPOINT):
+    return LineBotApi(
+        channel_access_token,
+        endpoint=endpoint,
+        timeout=(LINE_HTTP_CONNECT_TIMEOUT, LINE_HTTP_READ_TIMEOUT),
+        http_client=functools.partial(PooledHttpClient, pool_size=pool_size),
+    )
+
+
+class AsyncLineClient:
+    """在背景 event loop 上執行 AsyncLineBotApi
+
+    reply_message / push_message 不會阻塞呼叫的執行緒，回傳 concurrent.futures.Future。
+    同時進行的請求數由 aiohttp 連線池大小限制，不需要一個請求一條執行緒。
+    需要安裝 aiohttp。
+    """
+
+    def __init__(self, channel_access_token, pool_size=LINE_HTTP_POOL_SIZE, endpoint=LINE_API_ENDPOINT):
+        self.channel_access_token = channel_access_token
+        self.pool_size = pool_size
+        self.endpoint = endpoint
+        self.api = None
+        self._loop = None
+        self._session = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._loop = asyncio.new_event_loop()
+            threading.Thread(target=self._loop.run_forever, name="line-async-client", daemon=True).start()
+            asyncio.run_coroutine_threadsafe(self._open(), self._loop).result()
+            self._pid = os.getpid()
+            logger.info("Started async LINE client with %d connections", self.pool_size)
+
+    async def _open(self):
+        import aiohttp
+        from linebot import AsyncLineBotApi
+        from linebot.aiohttp_async_http_client import AiohttpAsyncHttpClient
+
+        connector = aiohttp.TCPConnector(limit=self.pool_size, keepalive_timeout=LINE_HTTP_KEEPALIVE)
+        timeout = aiohttp.ClientTimeout(sock_connect=LINE_HTTP_CONNECT_TIMEOUT, sock_read=LINE_HTTP_READ_TIMEOUT)
+        self._session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+        http_client = AiohttpAsyncHttpClient(self._session, timeout=LINE_HTTP_CONNECT_TIMEOUT + LINE_HTTP_READ_TIMEOUT)
+        self.api = AsyncLineBotApi(self.channel_access_token, http_client, endpoint=self.endpoint)
+
+    def _submit(self, coro_factory):
+        self.start()
+        return asyncio.run_coroutine_threadsafe(coro_factory(), self._loop)
+
+    def reply_message(self, reply_token, messages):
+        return self._submit(lambda: self.api.reply_message(reply_token, messages))
+
+    def push_message(self, to, messages):
+        return self._submit(lambda: self.api.push_message(to, messages))
+
+    def close(self, timeout=10):
+        if self._pid != os.getpid():
+            return
+        asyncio.run_coroutine_threadsafe(self._session.close(), self._loop).result(timeout)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._pid = None
@@ -0,0 +1,217 @@
+import heapq
+import itertools
+import logging
+import os
+import random
+import threading
+import time
+from concurrent.futures import Future
+
+import requests
+from linebot.exceptions import LineBotApiError
+
+import app_logging
+import metrics
+
+# 所有送往 LINE 的回覆／推播都經過這裡：
+#   - token bucket 控制每秒請求數，不超過頻道的 API 上限；取不到 token 的訊息延後送出（不算重試）
+#   - 429 / 5xx / 連線錯誤放進重試佇列，指數退避加上隨機抖動
+#   - reply token 過期或無效時改用 push_message
+#   - 統計成功、限流、延後、重試、改推播、放棄的次數
+
+# LINE 訊息 API 上限為每秒 2,000 次（整個頻道），多個 worker process 時請依數量分配
+LINE_RATE_LIMIT = float(os.getenv("LINE_RATE_LIMIT", "2000"))
+LINE_RATE_BURST = float(os.getenv("LINE_RATE_BURST", str(LINE_RATE_LIMIT)))
+LINE_MAX_RETRIES = int(os.getenv("LINE_MAX_RETRIES", "5"))
+LINE_RETRY_BASE_DELAY = float(os.getenv("LINE_RETRY_BASE_DELAY", "0.5"))
+LINE_RETRY_MAX_DELAY = float(os.getenv("LINE_RETRY_MAX_DELAY", "30"))
+# 取不到 token 時最多等多久，超過就改放進重試佇列，不卡住 worker
+LINE_RATE_WAIT = float(os.getenv("LINE_RATE_WAIT", "0.2"))
+# reply token 只能在事件發生後短時間內使用，超過這個秒數就改用 push_message
+REPLY_TOKEN_MAX_AGE = float(os.getenv("REPLY_TOKEN_MAX_AGE", "50"))
+# reply token 已使用或過期時 LINE 回 400 的錯誤訊息
+INVALID_REPLY_TOKEN = "Invalid reply token"
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _take(self):
+        """有 token 就取走並回傳 0，否則回傳還要等幾秒"""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0.0
+            return (1 - self.tokens) / self.rate
+
+    def acquire(self, timeout):
+        deadline = time.monotonic() + timeout
+        while True:
+            wait = self._take()
+            if wait == 0:
+                return True
+            if time.monotonic() + wait > deadline:
+                return False
+            time.sleep(wait)
+
+
+class _Job:
+    __slots__ = ("reply_token", "user_id", "messages", "event_time", "attempt", "request_id", "route")
+
+    def __init__(self, reply_token, user_id, messages, event_time):
+        self.reply_token = reply_token
+        self.user_id = user_id
+        self.messages = messages
+        self.event_time = event_time
+        self.attempt = 0
+        # 重試在別的執行緒進行，記下原本請求的 ID 讓日誌串得起來
+        self.request_id = app_logging.get_request_id()
+        self.route = metrics.current_route.get()
+
+    def use_push(self):
+        # 改用推播之後就不再使用 reply token
+        self.reply_token = None
+
+
+class OutboundDispatcher:
+    def __init__(self, api, rate=LINE_RATE_LIMIT, burst=LINE_RATE_BURST, max_retries=LINE_MAX_RETRIES,
+                 base_delay=LINE_RETRY_BASE_DELAY, max_delay=LINE_RETRY_MAX_DELAY, rate_wait=LINE_RATE_WAIT):
+        self.api = api
+        self.bucket = TokenBucket(rate, burst)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.rate_wait = rate_wait
+        self._retries = []  # (到期時間, 序號, job)
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._pid = None
+        # throttled：LINE 回 429；deferred：本機速率限制延後送出
+        self.counters = {"sent": 0, "throttled": 0, "deferred": 0, "retried": 0, "fallback_push": 0, "dropped": 0}
+
+    def _count(self, name):
+        with self._cond:
+            self.counters[name] += 1
+
+    def send(self, reply_token, user_id, messages, event_time=None):
+        """送出回覆；失敗可重試時會在背景重送，這裡不會拋出例外"""
+        self._attempt(_Job(reply_token, user_id, messages, event_time))
+
+    def _attempt(self, job):
+        age = time.time() - job.event_time if job.event_time else 0
+        if job.reply_token and job.user_id and age > REPLY_TOKEN_MAX_AGE:
+            logger.warning("Reply token is %.1fs old, pushing message to %s", age, job.user_id)
+            self._fallback(job)
+        if not self.bucket.acquire(self.rate_wait):
+            # 本機的速率限制：還沒送到 LINE，不算重試、不佔 max_retries
+            self._count("deferred")
+            self._enqueue(job, random.uniform(self.rate_wait, 2 * self.rate_wait))
+            return
+        stage = "reply_message" if job.reply_token else "push_message"
+        start = time.perf_counter()
+        try:
+            if job.reply_token:
+                result = self.api.reply_message(job.reply_token, job.messages)
+            else:
+                result = self.api.push_message(job.user_id, job.messages)
+        except Exception as e:
+            metrics.observe(stage, time.perf_counter() - start, error=True, route=job.route)
+            self._on_error(job, e)
+            return
+        if isinstance(result, Future):  # AsyncLineClient
+            result.add_done_callback(lambda future: self._on_done(job, future, stage, start))
+        else:
+            metrics.observe(stage, time.perf_counter() - start, route=job.route)
+            self._count("sent")
+
+    def _on_done(self, job, future, stage, start):
+        error = future.exception()
+        metrics.observe(stage, time.perf_counter() - start, error=error is not None, route=job.route)
+        if error is None:
+            self._count("sent")
+            return
+        with app_logging.request_context(job.request_id):
+            self._on_error(job, error)
+
+    def _on_error(self, job, error):
+        status = getattr(error, "status_code", None)
+        if (isinstance(error, LineBotApiError) and status == 400 and job.reply_token and job.user_id
+                and getattr(error.error, "message", None) == INVALID_REPLY_TOKEN):
+            # reply token 已被使用或過期；可能在 event loop 執行緒裡，交給重試執行緒送出
+            # （訊息內容有誤也是 400，改用 push 一樣會失敗，不重送）
+            logger.warning("Reply failed (%s), pushing message to %s", error, job.user_id)
+            self._fallback(job)
+            self._schedule(job, 0)
+            return
+        retryable = (isinstance(error, (requests.ConnectionError, requests.Timeout, OSError))
+                     or status == 429 or (status is not None and status >= 500))
+        if not retryable:
+            self._drop(job, str(error))
+            return
+        if status == 429:
+            self._count("throttled")
+        delay = self._backoff(job)
+        retry_after = (getattr(error, "headers", None) or {}).get("Retry-After")
+        if retry_after and retry_after.isdigit():
+            delay = max(delay, float(retry_after))
+        self._schedule(job, delay)
+
+    def _fallback(self, job):
+        job.use_push()
+        self._count("fallback_push")
+
+    def _drop(self, job, reason):
+        self._count("dropped")
+        logger.error("Dropped message to %s after %d retries: %s", job.user_id, job.attempt, reason)
+
+    def _backoff(self, job):
+        # full jitter：0 到 base * 2^n 之間隨機，避免大家同時重試
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** job.attempt))
+
+    def _schedule(self, job, delay):
+        if job.attempt >= self.max_retries:
+            self._drop(job, "too many retries")
+            return
+        job.attempt += 1
+        self._count("retried")
+        self._enqueue(job, delay)
+
+    def _enqueue(self, job, delay):
+        self._start()
+        with self._cond:
+            heapq.heappush(self._retries, (time.monotonic() + delay, next(self._seq), job))
+            self._cond.notify()
+
+    def _start(self):
+        with self._cond:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._retries = []
+        threading.Thread(target=self._run_retries, name="line-outbound-retry", daemon=True).start()
+
+    def _run_retries(self):
+        while True:
+            with self._cond:
+                while not self._retries or self._retries[0][0] > time.monotonic():
+                    self._cond.wait(self._retries[0][0] - time.monotonic() if self._retries else None)
+                _, _, job = heapq.heappop(self._retries)
+            with app_logging.request_context(job.request_id):
+                try:
+                    self._attempt(job)
+                except Exception as e:
+                    logger.exception("Error while retrying LINE message: %s", e)
+
+    def stats(self):
+        with self._cond:
+            return dict(self.counters, pending_retries=len(self._retries))
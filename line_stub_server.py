@@ -0,0 +1,134 @@
+import argparse
+import json
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl
+
+# 模擬 LINE Messaging API 的 reply / push 端點，測試和壓測時把 LINE_API_ENDPOINT 指到這裡：
+#   python line_stub_server.py --port 8081
+#   LINE_API_ENDPOINT=http://127.0.0.1:8081 python main.py
+# 也模擬 LINE Login 的 ID token 驗證：以 userId（U 開頭）當作 ID token 就會驗證成功。
+
+ENDPOINTS = {"/v2/bot/message/reply", "/v2/bot/message/push"}
+# 啟動檢查（line_api）呼叫 get_bot_info
+BOT_INFO_ENDPOINT = "/v2/bot/info"
+BOT_INFO = {"userId": "Ustub", "basicId": "@stub", "displayName": "LINE stub", "chatMode": "bot",
+            "markAsReadMode": "auto"}
+VERIFY_ENDPOINT = "/oauth2/v2.1/verify"
+
+
+class _Server(ThreadingHTTPServer):
+    # 預設的 listen backlog 只有 5，大量同時連線時會被重設
+    request_queue_size = 1024
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # client 關閉 keep-alive 連線不算錯誤
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class StubLineServer:
+    def __init__(self, host="127.0.0.1", port=0, delay=0.0):
+        self.delay = delay
+        self.requests = []  # (收到的時間, path, JSON body)
+        self._lock = threading.Lock()
+        self.server = _Server((host, port), self._handler_class())
+        self._thread = None
+
+    @property
+    def endpoint(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def _handler_class(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # HTTP/1.1 才會保持連線，可以用來確認 client 有重複使用連線
+            protocol_version = "HTTP/1.1"
+            # 標頭和內容分兩次寫出，開著 Nagle 演算法時 keep-alive 連線的每個請求會多等約 40 ms
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                if self.path != BOT_INFO_ENDPOINT:
+                    self._respond(404, {"message": "Not found"})
+                    return
+                if not self.headers.get("Authorization", "").startswith("Bearer "):
+                    self._respond(401, {"message": "Authentication failed"})
+                    return
+                self._respond(200, BOT_INFO)
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                if self.path == VERIFY_ENDPOINT:
+                    self._verify(dict(parse_qsl(body.decode("utf-8"))))
+                    return
+                if self.path not in ENDPOINTS:
+                    self._respond(404, {"message": "Not found"})
+                    return
+                if not self.headers.get("Authorization", "").startswith("Bearer "):
+                    self._respond(401, {"message": "Authentication failed"})
+                    return
+                if stub.delay:
+                    time.sleep(stub.delay)
+                with stub._lock:
+                    stub.requests.append((time.time(), self.path, json.loads(body or b"{}")))
+                self._respond(200, {})
+
+            def _verify(self, form):
+                with stub._lock:
+                    stub.requests.append((time.time(), self.path, form))
+                id_token = form.get("id_token", "")
+                if not (id_token.startswith("U") and form.get("client_id")):
+                    self._respond(400, {"error": "invalid_request", "error_description": "Invalid IdToken."})
+                    return
+                now = int(time.time())
+                self._respond(200, {"iss": "https://access.line.me", "sub": id_token, "aud": form["client_id"],
+                                    "iat": now, "exp": now + 3600})
+
+            def _respond(self, status, payload):
+                data = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def sent(self, path=None):
+        with self._lock:
+            return [request for request in self.requests if path is None or request[1] == path]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="LINE Messaging API stub server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--delay", type=float, default=0.0, help="每個請求額外延遲的秒數")
+    args = parser.parse_args()
+    stub = StubLineServer(args.host, args.port, args.delay)
+    print(f"✅ LINE stub server listening on {stub.endpoint}")
+    try:
+        stub.server.serve_forever()
+    except KeyboardInterrupt:
+        stub.stop()
+
+
+if __name__ == "__main__":
+    main()
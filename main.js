@@ -72,6 +72,9 @@ async function initLiff() {
 
         liffInited = true;
         console.log("[DEBUG] LIFF 初始化成功，已登入用戶");
+
+        // 載入血糖趨勢圖（不等待，失敗也不影響語音輸入）
+        loadChart(7);
         
         // 顯示用戶信息
         try {
@@ -303,6 +306,112 @@ manualInput.addEventListener('keypress', (e) => {
     }
 });
 
+// 血糖趨勢圖：向 /api/records 取得欄位式資料（t: Unix 秒, v: mg/dL），直接在手機上畫
+// 伺服器回應帶 ETag，瀏覽器重新整理時會自動帶 If-None-Match，資料沒變就只收到 304
+const API_BASE = (document.querySelector('meta[name="api-base"]') || {}).content || "";
+const TARGET_LOW = 70;
+const TARGET_HIGH = 180;
+const chartCanvas = document.getElementById('trendChart');
+const chartStatus = document.getElementById('chartStatus');
+const rangeBtns = document.querySelectorAll('.range-btn');
+
+function formatDate(date) {
+    const pad = n => String(n).padStart(2, "0");
+    return `${date.getFullYear()}-${pad(date.getMonth() + 1)}-${pad(date.getDate())}`;
+}
+
+// 區間太長時伺服器會分頁（next），依序取完
+async function fetchRecords(days) {
+    const end = new Date();
+    const start = new Date(end.getTime() - (days - 1) * 86400000);
+    const headers = { Authorization: `Bearer ${liff.getIDToken()}` };
+    const t = [];
+    const v = [];
+    let range = { start: formatDate(start), end: formatDate(end) };
+    while (range) {
+        const res = await fetch(`${API_BASE}/api/records?${new URLSearchParams(range)}`, { headers });
+        if (!res.ok) {
+            throw new Error(`HTTP ${res.status}`);
+        }
+        const page = await res.json();
+        t.push(...page.t);
+        v.push(...page.v);
+        range = page.next;
+    }
+    return { t, v, from: start.setHours(0, 0, 0, 0) / 1000, to: end.getTime() / 1000 };
+}
+
+function drawChart(data) {
+    // 依螢幕像素比放大畫布，線條才不會模糊
+    const ratio = window.devicePixelRatio || 1;
+    const width = chartCanvas.clientWidth;
+    const height = chartCanvas.clientHeight;
+    chartCanvas.width = width * ratio;
+    chartCanvas.height = height * ratio;
+    const ctx = chartCanvas.getContext('2d');
+    ctx.setTransform(ratio, 0, 0, ratio, 0, 0);
+    ctx.clearRect(0, 0, width, height);
+
+    const pad = { left: 32, right: 8, top: 8, bottom: 20 };
+    const minV = Math.min(50, ...data.v);
+    const maxV = Math.max(250, ...data.v);
+    const x = t => pad.left + (t - data.from) / (data.to - data.from) * (width - pad.left - pad.right);
+    const y = v => height - pad.bottom - (v - minV) / (maxV - minV) * (height - pad.top - pad.bottom);
+
+    // 目標範圍
+    ctx.fillStyle = "rgba(72, 187, 120, 0.12)";
+    ctx.fillRect(pad.left, y(TARGET_HIGH), width - pad.left - pad.right, y(TARGET_LOW) - y(TARGET_HIGH));
+    ctx.fillStyle = "#4a5568";
+    ctx.font = "10px sans-serif";
+    ctx.textAlign = "right";
+    [TARGET_LOW, TARGET_HIGH].forEach(value => ctx.fillText(value, pad.left - 4, y(value) + 3));
+    ctx.textAlign = "left";
+    ctx.fillText(formatDate(new Date(data.from * 1000)).slice(5), pad.left, height - 6);
+    ctx.textAlign = "right";
+    ctx.fillText(formatDate(new Date(data.to * 1000)).slice(5), width - pad.right, height - 6);
+
+    ctx.strokeStyle = "#4299e1";
+    ctx.lineWidth = 1.5;
+    ctx.beginPath();
+    data.t.forEach((t, i) => i ? ctx.lineTo(x(t), y(data.v[i])) : ctx.moveTo(x(t), y(data.v[i])));
+    ctx.stroke();
+    data.t.forEach((t, i) => {
+        const value = data.v[i];
+        ctx.fillStyle = value < TARGET_LOW || value > TARGET_HIGH ? "#e53e3e" : "#2c5282";
+        ctx.beginPath();
+        ctx.arc(x(t), y(value), 2.5, 0, Math.PI * 2);
+        ctx.fill();
+    });
+}
+
+async function loadChart(days) {
+    rangeBtns.forEach(btn => btn.classList.toggle('active', Number(btn.dataset.days) === days));
+    chartStatus.textContent = "載入中...";
+    try {
+        const data = await fetchRecords(days);
+        drawChart(data);
+        if (!data.v.length) {
+            chartStatus.textContent = "這段期間尚無血糖紀錄";
+            return;
+        }
+        const average = data.v.reduce((sum, value) => sum + value, 0) / data.v.length;
+        const inRange = data.v.filter(value => value >= TARGET_LOW && value <= TARGET_HIGH).length;
+        chartStatus.textContent = `共 ${data.v.length} 筆，平均 ${Math.round(average)} mg/dL，` +
+            `目標範圍內 ${Math.round(inRange / data.v.length * 100)}%`;
+    } catch (e) {
+        console.error("[DEBUG] 載入血糖紀錄失敗", e);
+        chartStatus.textContent = "無法載入血糖紀錄";
+    }
+}
+
+rangeBtns.forEach(btn => {
+    btn.addEventListener('click', () => {
+        if (liffInited) {
+            loadChart(Number(btn.dataset.days));
+        }
+    });
+});
+
 // 4. 啟動 LIFF
 window.onload = () => {
     console.log("[DEBUG] window.onload 執行");
@@ -1,18 +1,38 @@
-from flask import Flask, request
-from linebot import LineBotApi, WebhookHandler
+from flask import Flask, Response, request, jsonify, stream_with_context
 from linebot.models import (
     MessageEvent, TextMessage, TextSendMessage, PostbackEvent,
     QuickReply, QuickReplyButton, DatetimePickerAction, PostbackAction
 )
-from linebot.exceptions import InvalidSignatureError, LineBotApiError
 import os
-from datetime import datetime
+from datetime import datetime, timedelta
 from linebot.models import ImageSendMessage
 import pytz
-import blood_sugar
-import hmac
-import hashlib
-import base64
+import blood_sugar_cache
+import glucose_parser
+import liff_auth
+import records_api
+import chart_cache
+import chart_renderer
+import atexit
+import logging
+import sys
+import threading
+from webhook_worker import WebhookWorkerPool
+from webhook_parser import WebhookParser, InvalidPayloadError
+import line_client
+import line_outbound
+import session_state
+import dedup
+from session_state import SessionState
+from router import Router
+import startup
+import metrics
+import app_logging
+
+# 日誌交給背景執行緒寫出，並遮蔽權杖與使用者 ID
+app_logging.setup_logging()
+atexit.register(app_logging.shutdown_logging)  # 最後才執行，把其他元件關閉時的日誌也寫完
+logger = logging.getLogger("main")
 
 # 設定 Flask 伺服器
 app = Flask(__name__)
@@ -21,74 +41,136 @@ app = Flask(__name__)
 LINE_CHANNEL_ACCESS_TOKEN = os.getenv("LINE_CHANNEL_ACCESS_TOKEN")
 LINE_CHANNEL_SECRET = os.getenv("LINE_CHANNEL_SECRET")
 
-# 檢查環境變數是否正確載入
-print(f"✅ Loaded LINE_CHANNEL_ACCESS_TOKEN: {LINE_CHANNEL_ACCESS_TOKEN}")
-print(f"✅ Loaded LINE_CHANNEL_SECRET: {LINE_CHANNEL_SECRET}")
-
+# 檢查環境變數是否正確載入（不要把權杖印到 log）
 if not LINE_CHANNEL_ACCESS_TOKEN:
     raise ValueError("❌ 環境變數 LINE_CHANNEL_ACCESS_TOKEN 未正確設定！")
 if not LINE_CHANNEL_SECRET:
     raise ValueError("❌ 環境變數 LINE_CHANNEL_SECRET 未正確設定！")
 
-line_bot_api = LineBotApi(LINE_CHANNEL_ACCESS_TOKEN)
-handler = WebhookHandler(LINE_CHANNEL_SECRET)
+# LINE_ASYNC_REPLY=1 時改由背景 event loop 送出回覆，不佔用 worker 執行緒等待回應
+LINE_ASYNC_REPLY = os.getenv("LINE_ASYNC_REPLY", "0") == "1"
+# LINE API client 在第一次用到時才建立（get_outbound / get_line_bot_api），import 時不連線
+line_bot_api = None
+async_line_client = None
+outbound = None
+_clients_lock = threading.Lock()
+# 簽名驗證與 JSON 解析一次完成（原始 bytes + constant-time 比對）
+webhook_parser = WebhookParser(LINE_CHANNEL_SECRET)
 
-# 儲存使用者狀態（判斷是否要記錄血糖）
-user_states = {}
+# 儲存使用者狀態（判斷是否要記錄血糖），會自動過期，可設定成多個 worker 共用
+sessions = session_state.get_session_store()
+
+# 記住處理過的 webhookEventId，LINE 重送同一事件時不會重複記錄血糖或重畫圖表
+deduplicator = dedup.get_deduplicator()
+
+# 事件依使用者分給背景 worker 平行處理（同一使用者依序執行）
+# WEBHOOK_ASYNC=1 時 /callback 驗證簽名後立即回 200，不等事件處理完
+WEBHOOK_ASYNC = os.getenv("WEBHOOK_ASYNC", "0") == "1"
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "4"))
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", "1000"))
+
+
+
+def _build_clients():
+    global line_bot_api, async_line_client, outbound
+    with _clients_lock:
+        if outbound is not None:
+            return
+        # 共用 keep-alive 連線池的 LINE API client
+        line_bot_api = line_client.create_line_bot_api(LINE_CHANNEL_ACCESS_TOKEN)
+        if LINE_ASYNC_REPLY:
+            async_line_client = line_client.AsyncLineClient(LINE_CHANNEL_ACCESS_TOKEN)
+        # 所有回覆都經過 outbound：限流、失敗重試、reply token 失效時改用推播
+        outbound = line_outbound.OutboundDispatcher(async_line_client or line_bot_api)
+
+
+def get_outbound():
+    if outbound is None:
+        _build_clients()
+    return outbound
+
+
+def get_line_bot_api():
+    if line_bot_api is None:
+        _build_clients()
+    return line_bot_api
+
+
+def _close_clients():
+    if async_line_client is not None:
+        async_line_client.close()
+
+
+# 啟動檢查（伺服器開始接受連線後才在背景執行，結果見 /health/ready）
+# 取代原本 import 時推播測試訊息的做法：只讀取 bot 資訊，不會發訊息給任何人
+@startup.checks.register("line_api", required=False)
+def check_line_api():
+    return get_line_bot_api().get_bot_info().display_name
+
+
+@startup.checks.register("storage")
+def check_storage():
+    store = blood_sugar_cache.store
+    store.ping()
+    return store.name
+
+
+# 預先載入報表與繪圖用的套件，第一個要報表的使用者不必等
+@startup.checks.register("report_modules", required=False)
+def warm_up_reports():
+    import glucose_report  # noqa: F401
+    chart_renderer.renderer.ping()
+    return chart_renderer.renderer.pool_size
 
-# 測試 LINE API 連線（啟動時發送一條測試訊息）
-try:
-    print("✅ Testing LINE API connection by sending a test message")
-    line_bot_api.push_message(
-        "U4743c3f8d1cfa0a7e6571e10fb2cf5d",  # 你的 user_id
-        TextSendMessage(text="這是一條測試訊息，確認 LINE API 是否正常")
-    )
-    print("✅ Test message sent successfully")
-except LineBotApiError as e:
-    print(f"❌ Failed to send test message: {str(e)}")
 
 @app.route("/callback", methods=["POST"])
 def callback():
     signature = request.headers.get("X-Line-Signature", "")
-    body = request.get_data(as_text=True)
-    print(f"✅ Server time: {datetime.now(pytz.timezone('Asia/Taipei')).strftime('%Y-%m-%d %H:%M:%S')}")
-    print(f"✅ Received request with signature: {signature}")
-    print(f"✅ Request body: {body}")
-
-    # 手動計算簽名
-    hash = hmac.new(LINE_CHANNEL_SECRET.encode('utf-8'), body.encode('utf-8'), hashlib.sha256).digest()
-    calculated_signature = base64.b64encode(hash).decode('utf-8')
-    print(f"✅ Calculated signature: {calculated_signature}")
-
-    if signature != calculated_signature:
-        print(f"❌ Signature mismatch! Expected: {calculated_signature}, Received: {signature}")
+    body = request.get_data()  # 原始 bytes，簽名就是對這些 bytes 計算的
+    # 完整內容只在 DEBUG 時抽樣記錄（LOG_BODY_SAMPLE_RATE）
+    app_logging.log_body(logger, "Webhook body: %s", body)
+
+    with metrics.timed("signature", route="webhook"):
+        verified = webhook_parser.verify(body, signature)
+    if not verified:
+        logger.warning("Signature mismatch, rejecting webhook")
         return "Invalid signature", 400
-
     try:
-        handler.handle(body, signature)
-    except InvalidSignatureError as e:
-        print(f"❌ InvalidSignatureError: {str(e)}")
-        return "Invalid signature", 400
-
-    print("✅ Returning HTTP 200 response")
+        with metrics.timed("parse", route="webhook"):
+            events = webhook_parser.parse_events(body)
+    except InvalidPayloadError as e:
+        logger.warning("%s", e)
+        return "Invalid payload", 400
+
+    rejected = worker_pool.submit(deduplicator.filter(events), wait=not WEBHOOK_ASYNC)
+    if rejected:
+        # 程式正在結束，worker 不再接收事件，直接在這個請求裡處理，避免事件遺失
+        logger.warning("Webhook workers stopped, handling %d events inline", len(rejected))
+        for event in rejected:
+            dispatch_event(event)
     return "OK", 200
 
+def reply_message(event, message):
+    # 事件在佇列等太久時 reply token 可能已失效，outbound 會依事件時間改用 push_message
+    get_outbound().send(event.reply_token, event.source.user_id, message, event_time=event.timestamp / 1000)
+
 #-----------------------訊息欄格式-------------------------------
 def create_blood_sugar_message(user_id, date_str):
     try:
         # 查詢指定日期的血糖紀錄
-        print(f"✅ Querying blood sugar for user {user_id} on date {date_str}")
-        records = blood_sugar.get_blood_sugar_by_date(user_id, date_str)
-        print(f"✅ Retrieved records: {records}")
+        records = blood_sugar_cache.get_blood_sugar_by_date(user_id, date_str)
+        logger.debug("Retrieved records for user %s on %s: %s", user_id, date_str, records)
 
         # 準備訊息內容
-        message_text = f"今日血糖紀錄\n({date_str})\n"
+        title = "今日血糖紀錄" if date_str == today_str() else "血糖紀錄"
+        message_text = f"{title}\n({date_str})\n"
         
         if isinstance(records, str):  # 如果返回錯誤訊息
             message_text += records
         elif records:  # 如果有紀錄
             for record in records:
-                message_text += f"🔹 {record['time']} - {record['value']} mg/dL\n"
+                meal = f"（{record['meal']}）" if record.get("meal") else ""
+                message_text += f"🔹 {record['time']} - {record['value']} mg/dL{meal}\n"
         else: 
             message_text += "尚無血糖紀錄！\n"
 
@@ -126,7 +208,7 @@ def create_blood_sugar_message(user_id, date_str):
 
         return TextSendMessage(text=message_text, quick_reply=quick_reply)
     except Exception as e:
-        print(f"❌ Error in create_blood_sugar_message: {str(e)}")
+        logger.exception("Error in create_blood_sugar_message: %s", e)
         return TextSendMessage(text=f"❌ 無法顯示血糖紀錄，錯誤：{str(e)}")
 
 #------------------------------個人報表相關----------------------------------------
@@ -159,17 +241,48 @@ def create_report_menu_message():
         ])
         return TextSendMessage(text="請選擇要查看的報表時間範圍：", quick_reply=quick_reply)
     except Exception as e:
-        print(f"❌ Error in create_report_menu_message: {str(e)}")
+        logger.exception("Error in create_report_menu_message: %s", e)
         return TextSendMessage(text=f"❌ 無法顯示報表選單，錯誤：{str(e)}")
 
+def create_summary_message(records, date_str):
+    # 報表圖暫時無法產生時使用的文字摘要
+    values = [record["value"] for record in records]
+    message_text = f"血糖摘要\n({date_str})\n"
+    message_text += f"共 {len(values)} 筆，平均 {sum(values) / len(values):.0f} mg/dL\n"
+    message_text += f"最高 {max(values)} mg/dL，最低 {min(values)} mg/dL\n"
+    for record in records:
+        message_text += f"🔹 {record['time']} - {record['value']} mg/dL\n"
+    message_text += "（圖表產生中斷，請稍後再試）"
+    return TextSendMessage(text=message_text)
+
 
+def create_range_report_message(user_id, start_date, end_date, title):
+    import glucose_report  # numpy 較大，用到報表才載入
+    try:
+        logger.debug("Generating report for user %s from %s to %s", user_id, start_date, end_date)
+        # 區間很長且有每日統計時直接讀彙總列，不用掃描每一筆紀錄（少了百分位數）
+        summaries = None
+        if glucose_report.use_daily_summaries(start_date, end_date):
+            summaries = blood_sugar_cache.get_daily_summaries(user_id, start_date, end_date)
+        if summaries is not None:
+            stats = glucose_report.summarize_daily(summaries, start_date, end_date)
+            return TextSendMessage(text=glucose_report.format_report(stats, title))
+        records = blood_sugar_cache.get_blood_sugar_by_range(user_id, start_date, end_date)
+        if isinstance(records, str):  # 查詢錯誤
+            return TextSendMessage(text=records)
+        stats = glucose_report.summarize(records, start_date, end_date)
+        return TextSendMessage(text=glucose_report.format_report(stats, title))
+    except Exception as e:
+        logger.exception("Error in create_range_report_message: %s", e)
+        return TextSendMessage(text=f"❌ 無法生成報表，錯誤：{str(e)}")
 
 
 
 def show_records_for_edit(user_id, date_str):
     try:
-        print(f"✅ Showing records for edit for user {user_id} on date {date_str}")
-        records = blood_sugar.get_blood_sugar_by_date(user_id, date_str)
+        logger.debug("Showing records for edit for user %s on %s", user_id, date_str)
+        # 使用者點的序號會直接套用到後端的資料，不能用其他 worker 寫入前的快取
+        records = blood_sugar_cache.get_blood_sugar_fresh(user_id, date_str)
 
         message_text = f"請選擇要修改的血糖紀錄\n({date_str})\n"
         
@@ -195,7 +308,7 @@ def show_records_for_edit(user_id, date_str):
 
         return TextSendMessage(text=message_text, quick_reply=QuickReply(items=quick_reply_items))
     except Exception as e:
-        print(f"❌ Error in show_records_for_edit: {str(e)}")
+        logger.exception("Error in show_records_for_edit: %s", e)
         return TextSendMessage(text=f"❌ 無法顯示血糖紀錄，錯誤：{str(e)}")
 
 
@@ -206,8 +319,9 @@ def show_records_for_edit(user_id, date_str):
 
 def show_records_for_delete(user_id, date_str):
     try:
-        print(f"✅ Showing records for delete for user {user_id} on date {date_str}")
-        records = blood_sugar.get_blood_sugar_by_date(user_id, date_str)
+        logger.debug("Showing records for delete for user %s on %s", user_id, date_str)
+        # 使用者點的序號會直接套用到後端的資料，不能用其他 worker 寫入前的快取
+        records = blood_sugar_cache.get_blood_sugar_fresh(user_id, date_str)
 
         message_text = f"請選擇要刪除的血糖紀錄\n({date_str})\n"
         
@@ -233,306 +347,443 @@ def show_records_for_delete(user_id, date_str):
 
         return TextSendMessage(text=message_text, quick_reply=QuickReply(items=quick_reply_items))
     except Exception as e:
-        print(f"❌ Error in show_records_for_delete: {str(e)}")
+        logger.exception("Error in show_records_for_delete: %s", e)
         return TextSendMessage(text=f"❌ 無法顯示血糖紀錄，錯誤：{str(e)}")
 
 
 
 
-@handler.add(MessageEvent, message=TextMessage)
-def handle_message(event):
-    print(f"✅ 收到訊息：{event.message.text}")  # Debug 訊息
-    user_id = event.source.user_id
-    message_text = event.message.text.strip()
+# 文字指令、對話狀態與 postback 動作都註冊在路由表，新增指令不會讓每個事件多比對一次
+router = Router()
 
-    # 1️⃣ 使用者輸入「血糖紀錄」，預設顯示今天的紀錄
-    if message_text == "血糖紀錄":
-        tz = pytz.timezone("Asia/Taipei")
-        today = datetime.now(tz).strftime("%Y-%m-%d")  # 取得今天的日期
-        print(f"✅ Generating blood sugar message for date: {today}")
-        message = create_blood_sugar_message(user_id, today)
-        try:
-            print(f"✅ Attempting to reply with token: {event.reply_token}")
-            line_bot_api.reply_message(event.reply_token, message)
-            print("✅ Reply message sent successfully")
-        except LineBotApiError as e:
-            print(f"❌ Failed to reply message: {str(e)}")
+
+def today_str():
+    return datetime.now(pytz.timezone("Asia/Taipei")).strftime("%Y-%m-%d")
+
+
+# 1️⃣ 使用者輸入「血糖紀錄」，預設顯示今天的紀錄
+@router.command("血糖紀錄")
+def show_today_records(event, user_id, text):
+    today = today_str()  # 取得今天的日期
+    reply_message(event, create_blood_sugar_message(user_id, today))
+
+
+# 新增：使用者輸入「語音轉文字」時，回傳 LIFF 語音網頁連結
+@router.command("語音轉文字")
+def show_voice_input(event, user_id, text):
+    liff_url = "https://liff.line.me/2007818922-W21zlONn"
+    reply_message(event, TextSendMessage(text=f"請點擊進行語音輸入：{liff_url}"))
+
+
+# 2️⃣ 使用者輸入「個人報表」，顯示報表選單
+@router.command("個人報表")
+def show_report_menu(event, user_id, text):
+    reply_message(event, create_report_menu_message())
+
+
+INVALID_VALUE_TEXT = f"❌ 請輸入有效的血糖值（{glucose_parser.MIN_VALUE}～{glucose_parser.MAX_VALUE} mg/dL）！"
+NO_TIME_TEXT = "❌ 目前的儲存方式只能用現在的時間記錄，請不要加上時間（例如「早餐後 135」或「135」）！"
+
+
+def entry_recorded_at(entry):
+    """有說時間時用今天的那個時間；比現在還晚（例如早上補記昨晚）則算前一天"""
+    if entry.time is None:
+        return None
+    now = datetime.now(pytz.timezone("Asia/Taipei"))
+    recorded_at = now.replace(hour=int(entry.time[:2]), minute=int(entry.time[3:]), second=0, microsecond=0)
+    if recorded_at > now:
+        recorded_at -= timedelta(days=1)
+    return recorded_at.strftime("%Y-%m-%d %H:%M:%S")
+
+
+def record_entry(event, user_id, entry):
+    """記錄一筆血糖並回覆那一天的紀錄，成功時回傳 True"""
+    store = blood_sugar_cache.store
+    if not store.supports_details and entry.time is not None:
+        # 後端只會用寫入當下的時間，不能默默記在別的時間
+        reply_message(event, TextSendMessage(text=NO_TIME_TEXT))
+        return False
+    recorded_at = entry_recorded_at(entry)
+    logger.info("Recording blood sugar for user %s", user_id)
+    response_text = blood_sugar_cache.record_blood_sugar(user_id, entry.value, recorded_at, entry.meal)
+    if not response_text.startswith("✅"):
+        # 記錄失敗，回傳錯誤訊息
+        reply_message(event, TextSendMessage(text=response_text))
+        return False
+    header = "已記錄！"
+    if entry.meal and not store.supports_details:
+        header += f"（目前的儲存方式不會保存餐別「{entry.meal}」）"
+    # 生成寫入那一天的紀錄訊息，在訊息前加上「已記錄！」和分隔線
+    records_message = create_blood_sugar_message(user_id, recorded_at[:10] if recorded_at else today_str())
+    final_message = TextSendMessage(
+        text=f"{header}\n-------------\n{records_message.text}",
+        quick_reply=records_message.quick_reply
+    )
+    reply_message(event, final_message)
+    return True
+
+
+# 使用者正在等待輸入血糖值，則記錄血糖（「一百二」「早餐後 135」也可以）
+@router.state(session_state.WAITING_FOR_BLOODSUGAR)
+def record_value(event, user_id, text, state):
+    entry = glucose_parser.parse_entry(text, require_cue=False)
+    if entry is None:
+        reply_message(event, TextSendMessage(text=INVALID_VALUE_TEXT))
         return
-    # 新增：使用者輸入「語音轉文字」時，回傳 LIFF 語音網頁連結
-    if message_text == "語音轉文字":
-        liff_url = "https://liff.line.me/2007818922-W21zlONn"
-        try:
-            line_bot_api.reply_message(event.reply_token, TextSendMessage(text=f"請點擊進行語音輸入：{liff_url}"))
-        except LineBotApiError as e:
-            print(f"❌ Failed to reply message: {str(e)}")
+    if record_entry(event, user_id, entry):
+        sessions.clear(user_id)  # 清除狀態
+
+
+# 使用者正在修改某筆紀錄
+@router.state(session_state.EDITING_BLOODSUGAR)
+def update_value(event, user_id, text, state):
+    entry = glucose_parser.parse_entry(text, require_cue=False)
+    if entry is None:
+        reply_message(event, TextSendMessage(text=INVALID_VALUE_TEXT))
         return
-    # 2️⃣ 使用者輸入「個人報表」，顯示報表選單
-    if message_text == "個人報表":
-        print(f"✅ Generating report menu for user {user_id}")
-        message = create_report_menu_message()
-        try:
-            print(f"✅ Attempting to reply with token: {event.reply_token}")
-            line_bot_api.reply_message(event.reply_token, message)
-            print("✅ Reply message sent successfully")
-        except LineBotApiError as e:
-            print(f"❌ Failed to reply message: {str(e)}")
+    new_value = entry.value
+    date_str = state.date
+    record_index = state.index
+    logger.info("Updating blood sugar for user %s on %s, index %s", user_id, date_str, record_index)
+    response_text = blood_sugar_cache.update_blood_sugar(user_id, date_str, record_index, new_value)
+    if not response_text.startswith("✅"):
+        # 更新失敗，回傳錯誤訊息
+        reply_message(event, TextSendMessage(text=response_text))
         return
-    
-    # 2️⃣ 如果使用者正在等待輸入血糖值，則記錄血糖
-    if user_states.get(user_id) == "waiting_for_bloodsugar":
-        try:
-            blood_sugar_value = int(message_text)  # 確保是數字
-            print(f"✅ Recording blood sugar value: {blood_sugar_value}")
-            response_text = blood_sugar.record_blood_sugar(user_id, blood_sugar_value)
-            if response_text.startswith("✅"):
-                # 取得今日日期
-                tz = pytz.timezone("Asia/Taipei")
-                today = datetime.now(tz).strftime("%Y-%m-%d")
-                # 生成今日紀錄訊息
-                today_records_message = create_blood_sugar_message(user_id, today)
-                # 在訊息前加上「已記錄！」和分隔線
-                final_message = TextSendMessage(
-                    text=f"已記錄！\n-------------\n{today_records_message.text}",
-                    quick_reply=today_records_message.quick_reply
-                )
-                user_states[user_id] = None  # 清除狀態
-                try:
-                    print(f"✅ Attempting to reply with token: {event.reply_token}")
-                    line_bot_api.reply_message(event.reply_token, final_message)
-                    print("✅ Reply message sent successfully")
-                except LineBotApiError as e:
-                    print(f"❌ Failed to reply message: {str(e)}")
-            else:
-                # 記錄失敗，回傳錯誤訊息
-                try:
-                    print(f"✅ Attempting to reply with token: {event.reply_token}")
-                    line_bot_api.reply_message(event.reply_token, TextSendMessage(text=response_text))
-                    print("✅ Reply message sent successfully")
-                except LineBotApiError as e:
-                    print(f"❌ Failed to reply message: {str(e)}")
-        except ValueError:
-            try:
-                print(f"✅ Attempting to reply with token: {event.reply_token}")
-                line_bot_api.reply_message(event.reply_token, TextSendMessage(text="❌ 請輸入有效的數字！"))
-                print("✅ Reply message sent successfully")
-            except LineBotApiError as e:
-                print(f"❌ Failed to reply message: {str(e)}")
+    # 生成今日紀錄訊息，在訊息前加上「已修改！」和分隔線
+    today_records_message = create_blood_sugar_message(user_id, date_str)
+    final_message = TextSendMessage(
+        text=f"已修改！\n-------------\n{today_records_message.text}",
+        quick_reply=today_records_message.quick_reply
+    )
+    sessions.clear(user_id)  # 清除狀態
+    reply_message(event, final_message)
+
+
+# 語音或手動輸入「早餐後 135」「血糖一百二」這類訊息，不用先按「新增」就直接記錄
+@router.pattern("glucose_entry", glucose_parser.parse_entry)
+def record_free_text(event, user_id, text, entry):
+    record_entry(event, user_id, entry)
+
+
+# 3️⃣ 預設回應，提示使用者可以做什麼
+@router.default
+def show_help(event, user_id, text):
+    response_text = "📋 請選擇操作：\n- 輸入「血糖紀錄」查看紀錄\n- 直接輸入「早餐後 135」記錄血糖"
+    reply_message(event, TextSendMessage(text=response_text))
+
+
+# 1️⃣ 使用者點擊「選擇日期」
+@router.postback("select_date")
+def select_date(event, user_id, data):
+    selected_date = (event.postback.params or {}).get("date")  # 安全地取得日期
+    if not selected_date:
+        reply_message(event, TextSendMessage(text="❌ 請選擇一個日期！"))
         return
-    
+    reply_message(event, create_blood_sugar_message(user_id, selected_date))
 
 
+# 2️⃣ 使用者點擊「新增」按鈕
+@router.postback("add_blood_sugar")
+def add_blood_sugar(event, user_id, data):
+    sessions.set(user_id, SessionState(session_state.WAITING_FOR_BLOODSUGAR))
+    reply_message(event, TextSendMessage(text="請輸入血糖"))
 
-#修改
 
-    if user_states.get(user_id, {}).get("state") == "editing_bloodsugar":
-        try:
-            new_value = int(message_text)  # 確保是數字
-            state = user_states[user_id]
-            date_str = state["date"]
-            record_index = state["index"]
-            print(f"✅ Updating blood sugar for user {user_id} on {date_str}, index {record_index}")
-            response_text = blood_sugar.update_blood_sugar(user_id, date_str, record_index, new_value)
-            
-            # 檢查是否更新成功
-            if response_text.startswith("✅"):
-                # 生成今日紀錄訊息
-                today_records_message = create_blood_sugar_message(user_id, date_str)
-                # 在訊息前加上「已修改！」和分隔線
-                final_message = TextSendMessage(
-                    text=f"已修改！\n-------------\n{today_records_message.text}",
-                    quick_reply=today_records_message.quick_reply
-                )
-                user_states[user_id] = None  # 清除狀態
-                try:
-                    print(f"✅ Attempting to reply with token: {event.reply_token}")
-                    line_bot_api.reply_message(event.reply_token, final_message)
-                    print("✅ Reply message sent successfully")
-                except LineBotApiError as e:
-                    print(f"❌ Failed to reply message: {str(e)}")
-            else:
-                # 更新失敗，回傳錯誤訊息
-                try:
-                    print(f"✅ Attempting to reply with token: {event.reply_token}")
-                    line_bot_api.reply_message(event.reply_token, TextSendMessage(text=response_text))
-                    print("✅ Reply message sent successfully")
-                except LineBotApiError as e:
-                    print(f"❌ Failed to reply message: {str(e)}")
-        except ValueError:
-            try:
-                print(f"✅ Attempting to reply with token: {event.reply_token}")
-                line_bot_api.reply_message(event.reply_token, TextSendMessage(text="❌ 請輸入有效的數字！"))
-                print("✅ Reply message sent successfully")
-            except LineBotApiError as e:
-                print(f"❌ Failed to reply message: {str(e)}")
+# 3️⃣ 使用者點擊「修改」或「刪除」按鈕，只能修改／刪除今日紀錄
+@router.postback("edit_blood_sugar")
+def choose_record_to_edit(event, user_id, data):
+    reply_message(event, show_records_for_edit(user_id, today_str()))
+
+
+@router.postback("delete_blood_sugar")
+def choose_record_to_delete(event, user_id, data):
+    reply_message(event, show_records_for_delete(user_id, today_str()))
+
+
+@router.postback("edit_record")
+def edit_record(event, user_id, data):
+    if data.index is None:
+        reply_message(event, TextSendMessage(text="❌ 找不到這筆血糖紀錄"))
         return
+    # 儲存使用者狀態，記錄正在修改哪筆紀錄
+    sessions.set(user_id, SessionState(session_state.EDITING_BLOODSUGAR, date=today_str(), index=data.index))
+    reply_message(event, TextSendMessage(text="請輸入新的血糖值"))
 
 
+@router.postback("delete_record")
+def delete_record(event, user_id, data):
+    if data.index is None:
+        reply_message(event, TextSendMessage(text="❌ 找不到這筆血糖紀錄"))
+        return
+    logger.info("Deleting blood sugar for user %s, index %s", user_id, data.index)
+    response_text = blood_sugar_cache.delete_blood_sugar(user_id, today_str(), data.index)
+    reply_message(event, TextSendMessage(text=response_text))
+
 
-    # 3️⃣ 預設回應，提示使用者可以做什麼
-    response_text = "📋 請選擇操作：\n- 輸入「血糖紀錄」查看紀錄"
+#------------------------------------------------
+@router.postback("report_today")
+def report_today(event, user_id, data):
+    today = today_str()
     try:
-        print(f"✅ Attempting to reply with token: {event.reply_token}")
-        line_bot_api.reply_message(event.reply_token, TextSendMessage(text=response_text))
-        print("✅ Reply message sent successfully")
-    except LineBotApiError as e:
-        print(f"❌ Failed to reply message: {str(e)}")
+        records = blood_sugar_cache.get_blood_sugar_by_date(user_id, today)
+
+        if isinstance(records, str):  # 查詢錯誤
+            message = TextSendMessage(text=records)
+        elif not records:  # 無紀錄
+            message = TextSendMessage(text="今天還沒有記錄血糖喔!")
+        else:  # 有紀錄：產生圖檔→上傳取得 URL（紀錄沒變就沿用上次的圖）
+            image_url = chart_cache.get_chart_url(user_id, records, period="today", date_str=today)
+            if image_url is None:  # 繪圖服務忙碌或逾時，改回傳文字摘要
+                message = create_summary_message(records, today)
+            elif isinstance(image_url, str) and image_url.startswith("❌"):
+                message = TextSendMessage(text=image_url)
+            else:
+                message = ImageSendMessage(original_content_url=image_url, preview_image_url=image_url)
+
+        reply_message(event, message)
+    except Exception as e:
+        logger.exception("Error in report_today: %s", e)
+        reply_message(event, TextSendMessage(text=f"❌ 無法生成報表，錯誤：{str(e)}"))
+
+
+# 區間報表：最近一週，或從選擇的日期到今天（最多一年）
+@router.postback("report_last_week", "report_select_date")
+def report_range(event, user_id, data):
+    now = datetime.now(pytz.timezone("Asia/Taipei"))
+    today = now.strftime("%Y-%m-%d")
+    if data.action == "report_last_week":
+        start_date = (now - timedelta(days=6)).strftime("%Y-%m-%d")
+        title = "最近一週血糖報表"
+    else:
+        start_date = (event.postback.params or {}).get("date")
+        if not start_date:
+            reply_message(event, TextSendMessage(text="❌ 請選擇一個日期！"))
+            return
+        import glucose_report
+        earliest = (now - timedelta(days=glucose_report.MAX_REPORT_DAYS - 1)).strftime("%Y-%m-%d")
+        start_date = min(max(start_date, earliest), today)
+        title = "血糖報表"
+    reply_message(event, create_range_report_message(user_id, start_date, today, title))
+
+
+def handle_message(event):
+    user_id = event.source.user_id
+    message_text = event.message.text.strip()
+    # 指令優先；不是指令時才依對話狀態處理
+    state = None if message_text in router.commands else sessions.get(user_id)
+    router.dispatch_message(event, user_id, message_text, state)
 
 # 處理 Postback 事件（按鈕點擊）
-@handler.add(PostbackEvent)
 def handle_postback(event):
     user_id = event.source.user_id
     postback_data = event.postback.data
-    print(f"✅ Handling postback: {postback_data}")
+    if not router.dispatch_postback(event, user_id, postback_data):
+        logger.warning("Unknown postback action: %s", postback_data)
+
+
+def dispatch_event(event):
+    logger.debug("Dispatching %s event %s", getattr(event, "type", "?"), getattr(event, "webhook_event_id", None))
+    # 依事件種類交給對應的 handler（由 worker 執行緒呼叫）
+    if isinstance(event, MessageEvent) and isinstance(event.message, TextMessage):
+        handle_message(event)
+    elif isinstance(event, PostbackEvent):
+        handle_postback(event)
+
+
+worker_pool = WebhookWorkerPool(dispatch_event, num_workers=WEBHOOK_WORKERS, max_queue_size=WEBHOOK_QUEUE_SIZE)
+# 程式結束前把佇列中的事件處理完，再關閉繪圖 process 與 LINE 連線
+atexit.register(_close_clients)
+atexit.register(chart_renderer.renderer.shutdown)
+atexit.register(worker_pool.shutdown)
+
+# /metrics 一併輸出各元件的統計
+metrics.registry.register_collector("webhook", worker_pool.stats)
+metrics.registry.register_collector("outbound", lambda: outbound.stats() if outbound else {})
+metrics.registry.register_collector("dedup", deduplicator.stats)
+metrics.registry.register_collector("record_cache", blood_sugar_cache.cache.stats)
+metrics.registry.register_collector("chart_cache", chart_cache.cache.stats)
+metrics.registry.register_collector("chart_renderer", chart_renderer.renderer.stats)
+metrics.registry.register_collector("logging", app_logging.stats)
+metrics.registry.register_collector("sessions", lambda: {"active": len(sessions)})
+metrics.registry.register_collector("liff_auth", liff_auth.verifier.stats)
+metrics.registry.register_collector(
+    "csv_import", lambda: sys.modules["csv_io"].jobs.stats() if "csv_io" in sys.modules else {})
+
+
+# LIFF 頁面在手機上自己畫圖用的紀錄 API（欄位式 JSON，支援 ETag、gzip 與分頁）
+#   GET /api/records?start=YYYY-MM-DD&end=YYYY-MM-DD
+#   Authorization: Bearer <liff.getIDToken()>
+@app.route("/api/records", methods=["GET", "OPTIONS"])
+def api_records():
+    if request.method == "OPTIONS":
+        return records_api.with_cors(Response(status=204), request)
+    token = metrics.current_route.set("api:records")
+    try:
+        with metrics.timed("api_records"):
+            response = get_records_response()
+    finally:
+        metrics.current_route.reset(token)
+    return records_api.with_cors(response, request)
 
-    # 1️⃣ 使用者點擊「選擇日期」
-    if postback_data == "action=select_date":
-        selected_date = event.postback.params.get("date")  # 安全地取得日期
-        if not selected_date:
-            print("❌ No date selected in postback params")
-            try:
-                print(f"✅ Attempting to reply with token: {event.reply_token}")
-                line_bot_api.reply_message(event.reply_token, TextSendMessage(text="❌ 請選擇一個日期！"))
-                print("✅ Reply message sent successfully")
-            except LineBotApiError as e:
-                print(f"❌ Failed to reply message: {str(e)}")
-            return
 
-        print(f"✅ Selected date: {selected_date}")
-        message = create_blood_sugar_message(user_id, selected_date)
+def authenticate_liff():
+    """驗證 LIFF 的 ID token，回傳 (user_id, None)；失敗時回傳 (None, 錯誤回應)"""
+    try:
+        return liff_auth.verifier.verify(liff_auth.bearer_token(request.headers)), None
+    except liff_auth.VerificationUnavailable as e:
+        return None, records_api.error_response(str(e), 503)
+    except liff_auth.AuthError as e:
+        response = records_api.error_response(str(e), 401)
+        response.headers["WWW-Authenticate"] = "Bearer"
+        return None, response
+
+
+def get_records_response():
+    user_id, error = authenticate_liff()
+    if error:
+        return error
+    try:
+        start, end, next_range = records_api.page_range(request.args.get("start"), request.args.get("end"),
+                                                        today_str())
+    except ValueError as e:
+        return records_api.error_response(str(e), 400)
+    # 和報表同一個查詢路徑（後端不支援區間查詢時逐日查詢，有快取就用）
+    records = blood_sugar_cache.get_blood_sugar_by_range(user_id, start, end)
+    if isinstance(records, str):
+        return records_api.error_response(records, 502)
+    return records_api.json_response(records_api.payload(start, end, records, next_range), request)
+
+
+# 匯入血糖機匯出的 CSV（multipart 的 file 欄位，或直接把檔案當 body），在背景處理並回傳 job ID
+#   POST /api/import?unit=mmol&day_first=1&encoding=big5
+#   GET  /api/import/<job_id> 查詢進度
+@app.route("/api/import", methods=["POST", "OPTIONS"])
+def api_import():
+    if request.method == "OPTIONS":
+        return records_api.with_cors(Response(status=204), request)
+    user_id, response = authenticate_liff()
+    if response is None:
+        import csv_io  # 用到 numpy，第一次匯入時才載入
+        if (request.content_length or 0) > csv_io.CSV_MAX_UPLOAD_BYTES:
+            response = records_api.error_response("❌ 檔案太大", 413)
+        else:
+            upload = request.files.get("file")
+            try:
+                path, size = csv_io.jobs.save_upload(upload.stream if upload else request.stream)
+            except ValueError as e:
+                response = records_api.error_response(str(e), 413)
+            else:
+                job_id = csv_io.jobs.submit(user_id, path, size,
+                                            unit="mmol" if request.args.get("unit") == "mmol" else None,
+                                            day_first=request.args.get("day_first") == "1",
+                                            encoding=request.args.get("encoding", "utf-8"))
+                response = jsonify(job=job_id, status_url=f"/api/import/{job_id}")
+                response.status_code = 202
+    return records_api.with_cors(response, request)
+
+
+@app.route("/api/import/<job_id>", methods=["GET", "OPTIONS"])
+def api_import_status(job_id):
+    if request.method == "OPTIONS":
+        return records_api.with_cors(Response(status=204), request)
+    user_id, response = authenticate_liff()
+    if response is None:
+        import csv_io
+        job = csv_io.jobs.get(job_id)
+        if job is None or job.pop("user_id") != user_id:
+            response = records_api.error_response("❌ 找不到這個匯入工作", 404)
+        else:
+            response = jsonify(job)
+            response.headers["Cache-Control"] = "no-store"
+    return records_api.with_cors(response, request)
+
+
+# 匯出全部（或 start～end）的紀錄成 CSV，分段查詢、邊查邊送
+@app.route("/api/export.csv", methods=["GET", "OPTIONS"])
+def api_export():
+    if request.method == "OPTIONS":
+        return records_api.with_cors(Response(status=204), request)
+    user_id, response = authenticate_liff()
+    if response is None:
+        import csv_io
+        start = request.args.get("start", csv_io.EXPORT_START)
+        end = request.args.get("end", today_str())
         try:
-            print(f"✅ Attempting to reply with token: {event.reply_token}")
-            line_bot_api.reply_message(event.reply_token, message)
-            print("✅ Reply message sent successfully")
-        except LineBotApiError as e:
-            print(f"❌ Failed to reply message: {str(e)}")
-        return
+            records_api.page_range(start, end, today_str())  # 只檢查日期格式
+        except ValueError as e:
+            response = records_api.error_response(str(e), 400)
+        else:
+            response = Response(stream_with_context(csv_io.export_csv(user_id, start, end)), mimetype="text/csv")
+            response.headers["Content-Disposition"] = f'attachment; filename="blood_sugar_{start}_{end}.csv"'
+            response.headers["Cache-Control"] = "no-store"
+    return records_api.with_cors(response, request)
 
-    # 2️⃣ 使用者點擊「新增」按鈕
-    if postback_data == "action=add_blood_sugar":
-        print(f"✅ User {user_id} clicked 'add_blood_sugar'")
-        user_states[user_id] = "waiting_for_bloodsugar"
-        try:
-            print(f"✅ Attempting to reply with token: {event.reply_token}")
-            line_bot_api.reply_message(event.reply_token, TextSendMessage(text="請輸入血糖"))
-            print("✅ Reply message sent successfully")
-        except LineBotApiError as e:
-            print(f"❌ Failed to reply message: {str(e)}")
-        return
 
-    # 3️⃣ 使用者點擊「修改」或「刪除」按鈕（目前只顯示畫面，功能未實作）
-    if postback_data in ["action=edit_blood_sugar", "action=delete_blood_sugar"]:
-        action = "修改" if postback_data == "action=edit_blood_sugar" else "刪除"
-        print(f"✅ User {user_id} clicked '{action}'")
-        
-        if action == "修改":
-            # 只能修改今日紀錄
-            tz = pytz.timezone("Asia/Taipei")
-            today = datetime.now(tz).strftime("%Y-%m-%d")
-            message = show_records_for_edit(user_id, today)
-            try:
-                print(f"✅ Attempting to reply with token: {event.reply_token}")
-                line_bot_api.reply_message(event.reply_token, message)
-                print("✅ Reply message sent successfully")
-            except LineBotApiError as e:
-                print(f"❌ Failed to reply message: {str(e)}")
-            return
-        else:  # 刪除
-        # 只能刪除今日紀錄
-            tz = pytz.timezone("Asia/Taipei")
-            today = datetime.now(tz).strftime("%Y-%m-%d")
-            message = show_records_for_delete(user_id, today)
-            try:
-                print(f"✅ Attempting to reply with token: {event.reply_token}")
-                line_bot_api.reply_message(event.reply_token, message)
-                print("✅ Reply message sent successfully")
-            except LineBotApiError as e:
-                print(f"❌ Failed to reply message: {str(e)}")
-            return
-    
+# ✅ 健康檢查路由，確保 UptimeRobot 可以 Ping Render
+@app.route("/health", methods=["GET"])
+def health_check():
+    return "OK", 200  # 讓 UptimeRobot 知道伺服器正常運行
 
+# 存活檢查：process 還能回應就算存活，不檢查任何外部服務
+@app.route("/health/live", methods=["GET"])
+def liveness_check():
+    return "OK", 200
 
-    if postback_data.startswith("action=edit_record"):
-        import re
-        index = int(re.search(r"index=(\d+)", postback_data).group(1))
-        print(f"✅ User {user_id} selected record index {index} to edit")
-        
-        # 儲存使用者狀態，記錄正在修改哪筆紀錄
-        tz = pytz.timezone("Asia/Taipei")
-        today = datetime.now(tz).strftime("%Y-%m-%d")
-        user_states[user_id] = {"state": "editing_bloodsugar", "date": today, "index": index}
-        
-        try:
-            print(f"✅ Attempting to reply with token: {event.reply_token}")
-            line_bot_api.reply_message(event.reply_token, TextSendMessage(text="請輸入新的血糖值"))
-            print("✅ Reply message sent successfully")
-        except LineBotApiError as e:
-            print(f"❌ Failed to reply message: {str(e)}")
-        return
+# 就緒檢查：啟動檢查中必要的項目都通過才回 200
+@app.route("/health/ready", methods=["GET"])
+def readiness_check():
+    report = startup.checks.report()
+    return jsonify(report), 200 if report["ready"] else 503
 
+# webhook 佇列深度與各分片延遲
+@app.route("/health/queue", methods=["GET"])
+def queue_stats():
+    return jsonify(dict(worker_pool.stats(), outbound=outbound.stats() if outbound else {},
+                        dedup=deduplicator.stats(), logging=app_logging.stats())), 200
 
-    if postback_data.startswith("action=delete_record"):
-        import re
-        index = int(re.search(r"index=(\d+)", postback_data).group(1))
-        print(f"✅ User {user_id} selected record index {index} to delete")
-        
-        # 執行刪除
-        tz = pytz.timezone("Asia/Taipei")
-        today = datetime.now(tz).strftime("%Y-%m-%d")
-        response_text = blood_sugar.delete_blood_sugar(user_id, today, index)
-        
-        try:
-            print(f"✅ Attempting to reply with token: {event.reply_token}")
-            line_bot_api.reply_message(event.reply_token, TextSendMessage(text=response_text))
-            print("✅ Reply message sent successfully")
-        except LineBotApiError as e:
-            print(f"❌ Failed to reply message: {str(e)}")
-        return
+# 每條路由的處理時間分布
+@app.route("/health/routes", methods=["GET"])
+def route_stats():
+    return jsonify(router.stats()), 200
 
+# Prometheus 格式的各階段處理時間與元件統計
+@app.route("/metrics", methods=["GET"])
+def prometheus_metrics():
+    return Response(metrics.registry.render(), mimetype="text/plain; version=0.0.4")
 
-#------------------------------------------------
-    if postback_data == "action=report_today":
-        print(f"✅ User {user_id} clicked 'report_today'")
-        tz = pytz.timezone("Asia/Taipei")
-        today = datetime.now(tz).strftime("%Y-%m-%d")
-        try:
-            records = blood_sugar.get_blood_sugar_by_date(user_id, today)
-            print(f"✅ Retrieved records for {today}: {records}")
-            
-            if isinstance(records, str):  # 查詢錯誤
-                message = TextSendMessage(text=records)
-            elif not records:  # 無紀錄
-                message = TextSendMessage(text="今天還沒有記錄血糖喔!")
-            else:  # 有紀錄，**這裡要改成兩步：產生圖檔→上傳取得 URL**
-                local_file = blood_sugar.generate_blood_sugar_chart(user_id, records, period="today")
-                if isinstance(local_file, str) and local_file.startswith("❌"):
-                    message = TextSendMessage(text=local_file)
-                else:
-                    image_url = blood_sugar.upload_and_get_url(local_file, user_id, period="today")
-                    if isinstance(image_url, str) and image_url.startswith("❌"):
-                        message = TextSendMessage(text=image_url)
-                    else:
-                        message = ImageSendMessage(original_content_url=image_url, preview_image_url=image_url)
-            
-            print(f"✅ Attempting to reply with token: {event.reply_token}")
-            line_bot_api.reply_message(event.reply_token, message)
-            print("✅ Reply message sent successfully")
-        except Exception as e:
-            print(f"❌ Error in report_today: {str(e)}")
-            try:
-                line_bot_api.reply_message(event.reply_token, TextSendMessage(text=f"❌ 無法生成報表，錯誤：{str(e)}"))
-            except LineBotApiError as e:
-                print(f"❌ Failed to reply message: {str(e)}")
-        return
+# 每個請求一個 correlation ID（可以沿用上游 proxy 給的 X-Request-Id），日誌與回應標頭都帶著它
+@app.before_request
+def assign_request_id():
+    app_logging.new_request_id(request.headers.get("X-Request-Id"))
+    # 抽樣（或 X-Trace: 1）的請求記錄每個階段的時間
+    metrics.start_trace(force=request.headers.get("X-Trace") == "1")
 
 
+@app.after_request
+def add_request_id_header(response):
+    response.headers["X-Request-Id"] = app_logging.get_request_id()
+    server_timing = metrics.finish_trace()
+    if server_timing:
+        response.headers["Server-Timing"] = server_timing
+    return response
 
 
+# gunicorn 等情況下沒有 __main__，第一個請求（通常是平台的健康檢查）進來時啟動檢查
+@app.before_request
+def start_startup_checks():
+    startup.checks.start()
+
+
+def run(host="0.0.0.0", port=10000):
+    # 檢查在背景執行，不會延遲 app.run 開始接受連線
+    startup.checks.start()
+    app.run(host=host, port=port)
 
-# ✅ 健康檢查路由，確保 UptimeRobot 可以 Ping Render
-@app.route("/health", methods=["GET"])
-def health_check():
-    return "OK", 200  # 讓 UptimeRobot 知道伺服器正常運行
 
 # ✅ 確保 Flask 伺服器正確啟動
+# 繪圖 process 會重新 import 啟動的腳本，直接執行 main.py 時改由 serve.py 啟動，
+# 這個檔案的初始化（日誌、儲存後端、webhook worker）才不會在每個繪圖 process 再跑一次
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=10000)
+    serve_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "serve.py")
+    os.execv(sys.executable, [sys.executable, serve_path] + sys.argv[1:])
@@ -0,0 +1,227 @@
+import bisect
+import contextvars
+import logging
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+# 各階段的處理時間與錯誤次數，/metrics 以 Prometheus 文字格式輸出：
+#   liff_stage_seconds{stage, route}       處理時間分布（histogram）
+#   liff_stage_errors_total{stage, route}  拋出例外或回傳 ❌ 訊息的次數
+#   liff_<元件>_<欄位>                      快取、outbound、去重、佇列等元件的統計（register_collector）
+# route 是目前正在執行的路由（router 設定），同一個階段在不同指令下分開統計。
+# 每次記錄只有兩次 perf_counter、一次 bisect 和一個 lock，可以在正式環境常開。
+#
+# trace：METRICS_TRACE_SAMPLE_RATE 比例的請求（或帶 X-Trace: 1 標頭的請求）會把每個階段的
+# 時間記錄下來，請求結束時寫進日誌並放在 Server-Timing 回應標頭。
+
+METRICS_PREFIX = "liff"
+METRICS_TRACE_SAMPLE_RATE = float(os.getenv("METRICS_TRACE_SAMPLE_RATE", "0"))
+
+# 秒；涵蓋記憶體快取（微秒級）到繪圖上傳（數秒）
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+logger = logging.getLogger(__name__)
+
+current_route = contextvars.ContextVar("metrics_route", default="-")
+_trace = contextvars.ContextVar("metrics_trace", default=None)
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds, error=False):
+        with self._lock:
+            self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+            self.count += 1
+            self.total += seconds
+            if error:
+                self.errors += 1
+
+    def snapshot(self):
+        with self._lock:
+            return list(self.counts), self.count, self.total, self.errors
+
+    def percentile(self, pct, counts=None, count=None):
+        """回傳第 pct 百分位所在 bucket 的上限（秒），超過最大 bucket 時為 None"""
+        if counts is None:
+            counts, count, _, _ = self.snapshot()
+        if not count:
+            return 0
+        rank = count * pct / 100
+        seen = 0
+        for i, bucket_count in enumerate(counts):
+            seen += bucket_count
+            if seen >= rank:
+                return self.buckets[i] if i < len(self.buckets) else None
+        return None
+
+    def stats(self):
+        counts, count, total, errors = self.snapshot()
+
+        def ms(seconds):
+            return None if seconds is None else round(seconds * 1000, 3)
+
+        return {
+            "count": count,
+            "errors": errors,
+            "mean_ms": ms(total / count) if count else 0,
+            "p50_ms": ms(self.percentile(50, counts, count)),
+            "p95_ms": ms(self.percentile(95, counts, count)),
+            "p99_ms": ms(self.percentile(99, counts, count)),
+        }
+
+
+class Registry:
+    def __init__(self):
+        self.stages = {}  # (stage, route) -> Histogram
+        self.collectors = {}  # 名稱 -> 回傳 stats dict 的函式
+        self._lock = threading.Lock()
+
+    def histogram(self, stage, route):
+        key = (stage, route)
+        histogram = self.stages.get(key)
+        if histogram is None:
+            with self._lock:
+                histogram = self.stages.setdefault(key, Histogram())
+        return histogram
+
+    def observe(self, stage, seconds, error=False, route=None):
+        route = route or current_route.get()
+        self.histogram(stage, route).observe(seconds, error)
+        trace = _trace.get()
+        if trace is not None:
+            trace.append((stage, route, seconds, error))
+
+    def register_collector(self, name, func):
+        self.collectors[name] = func
+
+    def stage_stats(self, stage=None):
+        return {
+            f"{key[0]}:{key[1]}" if stage is None else key[1]: histogram.stats()
+            for key, histogram in sorted(self.stages.items()) if stage is None or key[0] == stage
+        }
+
+    def render(self):
+        """Prometheus 文字格式（text/plain; version=0.0.4）"""
+        name = f"{METRICS_PREFIX}_stage_seconds"
+        lines = [f"# HELP {name} Time spent in each stage of webhook handling.", f"# TYPE {name} histogram"]
+        errors = []
+        for (stage, route), histogram in sorted(self.stages.items()):
+            counts, count, total, error_count = histogram.snapshot()
+            labels = f'stage="{_escape(stage)}",route="{_escape(route)}"'
+            cumulative = 0
+            for bucket, bucket_count in zip(histogram.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f'{name}_bucket{{{labels},le="{bucket}"}} {cumulative}')
+            lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {count}')
+            lines.append(f"{name}_sum{{{labels}}} {total}")
+            lines.append(f"{name}_count{{{labels}}} {count}")
+            errors.append(f"{METRICS_PREFIX}_stage_errors_total{{{labels}}} {error_count}")
+        if errors:
+            lines.append(f"# HELP {METRICS_PREFIX}_stage_errors_total Stage calls that raised or returned an error.")
+            lines.append(f"# TYPE {METRICS_PREFIX}_stage_errors_total counter")
+            lines.extend(errors)
+        for collector_name, func in sorted(self.collectors.items()):
+            try:
+                # 同一個 metric 的樣本必須連在一起（shards 之類的 list 會交錯產生）
+                samples = sorted(_flatten(func()), key=lambda sample: sample[0])
+            except Exception as e:
+                logger.error("Metrics collector %s failed: %s", collector_name, e)
+                continue
+            seen = set()
+            for key, labels, value in samples:
+                metric = f"{METRICS_PREFIX}_{collector_name}_{key}"
+                if metric not in seen:
+                    lines.append(f"# TYPE {metric} gauge")
+                    seen.add(metric)
+                lines.append(f"{metric}{labels} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _flatten(stats, prefix="", labels=""):
+    """把元件的 stats dict 攤平成 (名稱, 標籤, 數值)；list 的每一項以 index 標籤區分"""
+    for key, value in stats.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, bool):
+            yield name, labels, int(value)
+        elif isinstance(value, (int, float)):
+            yield name, labels, value
+        elif isinstance(value, dict):
+            yield from _flatten(value, f"{name}_", labels)
+        elif isinstance(value, list):
+            for index, item in enumerate(value):
+                if isinstance(item, dict):
+                    yield from _flatten(item, f"{name}_", f'{{index="{index}"}}')
+
+
+registry = Registry()
+
+
+def observe(stage, seconds, error=False, route=None):
+    registry.observe(stage, seconds, error, route)
+
+
+@contextmanager
+def timed(stage, route=None):
+    """with metrics.timed("signature"): ... 例外會記為錯誤後再拋出"""
+    start = time.perf_counter()
+    error = False
+    try:
+        yield
+    except Exception:
+        error = True
+        raise
+    finally:
+        registry.observe(stage, time.perf_counter() - start, error, route)
+
+
+def timed_call(stage, func, *args, **kwargs):
+    """呼叫 func 並記錄時間；回傳 ❌ 開頭的訊息也算錯誤（blood_sugar 的慣例）"""
+    start = time.perf_counter()
+    error = True
+    try:
+        result = func(*args, **kwargs)
+        error = isinstance(result, str) and result.startswith("❌")
+        return result
+    finally:
+        registry.observe(stage, time.perf_counter() - start, error)
+
+
+def start_trace(force=False):
+    """依抽樣比例（或 force）開始記錄這個請求的每個階段，回傳是否開始"""
+    if force or (METRICS_TRACE_SAMPLE_RATE > 0 and random.random() < METRICS_TRACE_SAMPLE_RATE):
+        _trace.set([])
+        return True
+    return False
+
+
+def finish_trace():
+    """結束 trace，寫進日誌並回傳 Server-Timing 標頭的值；沒有 trace 時回傳 None
+
+    WEBHOOK_ASYNC=1 時回應送出後才處理完的事件不會出現在這裡。
+    """
+    trace = _trace.get()
+    if trace is None:
+        return None
+    _trace.set(None)
+    spans = [{"stage": stage, "route": route, "ms": round(seconds * 1000, 3), "error": error}
+             for stage, route, seconds, error in list(trace)]
+    logger.info("Request trace: %d spans", len(spans), extra={"trace": spans})
+    # HTTP 標頭只能是 latin-1，中文指令名稱轉成 \u 跳脫
+    return ", ".join(
+        f'{span["stage"]};dur={span["ms"]};desc="{span["route"].encode("ascii", "backslashreplace").decode()}"'
+        for span in spans
+    )
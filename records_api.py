@@ -0,0 +1,105 @@
+import gzip
+import hashlib
+import json
+import os
+from datetime import datetime, timedelta
+
+import pytz
+from flask import Response, jsonify
+
+# /api/records：LIFF 頁面取得血糖紀錄自己在手機上畫圖，不必由伺服器繪圖、上傳 PNG。
+# 回應是欄位式的 JSON，時間與數值分成平行的陣列，比每筆一個物件小很多：
+#   {"start": "2025-01-01", "end": "2025-01-07", "tz": "Asia/Taipei",
+#    "t": [1735689600, ...], "v": [120, ...], "m": ["早餐後", null, ...], "next": null}
+# t 為 Unix 秒；m（餐別）只在有標籤時出現。
+# 一次最多回傳 API_RECORDS_MAX_DAYS 天，區間更長時 next 是下一頁的 {start, end}。
+# 回應帶 ETag（內容的雜湊），If-None-Match 相同時回 304；夠大時用 gzip 壓縮。
+
+API_RECORDS_DEFAULT_DAYS = int(os.getenv("API_RECORDS_DEFAULT_DAYS", "7"))
+API_RECORDS_MAX_DAYS = int(os.getenv("API_RECORDS_MAX_DAYS", "31"))
+API_GZIP_MIN_BYTES = int(os.getenv("API_GZIP_MIN_BYTES", "1024"))
+API_GZIP_LEVEL = int(os.getenv("API_GZIP_LEVEL", "6"))
+# LIFF 頁面和 API 不同網域時，允許的來源（逗號分隔，例如 https://xxx.vercel.app）
+API_CORS_ORIGINS = {origin.strip() for origin in os.getenv("API_CORS_ORIGINS", "").split(",") if origin.strip()}
+
+TZ = pytz.timezone("Asia/Taipei")
+
+
+def _parse_date(date_str):
+    return datetime.strptime(date_str, "%Y-%m-%d").date()
+
+
+def page_range(start, end, today):
+    """回傳這一頁的 (start, end, next)；格式錯誤時拋出 ValueError
+
+    沒有 end 時為今天，沒有 start 時為 end 往前 API_RECORDS_DEFAULT_DAYS 天。
+    """
+    try:
+        end_day = _parse_date(end or today)
+        start_day = _parse_date(start) if start else end_day - timedelta(days=API_RECORDS_DEFAULT_DAYS - 1)
+    except ValueError:
+        raise ValueError("❌ 日期格式必須是 YYYY-MM-DD")
+    if start_day > end_day:
+        raise ValueError("❌ start 不能晚於 end")
+    page_end = min(end_day, start_day + timedelta(days=API_RECORDS_MAX_DAYS - 1))
+    next_range = None
+    if page_end < end_day:
+        next_range = {"start": str(page_end + timedelta(days=1)), "end": str(end_day)}
+    return str(start_day), str(page_end), next_range
+
+
+def columnar(records):
+    """get_blood_sugar_by_range 的紀錄轉成 {"t": [...], "v": [...], "m": [...]}"""
+    midnights = {}  # 日期 -> 當天 00:00 的 Unix 秒（台灣沒有日光節約時間，直接加時分）
+    times, values, meals = [], [], []
+    for record in records:
+        midnight = midnights.get(record["date"])
+        if midnight is None:
+            midnight = int(TZ.localize(datetime.strptime(record["date"], "%Y-%m-%d")).timestamp())
+            midnights[record["date"]] = midnight
+        times.append(midnight + int(record["time"][:2]) * 3600 + int(record["time"][3:5]) * 60)
+        values.append(record["value"])
+        meals.append(record.get("meal"))
+    columns = {"t": times, "v": values}
+    if any(meals):
+        columns["m"] = meals
+    return columns
+
+
+def payload(start, end, records, next_range=None):
+    return dict({"start": start, "end": end, "tz": TZ.zone}, **columnar(records), next=next_range)
+
+
+def json_response(data, request):
+    """建立帶 ETag 的 JSON 回應；If-None-Match 相同時回 304，client 接受時用 gzip 壓縮"""
+    body = json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    response = Response(body, mimetype="application/json")
+    # 壓縮前後內容相同，用 weak ETag
+    response.set_etag(hashlib.blake2b(body, digest_size=16).hexdigest(), weak=True)
+    response.headers["Cache-Control"] = "private, no-cache"
+    response.vary.update(("Accept-Encoding", "Authorization"))
+    response = response.make_conditional(request)
+    if response.status_code == 200 and len(body) >= API_GZIP_MIN_BYTES and request.accept_encodings["gzip"]:
+        response.set_data(gzip.compress(body, API_GZIP_LEVEL))
+        response.headers["Content-Encoding"] = "gzip"
+    return response
+
+
+def error_response(message, status):
+    response = jsonify(error=message)
+    response.status_code = status
+    response.headers["Cache-Control"] = "no-store"
+    return response
+
+
+def with_cors(response, request):
+    """來源在 API_CORS_ORIGINS 裡時加上 CORS 標頭（LIFF 頁面帶 Authorization 會先送 OPTIONS）"""
+    origin = request.headers.get("Origin")
+    if origin and (origin in API_CORS_ORIGINS or "*" in API_CORS_ORIGINS):
+        response.headers["Access-Control-Allow-Origin"] = origin
+        response.headers["Access-Control-Allow-Methods"] = "GET, POST, OPTIONS"
+        response.headers["Access-Control-Allow-Headers"] = "Authorization, Content-Type"
+        response.headers["Access-Control-Expose-Headers"] = "ETag, Content-Disposition"
+        response.headers["Access-Control-Max-Age"] = "600"
+        response.vary.add("Origin")
+    return response
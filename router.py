@@ -0,0 +1,124 @@
+import time
+from collections import namedtuple
+from functools import lru_cache
+from urllib.parse import parse_qsl
+
+import metrics
+
+# 文字指令與 postback 動作的路由表：
+#   @router.command("血糖紀錄")          完全相同的文字訊息
+#   @router.state(WAITING_FOR_BLOODSUGAR) 使用者目前的對話狀態
+#   @router.postback("edit_record")       postback data 的 action
+#   @router.pattern("entry", parse)       parse(text) 不是 None 時（依註冊順序嘗試）
+#   @router.default                       都沒有對到時
+# 分派只查一次 dict；每條路由的處理時間記在 metrics 的 dispatch 階段（label 為路由名稱）。
+
+# postback data（例如 "action=edit_record&index=2"）解析後的結果
+# index 沒有或不是數字時為 None；其他參數放在 extra，為 (key, value) 的 tuple
+PostbackData = namedtuple("PostbackData", ["action", "index", "extra"])
+
+
+@lru_cache(maxsize=1024)
+def parse_postback(data):
+    """解析 postback data；同樣的字串只解析一次"""
+    params = dict(parse_qsl(data or ""))
+    action = params.pop("action", None)
+    index = params.pop("index", None)
+    index = int(index) if index is not None and index.isdigit() else None
+    return PostbackData(action, index, tuple(sorted(params.items())))
+
+
+class Route:
+    __slots__ = ("name", "func")
+
+    def __init__(self, name, func):
+        self.name = name
+        self.func = func
+
+    def __call__(self, *args):
+        # handler 裡各階段（查詢、繪圖、回覆）的時間也會記在這條路由底下
+        token = metrics.current_route.set(self.name)
+        start = time.perf_counter()
+        error = False
+        try:
+            return self.func(*args)
+        except Exception:
+            error = True
+            raise
+        finally:
+            metrics.observe("dispatch", time.perf_counter() - start, error, route=self.name)
+            metrics.current_route.reset(token)
+
+
+class Router:
+    def __init__(self):
+        self.commands = {}
+        self.states = {}
+        self.actions = {}
+        self.patterns = []  # [(parse, Route)]
+        self.fallback = None
+
+    def _register(self, table, prefix, keys):
+        def decorator(func):
+            for key in keys:
+                if key in table:
+                    raise ValueError(f"❌ 路由重複註冊：{prefix}:{key}")
+                table[key] = Route(f"{prefix}:{key}", func)
+            return func
+        return decorator
+
+    def command(self, *texts):
+        """handler(event, user_id, text)"""
+        return self._register(self.commands, "command", texts)
+
+    def state(self, *states):
+        """handler(event, user_id, text, state)"""
+        return self._register(self.states, "state", states)
+
+    def postback(self, *actions):
+        """handler(event, user_id, data)，data 為 PostbackData"""
+        return self._register(self.actions, "postback", actions)
+
+    def pattern(self, name, parse):
+        """handler(event, user_id, text, result)，result 為 parse(text) 的回傳值"""
+        def decorator(func):
+            self.patterns.append((parse, Route(f"pattern:{name}", func)))
+            return func
+        return decorator
+
+    def default(self, func):
+        """handler(event, user_id, text)"""
+        self.fallback = Route("default", func)
+        return func
+
+    def dispatch_message(self, event, user_id, text, state=None):
+        route = self.commands.get(text)
+        if route is not None:
+            return route(event, user_id, text)
+        if state is not None:
+            route = self.states.get(state.state)
+            if route is not None:
+                return route(event, user_id, text, state)
+        for parse, route in self.patterns:
+            result = parse(text)
+            if result is not None:
+                return route(event, user_id, text, result)
+        if self.fallback is not None:
+            return self.fallback(event, user_id, text)
+
+    def dispatch_postback(self, event, user_id, data):
+        """回傳 False 表示沒有對應的 action"""
+        postback = parse_postback(data)
+        route = self.actions.get(postback.action)
+        if route is None:
+            return False
+        route(event, user_id, postback)
+        return True
+
+    def routes(self):
+        return (list(self.commands.values()) + list(self.states.values()) + list(self.actions.values()) +
+                [route for _, route in self.patterns] + ([self.fallback] if self.fallback else []))
+
+    def stats(self):
+        dispatch = metrics.registry.stage_stats("dispatch")
+        return {route.name: dispatch.get(route.name, metrics.Histogram().stats()) for route in self.routes()}
@@ -0,0 +1,8 @@
+# 本機啟動：python serve.py（python main.py 也會轉到這裡）
+# 繪圖 pool 用 forkserver／spawn 啟動子 process，子 process 會重新 import 啟動的腳本（__mp_main__）。
+# 這個檔案在 import 時什麼都不做，main.py 的初始化只會在伺服器 process 執行一次。
+
+if __name__ == "__main__":
+    import main
+
+    main.run()
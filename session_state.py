@@ -0,0 +1,125 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from sqlite_local import ThreadLocalConnection
+
+# 使用者對話狀態（例如按了「新增」後等待輸入血糖值）。
+# 狀態有 TTL，放著不管的流程會自動過期；數量有上限，超過時淘汰最久沒動的。
+#   memory：只存在目前的 process
+#   sqlite：存在共用的 SQLite 檔，多個 gunicorn worker 都看得到同一個使用者的狀態
+# 用 SESSION_BACKEND 選擇後端。
+
+SESSION_BACKEND = os.getenv("SESSION_BACKEND", "memory")
+SESSION_DB = os.getenv("SESSION_DB", "sessions.db")
+SESSION_TTL = float(os.getenv("SESSION_TTL", "600"))
+SESSION_MAX_ENTRIES = int(os.getenv("SESSION_MAX_ENTRIES", "10000"))
+
+WAITING_FOR_BLOODSUGAR = "waiting_for_bloodsugar"
+EDITING_BLOODSUGAR = "editing_bloodsugar"
+
+
+class SessionState:
+    __slots__ = ("state", "date", "index", "updated_at")
+
+    def __init__(self, state, date=None, index=None, updated_at=None):
+        self.state = state
+        self.date = date
+        self.index = index
+        self.updated_at = updated_at or time.time()
+
+    def __repr__(self):
+        return f"SessionState({self.state!r}, date={self.date!r}, index={self.index!r})"
+
+
+class MemorySessionStore:
+    def __init__(self, ttl=SESSION_TTL, max_entries=SESSION_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._states = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        with self._lock:
+            state = self._states.get(user_id)
+            if state is None:
+                return None
+            if state.updated_at + self.ttl < time.time():
+                del self._states[user_id]
+                return None
+            return state
+
+    def set(self, user_id, state):
+        with self._lock:
+            self._states[user_id] = state
+            self._states.move_to_end(user_id)
+            while len(self._states) > self.max_entries:
+                self._states.popitem(last=False)
+
+    def clear(self, user_id):
+        with self._lock:
+            self._states.pop(user_id, None)
+
+    def __len__(self):
+        return len(self._states)
+
+
+class SQLiteSessionStore:
+    def __init__(self, path=SESSION_DB, ttl=SESSION_TTL, max_entries=SESSION_MAX_ENTRIES):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._conn = ThreadLocalConnection(path)
+        self._writes = 0
+        self._conn().executescript("""
+            CREATE TABLE IF NOT EXISTS sessions (
+                user_id TEXT PRIMARY KEY,
+                state TEXT NOT NULL,
+                date TEXT,
+                record_index INTEGER,
+                updated_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_sessions_updated_at ON sessions (updated_at);
+        """)
+
+    def get(self, user_id):
+        row = self._conn().execute(
+            "SELECT state, date, record_index, updated_at FROM sessions WHERE user_id = ? AND updated_at >= ?",
+            (user_id, time.time() - self.ttl),
+        ).fetchone()
+        return SessionState(*row) if row else None
+
+    def set(self, user_id, state):
+        conn = self._conn()
+        conn.execute(
+            "INSERT OR REPLACE INTO sessions (user_id, state, date, record_index, updated_at) VALUES (?, ?, ?, ?, ?)",
+            (user_id, state.state, state.date, state.index, state.updated_at),
+        )
+        self._writes += 1
+        if self._writes % 100 == 0:
+            self.prune()
+
+    def clear(self, user_id):
+        self._conn().execute("DELETE FROM sessions WHERE user_id = ?", (user_id,))
+
+    def prune(self):
+        """刪除過期的狀態，數量仍超過上限時刪除最久沒更新的"""
+        conn = self._conn()
+        conn.execute("DELETE FROM sessions WHERE updated_at < ?", (time.time() - self.ttl,))
+        conn.execute(
+            "DELETE FROM sessions WHERE user_id IN "
+            "(SELECT user_id FROM sessions ORDER BY updated_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,),
+        )
+
+    def __len__(self):
+        return self._conn().execute("SELECT count(*) FROM sessions").fetchone()[0]
+
+
+def get_session_store():
+    if SESSION_BACKEND == "sqlite":
+        return SQLiteSessionStore()
+    if SESSION_BACKEND != "memory":
+        raise ValueError(f"❌ 未知的 SESSION_BACKEND：{SESSION_BACKEND}")
+    return MemorySessionStore()
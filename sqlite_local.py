@@ -0,0 +1,27 @@
+import os
+import sqlite3
+import threading
+
+# 多個 worker process 共用的小型 SQLite 檔（對話狀態、事件去重、匯入進度、快取版本）的連線：
+# 每個執行緒一條 autocommit 連線，WAL 模式讓讀寫不互相卡住；fork 後的 process 要重新連線。
+
+
+class ThreadLocalConnection:
+    """呼叫時回傳目前執行緒的連線；schema 在每條新連線建立時執行（CREATE ... IF NOT EXISTS）"""
+
+    def __init__(self, path, schema=None):
+        self.path = path
+        self.schema = schema
+        self._local = threading.local()
+
+    def __call__(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            if self.schema:
+                conn.executescript(self.schema)
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
@@ -0,0 +1,92 @@
+import logging
+import os
+import threading
+import time
+
+# 啟動檢查：import 時不連線、不做任何耗時的事，等伺服器開始接受連線後才在背景執行檢查
+# （LINE API 連線、儲存後端、預先啟動繪圖 process 等），結果由 /health/ready 回報。
+#   required=True 的檢查沒通過前，/health/ready 回 503
+#   失敗的檢查每隔 STARTUP_CHECK_RETRY 秒重試，直到全部通過
+# STARTUP_CHECKS=0 可以關閉檢查（/health/ready 直接視為就緒）。
+
+STARTUP_CHECKS = os.getenv("STARTUP_CHECKS", "1") == "1"
+STARTUP_CHECK_RETRY = float(os.getenv("STARTUP_CHECK_RETRY", "30"))
+
+logger = logging.getLogger(__name__)
+
+
+class StartupChecks:
+    def __init__(self, enabled=STARTUP_CHECKS, retry_interval=STARTUP_CHECK_RETRY):
+        self.enabled = enabled
+        self.retry_interval = retry_interval
+        self._checks = {}  # name -> (func, required)，依註冊順序執行
+        self.results = {}
+        self.started_at = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def register(self, name, required=True):
+        def decorator(func):
+            self._checks[name] = (func, required)
+            return func
+        return decorator
+
+    def start(self):
+        """在背景執行檢查；每個 process 只會啟動一次，可以重複呼叫"""
+        if not self.enabled or self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self.results = {}
+            self.started_at = time.time()
+        threading.Thread(target=self._run, name="startup-checks", daemon=True).start()
+
+    def _run(self):
+        while True:
+            for name, (func, required) in self._checks.items():
+                if not self.results.get(name, {}).get("ok"):
+                    self._run_check(name, func, required)
+            if all(result["ok"] for result in self.results.values()):
+                logger.info("Startup checks passed in %.2fs", time.time() - self.started_at)
+                return
+            time.sleep(self.retry_interval)
+
+    def _run_check(self, name, func, required):
+        start = time.perf_counter()
+        try:
+            detail = func()
+            ok = True
+        except Exception as e:
+            detail = f"{type(e).__name__}: {str(e)}"
+            ok = False
+            logger.error("Startup check %r failed: %s", name, detail)
+        self.results[name] = {
+            "ok": ok,
+            "required": required,
+            "detail": detail,
+            "duration_ms": round((time.perf_counter() - start) * 1000, 1),
+            "checked_at": time.time(),
+        }
+
+    def ready(self):
+        if not self.enabled:
+            return True
+        return all(
+            self.results.get(name, {}).get("ok") for name, (_, required) in self._checks.items() if required
+        )
+
+    def report(self):
+        return {
+            "ready": self.ready(),
+            "enabled": self.enabled,
+            "started_at": self.started_at,
+            "checks": {
+                name: self.results.get(name, {"ok": None, "required": required, "detail": "pending"})
+                for name, (_, required) in self._checks.items()
+            },
+        }
+
+
+checks = StartupChecks()
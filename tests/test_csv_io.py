@@ -0,0 +1,120 @@
+import io
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import blood_sugar_cache  # noqa: E402
+import blood_sugar_store  # noqa: E402
+import csv_io  # noqa: E402
+from csv_io import RawRow, import_csv, normalize_datetime, read_rows, validate  # noqa: E402
+
+NOW = np.datetime64("2024-06-01T00:00:00", "s")
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("2024-01-02 07:05", "2024-01-02 07:05:00"),
+    ("2024/1/2 7:05:09", "2024-01-02 07:05:09"),
+    ("2024-01-02", "2024-01-02 00:00:00"),
+    ("01/02/2024 7:05 PM", "2024-01-02 19:05:00"),
+    ("01/02/2024 7:05 pm", "2024-01-02 19:05:00"),
+    ("01/02/2024 7:05 p.m.", "2024-01-02 19:05:00"),
+    ("01/02/2024 12:30 AM", "2024-01-02 00:30:00"),
+    ("01/02/2024 12:30 PM", "2024-01-02 12:30:00"),
+    ("2024/1/2 下午 07:05:00", "2024-01-02 19:05:00"),
+    ("2024/1/2 上午 12:10", "2024-01-02 00:10:00"),
+    ("2024/1/2 上午 9:10", "2024-01-02 09:10:00"),
+    ("01/02/2024 13:05 PM", None),
+    ("not a date", None),
+])
+def test_normalize_datetime(text, expected):
+    assert normalize_datetime(text) == expected
+
+
+def test_normalize_datetime_day_first():
+    assert normalize_datetime("02/01/2024 08:00", day_first=True) == "2024-01-02 08:00:00"
+    assert normalize_datetime("02/01/2024 08:00") == "2024-02-01 08:00:00"
+    # 年份在前的日期不受 day_first 影響
+    assert normalize_datetime("2024-01-02 08:00", day_first=True) == "2024-01-02 08:00:00"
+
+
+def test_read_rows_finds_header_after_preamble():
+    lines = [
+        "Glucose Meter Export",
+        "Serial Number,ABC123",
+        "",
+        "Device Timestamp,Historic Glucose mg/dL,Notes",
+        "01/02/2024 7:05 PM,135,after dinner",
+        ",,",
+        "01/03/2024 8:00 AM,98,",
+    ]
+    rows = list(read_rows(lines))
+    assert [(row.line, row.recorded_at, row.value, row.meal) for row in rows] == [
+        (5, "2024-01-02 19:05:00", "135", "after dinner"),
+        (7, "2024-01-03 08:00:00", "98", None),
+    ]
+
+
+def test_read_rows_separate_date_and_time_columns():
+    rows = list(read_rows(["日期,時間,血糖值,備註", "2024/1/2,下午 07:05,135,晚餐後"]))
+    assert rows == [RawRow(2, "2024-01-02 19:05:00", "135", "晚餐後", False)]
+
+
+def test_read_rows_without_glucose_column():
+    with pytest.raises(ValueError):
+        list(read_rows(["date,time,steps", "2024-01-02,08:00,1000"]))
+
+
+def test_validate_converts_mmol():
+    batch = [
+        RawRow(2, "2024-01-02 08:00:00", "", None, False),
+        RawRow(3, "2024-01-02 09:00:00", "7.5", None, True),
+        RawRow(4, "2024-01-02 10:00:00", "120", None, False),
+    ]
+    rows, errors = validate(batch, NOW)
+    assert rows == [("2024-01-02 09:00:00", 135, None), ("2024-01-02 10:00:00", 120, None)]
+    assert errors == [(2, "缺少血糖值")]
+    # unit="mmol" 時數值欄位也當成 mmol/L
+    rows, _ = validate([RawRow(2, "2024-01-02 08:00:00", "5.5", None, False)], NOW, unit="mmol")
+    assert rows == [("2024-01-02 08:00:00", 99, None)]
+
+
+def test_validate_reports_reasons():
+    batch = [
+        RawRow(2, None, "120", None, False),
+        RawRow(3, "2024-02-30 08:00:00", "120", None, False),
+        RawRow(4, "2030-01-01 08:00:00", "120", None, False),
+        RawRow(5, "2024-01-02 08:00:00", "abc", None, False),
+        RawRow(6, "2024-01-02 08:00:00", "900", None, False),
+    ]
+    rows, errors = validate(batch, NOW)
+    assert rows == []
+    assert [reason for _, reason in errors] == [
+        "時間格式錯誤", "時間格式錯誤", "時間晚於現在", "血糖值不是數字",
+        f"血糖值超出範圍（{csv_io.MIN_VALUE}～{csv_io.MAX_VALUE} mg/dL）",
+    ]
+
+
+@pytest.fixture
+def sqlite_store(tmp_path, monkeypatch):
+    monkeypatch.setattr(blood_sugar_cache, "store", blood_sugar_store.SQLiteStore(str(tmp_path / "blood_sugar.db")))
+    monkeypatch.setattr(blood_sugar_cache, "versions", blood_sugar_cache.UserVersions(str(tmp_path / "versions.db")))
+    return blood_sugar_cache.store
+
+
+def test_import_skips_duplicates(sqlite_store):
+    data = ("\ufeffdate,time,glucose,meal\r\n"
+            "01/02/2024,7:05 PM,135,晚餐後\r\n"
+            "01/03/2024,12:30 AM,98,\r\n"
+            "01/03/2024,8:00 AM,abc,\r\n").encode("utf-8")
+    stats = import_csv(io.BytesIO(data), "U1", batch_size=2)
+    assert (stats["rows"], stats["inserted"], stats["duplicates"], stats["invalid"]) == (3, 2, 0, 1)
+    assert stats["error"] is None
+
+    stats = import_csv(io.BytesIO(data), "U1")
+    assert (stats["inserted"], stats["duplicates"]) == (0, 2)
+    assert sqlite_store.get_by_date("U1", "2024-01-02") == [{"time": "19:05", "value": 135, "meal": "晚餐後"}]
+    assert sqlite_store.get_by_date("U1", "2024-01-03") == [{"time": "00:30", "value": 98}]
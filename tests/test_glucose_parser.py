@@ -0,0 +1,100 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from glucose_parser import GlucoseEntry, chinese_to_int, parse_entry  # noqa: E402
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("135", 135),
+    ("一百二十五", 125),
+    ("一百二", 120),
+    ("一百零二", 102),
+    ("兩百", 200),
+    ("一二五", 125),
+    ("九十八", 98),
+    ("十五", 15),
+    ("十", 10),
+    ("百一二", None),
+    ("一十百", None),
+    ("好", None),
+])
+def test_chinese_to_int(text, expected):
+    assert chinese_to_int(text) == expected
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("早餐後 135", GlucoseEntry(135, "早餐後", None)),
+    ("血糖一百二", GlucoseEntry(120, None, None)),
+    ("空腹 98", GlucoseEntry(98, "空腹", None)),
+    ("晚餐后一百六", GlucoseEntry(160, "晚餐後", None)),
+    ("飯後兩小時 180", GlucoseEntry(180, "餐後", None)),
+    ("7:30 空腹 98 mg/dL", GlucoseEntry(98, "空腹", "07:30")),
+    ("１２：３０ 午餐後 １４５", GlucoseEntry(145, "午餐後", "12:30")),
+    ("晚上八點半 飯後 兩百", GlucoseEntry(200, "餐後", "20:30")),
+    ("下午三點十五分 血糖 180", GlucoseEntry(180, None, "15:15")),
+    ("凌晨兩點 血糖 65", GlucoseEntry(65, None, "02:00")),
+    ("今天早餐後血糖是一百五十", GlucoseEntry(150, "早餐後", None)),
+])
+def test_parse_entry(text, expected):
+    assert parse_entry(text) == expected
+
+
+@pytest.mark.parametrize("text, expected", [
+    # 時間後面隔著空白的數字是血糖值，不是分鐘
+    ("早上8點 135", GlucoseEntry(135, None, "08:00")),
+    ("8點 135", GlucoseEntry(135, None, "08:00")),
+    ("8點135", GlucoseEntry(135, None, "08:00")),
+    ("十點 一百二", GlucoseEntry(120, None, "10:00")),
+    ("晚上八點 一百五", GlucoseEntry(150, None, "20:00")),
+    ("八點一百五", GlucoseEntry(150, None, "08:00")),
+    # 緊接在「點」後面，或後面有「分」才是分鐘
+    ("早上8點30 135", GlucoseEntry(135, None, "08:30")),
+    ("晚上八點十五 一百二", GlucoseEntry(120, None, "20:15")),
+    ("8點 5分 血糖 120", GlucoseEntry(120, None, "08:05")),
+])
+def test_parse_entry_time_followed_by_value(text, expected):
+    assert parse_entry(text) == expected
+
+
+@pytest.mark.parametrize("text", [
+    "晚餐後散步 30 分鐘",
+    "午餐後走了 45 分鐘",
+    "早餐後走了 8000 步",
+    "睡前吃藥 2 顆",
+    "早上量體重 65 公斤",
+    "我下午3點吃藥 血壓 130",
+    "空腹 心跳 72",
+    "睡前打 20 單位",
+    "睡前打 20U",
+    "晚餐前 吃 30 單位胰島素",
+    "午餐吃了 150 克飯 餐後",
+    "早餐吃了 2 片吐司 血糖",
+    "晚餐後喝了 250 ml 牛奶",
+    "午餐後 一碗飯 500 大卡",
+])
+def test_parse_entry_rejects_other_measurements(text):
+    assert parse_entry(text) is None
+
+
+@pytest.mark.parametrize("text", [
+    "135",
+    "血糖紀錄",
+    "三點要回診",
+    "明天早上八點抽血",
+    "血糖高一點怎麼辦",
+    "早餐後 135 還是 140",
+    "早餐後 15",
+    "早餐後 700",
+])
+def test_parse_entry_not_a_reading(text):
+    assert parse_entry(text) is None
+
+
+def test_parse_entry_bare_number_without_cue():
+    assert parse_entry("135", require_cue=False) == GlucoseEntry(135, None, None)
+    assert parse_entry("一百二", require_cue=False) == GlucoseEntry(120, None, None)
+    assert parse_entry("15", require_cue=False) is None
@@ -0,0 +1,66 @@
+import base64
+import hashlib
+import hmac
+import json
+
+from linebot.exceptions import InvalidSignatureError
+from linebot.models import (
+    AccountLinkEvent, BeaconEvent, FollowEvent, JoinEvent, LeaveEvent, MemberJoinedEvent, MemberLeftEvent,
+    MessageEvent, PostbackEvent, ThingsEvent, UnfollowEvent, UnknownEvent, UnsendEvent, VideoPlayCompleteEvent,
+)
+
+# webhook 的簽名驗證與解析，一次完成：
+#   - 直接對原始的 request bytes 計算 HMAC-SHA256，不先轉成字串再編碼回來
+#   - 用 hmac.compare_digest 比對，比對時間不會洩漏簽名有幾個字元相同
+#   - JSON 只解析一次，依事件種類查表建立 linebot 的事件物件
+# 取代「手動驗證一次 + WebhookHandler 再驗證、解析一次」的做法。
+
+EVENT_TYPES = {
+    "message": MessageEvent,
+    "postback": PostbackEvent,
+    "follow": FollowEvent,
+    "unfollow": UnfollowEvent,
+    "join": JoinEvent,
+    "leave": LeaveEvent,
+    "memberJoined": MemberJoinedEvent,
+    "memberLeft": MemberLeftEvent,
+    "beacon": BeaconEvent,
+    "accountLink": AccountLinkEvent,
+    "things": ThingsEvent,
+    "unsend": UnsendEvent,
+    "videoPlayComplete": VideoPlayCompleteEvent,
+}
+
+
+class InvalidPayloadError(ValueError):
+    pass
+
+
+class WebhookParser:
+    def __init__(self, channel_secret):
+        self.key = channel_secret.encode("utf-8")
+
+    def signature_of(self, body):
+        return base64.b64encode(hmac.new(self.key, body, hashlib.sha256).digest())
+
+    def verify(self, body, signature):
+        """body 為原始 bytes，signature 為 X-Line-Signature 標頭"""
+        return hmac.compare_digest(self.signature_of(body), signature.encode("utf-8"))
+
+    def parse(self, body, signature):
+        """驗證簽名並回傳事件列表
+
+        簽名不符時拋出 InvalidSignatureError，內容不是合法的 webhook JSON 時拋出 InvalidPayloadError。
+        """
+        if not self.verify(body, signature):
+            raise InvalidSignatureError("Invalid signature")
+        return self.parse_events(body)
+
+    def parse_events(self, body):
+        """解析已經驗證過簽名的 body"""
+        try:
+            payload = json.loads(body)
+            return [EVENT_TYPES.get(event["type"], UnknownEvent).new_from_json_dict(event)
+                    for event in payload.get("events", [])]
+        except (ValueError, TypeError, KeyError, AttributeError) as e:
+            raise InvalidPayloadError(f"Invalid webhook payload: {str(e)}")
@@ -0,0 +1,191 @@
+import contextvars
+import logging
+import os
+import queue
+import threading
+import time
+import zlib
+
+# 背景處理 webhook 事件：/callback 只負責驗證簽名與排入佇列，
+# 實際的查詢、畫圖、回覆訊息都交給 worker 執行緒處理。
+# 事件依使用者分片：同一個使用者的事件永遠進同一個 worker，確保依序執行
+# （user_states 的「新增→輸入數值」流程需要順序），不同使用者則可平行處理。
+
+_STOP = object()
+
+logger = logging.getLogger(__name__)
+
+
+def shard_key(event):
+    source = getattr(event, "source", None)
+    return (getattr(source, "user_id", None)
+            or getattr(source, "group_id", None)
+            or getattr(source, "room_id", None)
+            or "")
+
+
+class _Batch:
+    # 讓呼叫端可以等待同一個 webhook 裡的事件全部處理完
+    def __init__(self, size):
+        self.remaining = size
+        self.lock = threading.Lock()
+        self.done = threading.Event()
+        if size == 0:
+            self.done.set()
+
+    def finish_one(self):
+        with self.lock:
+            self.remaining -= 1
+            if self.remaining <= 0:
+                self.done.set()
+
+
+class _Shard:
+    def __init__(self, max_queue_size):
+        self.events = queue.Queue(maxsize=max_queue_size)
+        # 處理事件時持有，佇列滿時在請求執行緒處理的事件不會和 worker 同時改同一個使用者的狀態
+        self.running = threading.Lock()
+        self.processed = 0
+        self.last_lag = 0.0
+
+    def wait_idle(self, timeout):
+        """等佇列中的事件全部處理完，逾時回傳 False"""
+        deadline = time.monotonic() + timeout
+        with self.events.all_tasks_done:
+            while self.events.unfinished_tasks:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self.events.all_tasks_done.wait(remaining)
+        return True
+
+    def oldest_wait(self):
+        # 佇列最前面的事件已經等了多久
+        with self.events.mutex:
+            head = self.events.queue[0] if self.events.queue else None
+        if head is None or head is _STOP:
+            return 0.0
+        return time.monotonic() - head[1]
+
+
+class WebhookWorkerPool:
+    def __init__(self, handle_event, num_workers=4, max_queue_size=1000, put_timeout=5, drain_timeout=30):
+        self.handle_event = handle_event
+        self.num_workers = num_workers
+        self.put_timeout = put_timeout
+        self.drain_timeout = drain_timeout
+        # 每個 worker 有自己的佇列，總容量與單一佇列相同
+        shard_size = max(1, max_queue_size // num_workers)
+        self.shards = [_Shard(shard_size) for _ in range(num_workers)]
+        self._threads = []
+        self._pid = None
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def start(self):
+        # gunicorn fork 之後執行緒不會跟著複製，所以用 pid 判斷是否需要重新啟動
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._threads = []
+            for i, shard in enumerate(self.shards):
+                thread = threading.Thread(target=self._run, args=(shard,), name=f"webhook-worker-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+            logger.info("Started %d webhook workers", self.num_workers)
+
+    def shard_for(self, event):
+        # crc32 在不同 process 間結果一致（hash() 每次啟動都不同）
+        return self.shards[zlib.crc32(shard_key(event).encode("utf-8")) % self.num_workers]
+
+    def submit(self, events, wait=False, timeout=None):
+        """把事件依使用者排入佇列；已關閉時回傳全部事件（由呼叫端自行處理）
+
+        某個分片的佇列滿了時，等那個分片消化完之前的事件，再直接在呼叫端的執行緒處理，
+        同一個使用者的事件仍然依序執行。wait=True 時會等到已排入的事件全部處理完才返回。
+        """
+        if self._closed:
+            return list(events)
+        self.start()
+        batch = _Batch(len(events))
+        for event in events:
+            shard = self.shard_for(event)
+            # 複製目前的 context，worker 裡的日誌會帶著這個請求的 request_id
+            item = (event, time.monotonic(), batch, contextvars.copy_context())
+            try:
+                # 佇列滿了先稍等一下，讓 worker 消化
+                shard.events.put(item, timeout=self.put_timeout)
+            except queue.Full:
+                self._handle_inline(shard, item)
+        if wait and not batch.done.wait(timeout):
+            logger.warning("Webhook batch not finished within %ss", timeout)
+        return []
+
+    def _handle_inline(self, shard, item):
+        event, _, batch, context = item
+        logger.warning("Webhook queue full, handling event inline")
+        if not shard.wait_idle(self.drain_timeout):
+            logger.error("Webhook shard did not drain within %ss, events may run out of order", self.drain_timeout)
+        try:
+            with shard.running:
+                context.run(self.handle_event, event)
+        except Exception as e:
+            logger.exception("Error while handling webhook event: %s", e)
+        finally:
+            shard.processed += 1
+            batch.finish_one()
+
+    def _run(self, shard):
+        while True:
+            item = shard.events.get()
+            try:
+                if item is _STOP:
+                    return
+                event, queued_at, batch, context = item
+                shard.last_lag = time.monotonic() - queued_at
+                if shard.last_lag > 1:
+                    logger.warning("Event waited %.2fs in webhook queue", shard.last_lag)
+                try:
+                    with shard.running:
+                        context.run(self.handle_event, event)
+                finally:
+                    shard.processed += 1
+                    batch.finish_one()
+            except Exception as e:
+                logger.exception("Error while handling webhook event: %s", e)
+            finally:
+                shard.events.task_done()
+
+    def queue_depth(self):
+        return sum(shard.events.qsize() for shard in self.shards)
+
+    def stats(self):
+        """目前佇列深度與各分片的延遲（秒）"""
+        return {
+            "queue_depth": self.queue_depth(),
+            "shards": [
+                {
+                    "depth": shard.events.qsize(),
+                    "oldest_wait": round(shard.oldest_wait(), 3),
+                    "last_lag": round(shard.last_lag, 3),
+                    "processed": shard.processed,
+                }
+                for shard in self.shards
+            ],
+        }
+
+    def shutdown(self, timeout=30):
+        """停止接收新事件，等佇列中的事件處理完再結束 worker"""
+        self._closed = True
+        if self._pid != os.getpid():
+            return
+        logger.info("Draining webhook queue (%d events left)", self.queue_depth())
+        for shard in self.shards:
+            shard.events.put(_STOP)
+        deadline = time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(max(0, deadline - time.monotonic()))
+        alive = sum(thread.is_alive() for thread in self._threads)
+        if alive:
+            logger.error("%d webhook workers did not stop within %ss", alive, timeout)